@@ -0,0 +1,141 @@
+"""Length-bucketed batching for SFT and ORPO training.
+
+Random batches mix one-line answers with multi-paragraph ORPO texts, so
+most of every batch is padding. ``BucketBatchSampler`` shuffles samples,
+sorts them by length inside large buckets and cuts batches from the
+sorted runs, so each batch holds samples of similar length. Batch order
+is shuffled again, so training still sees lengths in random order.
+
+Two modes:
+
+* ``batch_size=N`` - fixed batch size, like ``per_device_train_batch_size``;
+* ``max_tokens=T`` - dynamic batch size: as many samples as fit in
+  ``T`` padded tokens (longest sample x batch size), so short samples go
+  in big batches and long ones in small batches.
+
+The sampler only needs sample lengths and has no torch dependency. Pass
+it to a DataLoader as ``batch_sampler``, or use ``bucketed(TrainerClass)``
+to plug it into a transformers/TRL trainer.
+"""
+import random
+
+
+class BucketBatchSampler:
+
+    def __init__(self, lengths, batch_size=None, max_tokens=None, bucket_size=None, shuffle=True,
+                 drop_last=False, seed=42):
+        if (batch_size is None) == (max_tokens is None):
+            raise ValueError("Pass exactly one of batch_size or max_tokens")
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        # Default: buckets of ~50 batches, a few hundred samples for token budgets
+        self.bucket_size = bucket_size or (batch_size * 50 if batch_size else 512)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def batches(self):
+        """Index batches for the current epoch"""
+        rng = random.Random(self.seed + self.epoch)
+        indexes = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indexes)
+
+        batches = []
+        for start in range(0, len(indexes), self.bucket_size):
+            bucket = sorted(indexes[start:start + self.bucket_size], key=lambda i: self.lengths[i])
+            batches.extend(self._split(bucket))
+
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def _split(self, bucket):
+        if self.batch_size:
+            batches = [bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size)]
+            if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+                batches.pop()
+            return batches
+
+        batches, batch, longest = [], [], 0
+        for i in bucket:
+            length = self.lengths[i]
+            if batch and max(longest, length) * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch, longest = [], 0
+            batch.append(i)
+            longest = max(longest, length)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        return len(self.batches())
+
+
+def random_batches(lengths, batch_size, seed=42):
+    """Plain shuffled fixed-size batches, as the trainers use by default"""
+    indexes = list(range(len(lengths)))
+    random.Random(seed).shuffle(indexes)
+    return [indexes[i:i + batch_size] for i in range(0, len(indexes), batch_size)]
+
+
+def padding_stats(lengths, batches):
+    """Real vs padded token counts for a list of index batches"""
+    real = sum(lengths[i] for batch in batches for i in batch)
+    padded = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    return {
+        'batches': len(batches),
+        'real_tokens': real,
+        'padded_tokens': padded,
+        'efficiency': round(real / max(1, padded), 3),
+    }
+
+
+def column_lengths(dataset, columns):
+    """Per-row max length over token-id columns of a tokenized dataset.
+
+    ORPOTrainer tokenizes its dataset on init; after that
+    ``column_lengths(trainer.train_dataset, ['chosen_input_ids', 'rejected_input_ids'])``
+    gives the lengths its collator pads to.
+    """
+    return [max(len(row[column]) for column in columns) for row in dataset]
+
+
+def bucketed(trainer_cls):
+    """Subclass of a transformers/TRL trainer that batches with ``batch_sampler``.
+
+    Set ``trainer.batch_sampler`` (a BucketBatchSampler over the train
+    dataset) before ``trainer.train()``. With ``max_tokens`` the number of
+    samples per step varies; losses are still averaged per token.
+    """
+
+    class BucketedTrainer(trainer_cls):
+        batch_sampler = None
+
+        def get_train_dataloader(self):
+            if self.batch_sampler is None:
+                return super().get_train_dataloader()
+            from torch.utils.data import DataLoader
+            dataset = self.train_dataset
+            if hasattr(self, '_remove_unused_columns'):
+                dataset = self._remove_unused_columns(dataset, description="training")
+            loader = DataLoader(
+                dataset,
+                batch_sampler=self.batch_sampler,
+                collate_fn=self.data_collator,
+                num_workers=self.args.dataloader_num_workers,
+                pin_memory=self.args.dataloader_pin_memory,
+            )
+            return self.accelerator.prepare(loader)
+
+    BucketedTrainer.__name__ = f"Bucketed{trainer_cls.__name__}"
+    return BucketedTrainer
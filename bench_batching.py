@@ -0,0 +1,89 @@
+"""Training throughput with random vs length-bucketed batches.
+
+Runs forward + backward passes over the ORPO chosen sequences (prompt +
+chosen answer, capped at 1024 tokens like the notebook's ``max_length``)
+for three batching setups and reports real (non-padding) tokens/sec:
+
+    random    shuffled batches of 2 (current per_device_train_batch_size)
+    bucketed  BucketBatchSampler(batch_size=2)
+    budget    BucketBatchSampler(max_tokens=2 * 1024)
+
+Works on CPU; point BENCH_MODEL at a small checkpoint for a quick run.
+"""
+import os
+import time
+
+import torch
+from transformers import AutoModelForCausalLM
+
+from batching import BucketBatchSampler, padding_stats, random_batches
+from convert_format import read_dataset
+from pack_dataset import chat_ids, load_tokenizer
+
+BENCH_MODEL = os.getenv("BENCH_MODEL", "unsloth/Qwen2.5-3B-bnb-4bit")
+BENCH_SAMPLES = int(os.getenv("BENCH_SAMPLES", "128"))
+MAX_LENGTH = 1024
+BATCH_SIZE = 2
+
+
+def load_sequences(tokenizer, path='orpo_dataset_pairs.jsonl', limit=BENCH_SAMPLES):
+    sequences = []
+    for row in read_dataset(path):
+        sequences.append(chat_ids(tokenizer, row['prompt'] + row['chosen'])[:MAX_LENGTH])
+        if len(sequences) >= limit:
+            break
+    return sequences
+
+
+def run_epoch(model, sequences, batches, pad_token_id):
+    """Seconds for one pass of forward + backward over ``batches``"""
+    model.train()
+    started = time.monotonic()
+    for batch in batches:
+        length = max(len(sequences[i]) for i in batch)
+        input_ids = torch.full((len(batch), length), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+        for row, i in enumerate(batch):
+            input_ids[row, :len(sequences[i])] = torch.tensor(sequences[i])
+            attention_mask[row, :len(sequences[i])] = 1
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        loss = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels).loss
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+    return time.monotonic() - started
+
+
+def main():
+    tokenizer = load_tokenizer(BENCH_MODEL)
+    model = AutoModelForCausalLM.from_pretrained(BENCH_MODEL)
+    sequences = load_sequences(tokenizer)
+    lengths = [len(s) for s in sequences]
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+    setups = {
+        'random': random_batches(lengths, BATCH_SIZE),
+        'bucketed': BucketBatchSampler(lengths, batch_size=BATCH_SIZE).batches(),
+        'budget': BucketBatchSampler(lengths, max_tokens=BATCH_SIZE * MAX_LENGTH).batches(),
+    }
+
+    # Warm-up so the first setup does not pay for lazy initialisation
+    run_epoch(model, sequences, setups['random'][:2], pad_token_id)
+
+    results = {}
+    for name, batches in setups.items():
+        stats = padding_stats(lengths, batches)
+        seconds = run_epoch(model, sequences, batches, pad_token_id)
+        results[name] = (stats, seconds)
+
+    print("\n" + "=" * 60)
+    print(f"BATCHING BENCHMARK ({len(sequences)} sequences, {BENCH_MODEL})")
+    print("=" * 60)
+    base = results['random'][0]['real_tokens'] / results['random'][1]
+    for name, (stats, seconds) in results.items():
+        rate = stats['real_tokens'] / seconds
+        print(f"  {name:<9} {stats['batches']:>4} batches  padding eff. {stats['efficiency']:.0%}  "
+              f"{rate:8.0f} tok/s  x{rate / base:.2f}")
+
+
+if __name__ == '__main__':
+    main()
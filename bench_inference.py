@@ -0,0 +1,60 @@
+"""Time-to-first-token and CPU time per query, with and without PrefixCache.
+
+Each question is answered on its own (batch of 1), as in an interactive
+chat. ``max_new_tokens=1`` isolates prefill, i.e. time to first token;
+the second pass generates full answers. Works on CPU; point BENCH_MODEL
+at a small checkpoint for a quick run.
+"""
+import os
+import time
+
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from inference import PrefixCache, generate_answers
+
+BENCH_MODEL = os.getenv("BENCH_MODEL", "rsyrlybay/qwen2.5-3b-sxodim-almaty")
+BENCH_NEW_TOKENS = int(os.getenv("BENCH_NEW_TOKENS", "64"))
+
+QUESTIONS = [
+    "Куда можно сходить в Алматы на выходных?",
+    "Где послушать джаз в Алматы?",
+    "Сколько стоят билеты на стендап в Punch?",
+    "Что такое киноужин от VkusKino?",
+    "Куда сходить с детьми в Алматы?",
+    "Какие спектакли идут в Алматы?",
+]
+
+
+def timed(model, tokenizer, prefix_cache, max_new_tokens):
+    """(wall seconds, CPU seconds, answers) over QUESTIONS one at a time"""
+    wall, cpu = time.perf_counter(), time.process_time()
+    answers = [generate_answers(model, tokenizer, [q], batch_size=1, prefix_cache=prefix_cache,
+                                max_new_tokens=max_new_tokens, do_sample=False)[0] for q in QUESTIONS]
+    return time.perf_counter() - wall, time.process_time() - cpu, answers
+
+
+def main():
+    tokenizer = AutoTokenizer.from_pretrained(BENCH_MODEL)
+    model = AutoModelForCausalLM.from_pretrained(BENCH_MODEL).eval()
+
+    started = time.perf_counter()
+    cache = PrefixCache(model, tokenizer)
+    build_time = time.perf_counter() - started
+
+    timed(model, tokenizer, None, 1)  # Warm-up
+
+    print("\n" + "=" * 60)
+    print(f"PREFIX CACHE BENCHMARK ({BENCH_MODEL})")
+    print("=" * 60)
+    print(f"Cached prefix: {len(cache.prefix_ids)} tokens, built in {build_time:.2f}s")
+    for label, new_tokens in (("first token", 1), (f"{BENCH_NEW_TOKENS} tokens", BENCH_NEW_TOKENS)):
+        plain_wall, plain_cpu, plain = timed(model, tokenizer, None, new_tokens)
+        cached_wall, cached_cpu, cached = timed(model, tokenizer, cache, new_tokens)
+        n = len(QUESTIONS)
+        print(f"  {label:<12} plain {plain_wall / n * 1000:7.1f} ms/query (cpu {plain_cpu / n * 1000:7.1f})  "
+              f"cached {cached_wall / n * 1000:7.1f} ms/query (cpu {cached_cpu / n * 1000:7.1f})  "
+              f"same output: {plain == cached}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Offline benchmark of the data stages: scrape, SFT and ORPO generation, conversion.
+
+Every stage runs as its own process, in a scratch directory, against the
+local stubs (stubs.py) instead of sxodim.com, r.jina.ai and OpenRouter,
+on a synthetic listing of BENCH_EVENTS events:
+
+    python bench_pipeline.py
+    BENCH_EVENTS=10000,100000 BENCH_ERROR_RATE=0.01 python bench_pipeline.py
+
+Per stage it reports wall time, events/sec, requests to the stubs (and
+the 503s they injected), peak and mean requests in flight, peak RSS of
+the stage process and retries from the stage's metrics report. Results
+are appended to BENCH_OUTPUT with the settings, and each run is compared
+with the previous run of the same settings, so regressions show up as
+numbers.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from stubs import CHAT_PATH, LISTING_PATH, READER_PATH, reset_counters, start_stub_server
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+EVENT_COUNTS = [int(n) for n in os.getenv("BENCH_EVENTS", "10000").split(',')]
+LATENCY = float(os.getenv("BENCH_LATENCY", "0.02"))             # Listing and reader, seconds
+CHAT_LATENCY = float(os.getenv("BENCH_CHAT_LATENCY", "0.2"))    # Chat endpoint, seconds
+ERROR_RATE = float(os.getenv("BENCH_ERROR_RATE", "0"))          # Share of requests answered with 503
+RATE = os.getenv("BENCH_RPS", "1000")                           # Per-endpoint limit during the benchmark
+CONCURRENCY = os.getenv("BENCH_CONCURRENCY", "32")              # Scrape and generation requests in flight
+BATCH_EVENTS = os.getenv("BENCH_BATCH_EVENTS", "5")             # GENERATION_BATCH_EVENTS
+PER_PAGE = int(os.getenv("BENCH_PER_PAGE", "15"))
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT", "bench_pipeline.jsonl")
+
+STAGES = [
+    ('scrape', ['scrape_sxodim.py']),
+    ('sft', ['generate_sft.py']),
+    ('orpo', ['generate_orpo_dataset.py']),
+    ('convert_chat', ['convert_format.py', '--format', 'chat']),
+    ('convert_orpo', ['convert_format.py', '--format', 'orpo']),
+]
+
+
+def stage_env(base_url, directory):
+    env = dict(os.environ)
+    env.update(
+        SXODIM_API_URL=base_url + LISTING_PATH,
+        JINA_READER_URL=base_url + READER_PATH.rstrip('/'),
+        OPENROUTER_BASE_URL=base_url + CHAT_PATH[:-len('/chat/completions')],
+        OPENROUTER_API_KEY='stub',
+        JINA_API_KEY='stub',
+        SXODIM_RPS=RATE,
+        JINA_RPS=RATE,
+        OPENROUTER_RPS=RATE,
+        SCRAPE_CONCURRENCY=CONCURRENCY,
+        GENERATION_CONCURRENCY=CONCURRENCY,
+        GENERATION_BATCH_EVENTS=BATCH_EVENTS,
+        EVENT_STORE_PATH=os.path.join(directory, 'sxodim.db'),
+        LLM_CACHE_DIR=os.path.join(directory, '.llm_cache'),
+        METRICS_DIR=os.path.join(directory, 'metrics'),
+    )
+    return env
+
+
+def run_stage(name, command, env, directory):
+    """Run one stage; returns (exit code, seconds, peak RSS in MB)"""
+    with open(os.path.join(directory, f"{name}.log"), 'w', encoding='utf-8') as log:
+        started = time.monotonic()
+        proc = subprocess.Popen([sys.executable, os.path.join(ROOT, command[0])] + command[1:],
+                                cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        seconds = time.monotonic() - started
+    return proc.returncode, seconds, usage.ru_maxrss / 1024
+
+
+def stage_retries(name, directory):
+    path = os.path.join(directory, 'metrics', f"{name}.json")
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return sum(c['value'] for c in report['counters'] if c['name'] == 'retries_total')
+
+
+def bench(total_events):
+    """Run every stage on a fresh corpus of ``total_events`` events"""
+    server, base_url = start_stub_server(total_events=total_events, per_page=PER_PAGE, latency=LATENCY,
+                                         error_rate=ERROR_RATE, chat_latency=CHAT_LATENCY)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            env = stage_env(base_url, directory)
+            for name, command in STAGES:
+                reset_counters(server)
+                code, seconds, peak_rss = run_stage(name, command, env, directory)
+                results.append({
+                    'stage': name,
+                    'ok': code == 0,
+                    'seconds': round(seconds, 2),
+                    'events_per_sec': round(total_events / seconds, 1),
+                    'requests': server.requests,
+                    'errors': server.errors,
+                    'peak_in_flight': server.peak_in_flight,
+                    'mean_in_flight': round(server.busy_seconds / seconds, 1),
+                    'peak_rss_mb': round(peak_rss, 1),
+                    'retries': stage_retries(name, directory),
+                })
+                print(f"  {name:<13} {'ok' if code == 0 else f'FAILED (exit {code})'} in {seconds:.1f}s")
+                if code != 0:
+                    with open(os.path.join(directory, f"{name}.log"), 'r', encoding='utf-8') as f:
+                        print(''.join(f.readlines()[-10:]))
+                    break
+    finally:
+        server.shutdown()
+    return results
+
+
+def settings(total_events):
+    return {'events': total_events, 'latency': LATENCY, 'chat_latency': CHAT_LATENCY, 'error_rate': ERROR_RATE,
+            'concurrency': CONCURRENCY, 'batch_events': BATCH_EVENTS, 'per_page': PER_PAGE}
+
+
+def previous_run(config):
+    """Stage results of the last recorded run with the same settings"""
+    if not os.path.exists(BENCH_OUTPUT):
+        return {}
+    previous = {}
+    with open(BENCH_OUTPUT, 'r', encoding='utf-8') as f:
+        for line in f:
+            run = json.loads(line)
+            if run['settings'] == config:
+                previous = {r['stage']: r for r in run['stages']}
+    return previous
+
+
+def main():
+    for total_events in EVENT_COUNTS:
+        config = settings(total_events)
+        print("=" * 60)
+        print(f"PIPELINE BENCHMARK ({total_events} events)")
+        print(f"Latency {LATENCY * 1000:.0f}ms, chat {CHAT_LATENCY * 1000:.0f}ms, errors {ERROR_RATE:.0%}, "
+              f"concurrency {CONCURRENCY}, {BATCH_EVENTS} events per request")
+        print("=" * 60)
+
+        previous = previous_run(config)
+        results = bench(total_events)
+        with open(BENCH_OUTPUT, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'settings': config,
+                                'stages': results}) + '\n')
+
+        print("\n" + f"{'stage':<13} {'wall':>7} {'ev/s':>8} {'req':>7} {'503':>5} {'retry':>5} "
+              f"{'peak':>5} {'mean':>5} {'rss MB':>7}  vs last")
+        for r in results:
+            before = previous.get(r['stage'])
+            change = f"{r['events_per_sec'] / before['events_per_sec'] - 1:+.0%}" if before else '-'
+            print(f"{r['stage']:<13} {r['seconds']:>6.1f}s {r['events_per_sec']:>8.0f} {r['requests']:>7} "
+                  f"{r['errors']:>5} {r['retries']:>5} {r['peak_in_flight']:>5} {r['mean_in_flight']:>5} "
+                  f"{r['peak_rss_mb']:>7.0f}  {change}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import time
+
+import rate_limit
+import scrape_sxodim
+from stubs import start_stub_server, LISTING_PATH, READER_PATH
+
+TOTAL_EVENTS = int(os.getenv("BENCH_EVENTS", "100"))
+LATENCY = float(os.getenv("BENCH_LATENCY", "0.05"))
+RATE = float(os.getenv("BENCH_RPS", "1000"))  # Per-endpoint limit during the benchmark
+
+
+def run_crawl(base_url, concurrency):
+    scrape_sxodim.SXODIM_API_URL = base_url + LISTING_PATH
+    scrape_sxodim.JINA_READER_URL = base_url + READER_PATH.rstrip('/')
+    scrape_sxodim.SCRAPE_CONCURRENCY = concurrency
+    rate_limit.configure('sxodim', RATE)
+    rate_limit.configure('jina', RATE)
+
+    started = time.monotonic()
+    scrape_sxodim.main()
+    return time.monotonic() - started
+
+
+def main():
+    server, base_url = start_stub_server(total_events=TOTAL_EVENTS, latency=LATENCY)
+    cwd = os.getcwd()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            for concurrency in (1, 8, 32):
+                results[concurrency] = run_crawl(base_url, concurrency)
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+    print("\n" + "=" * 60)
+    print(f"SCRAPE BENCHMARK ({TOTAL_EVENTS} events, {LATENCY * 1000:.0f}ms latency)")
+    print("=" * 60)
+    for concurrency, elapsed in results.items():
+        print(f"  concurrency={concurrency:<3} {elapsed:6.2f}s  x{results[1] / elapsed:.1f}")
+
+
+if __name__ == '__main__':
+    main()
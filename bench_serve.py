@@ -0,0 +1,78 @@
+"""Load test for serve.py: throughput and latency vs --max-batch.
+
+Starts the server in-process for each batch size and fires
+BENCH_REQUESTS chat completions from BENCH_CLIENTS concurrent OpenAI
+clients. Runs on CPU; point BENCH_MODEL at a small checkpoint for a
+quick run.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI
+
+from inference import SYSTEM_PROMPT
+from serve import start_server
+
+BENCH_MODEL = os.getenv("BENCH_MODEL", "rsyrlybay/qwen2.5-3b-sxodim-almaty")
+BENCH_REQUESTS = int(os.getenv("BENCH_REQUESTS", "48"))
+BENCH_CLIENTS = int(os.getenv("BENCH_CLIENTS", "16"))
+BENCH_NEW_TOKENS = int(os.getenv("BENCH_NEW_TOKENS", "64"))
+
+QUESTIONS = [
+    "Куда можно сходить в Алматы на выходных?",
+    "Где послушать джаз в Алматы?",
+    "Сколько стоят билеты на стендап в Punch?",
+    "Что такое киноужин от VkusKino?",
+    "Куда сходить с детьми в Алматы?",
+    "Какие спектакли идут в Алматы?",
+]
+
+
+def load_test(base_url):
+    client = OpenAI(base_url=base_url, api_key="local", max_retries=5)
+
+    def ask(i):
+        started = time.monotonic()
+        stream = client.chat.completions.create(
+            model=BENCH_MODEL,
+            messages=[{"role": "system", "content": SYSTEM_PROMPT},
+                      {"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]}],
+            max_tokens=BENCH_NEW_TOKENS,
+            temperature=0.7,
+            stream=True,
+        )
+        first = None
+        for chunk in stream:
+            if first is None and chunk.choices and chunk.choices[0].delta.content:
+                first = time.monotonic() - started
+        return first, time.monotonic() - started
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=BENCH_CLIENTS) as pool:
+        results = list(pool.map(ask, range(BENCH_REQUESTS)))
+    return time.monotonic() - started, results
+
+
+def main():
+    rows = {}
+    for max_batch in (1, 8):
+        server, base_url = start_server(BENCH_MODEL, port=0, max_batch=max_batch, max_queue=BENCH_REQUESTS)
+        wall, results = load_test(base_url)
+        metrics = server.engine.metrics.snapshot(server.engine)
+        server.shutdown()
+        rows[max_batch] = (wall, results, metrics)
+
+    print("\n" + "=" * 60)
+    print(f"SERVER LOAD TEST ({BENCH_REQUESTS} requests, {BENCH_CLIENTS} clients, {BENCH_MODEL})")
+    print("=" * 60)
+    for max_batch, (wall, results, metrics) in rows.items():
+        ttft = sorted(r[0] for r in results if r[0] is not None)
+        latency = sorted(r[1] for r in results)
+        print(f"  max_batch={max_batch:<2} {wall:6.1f}s  {BENCH_REQUESTS / wall:5.2f} req/s  "
+              f"{metrics['completion_tokens'] / wall:7.1f} tok/s  avg batch {metrics['avg_batch_size']:.1f}  "
+              f"ttft p50 {ttft[len(ttft) // 2] * 1000:.0f}ms  latency p50 {latency[len(latency) // 2] * 1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
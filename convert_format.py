@@ -1,37 +1,136 @@
+"""Convert generated datasets to compact JSONL for training.
+
+Records are streamed from the source JSON array and written one per
+line, so memory stays flat whatever the dataset size. The system prompt
+is written once, in a header on the first line, instead of in every
+row:
+
+    {"header": true, "format": "chat", "system_prompt": "..."}
+    {"messages": [{"role": "user", ...}, {"role": "assistant", ...}]}
+
+Rows whose system prompt differs from the header keep it inline.
+``read_dataset`` puts the system message back when loading.
+
+Formats:
+    chat      sft_dataset_alpaca.json -> sft_dataset_chat.jsonl      (OpenAI messages)
+    sharegpt  sft_dataset_alpaca.json -> sft_dataset_sharegpt.jsonl  (conversations)
+    orpo      orpo_dataset.json       -> orpo_dataset_pairs.jsonl    (prompt/chosen/rejected)
+"""
+import argparse
 import json
+import os
 
-# Load the alpaca format dataset
-with open('sft_dataset_alpaca.json', 'r', encoding='utf-8') as f:
-    alpaca_data = json.load(f)
+from json_stream import iter_array
 
 # System prompt for the assistant
 system_prompt = "Ты — дружелюбный помощник по мероприятиям в Алматы. Помогаешь пользователям найти интересные события, концерты, спектакли, выставки и развлечения в городе. Отвечай информативно, указывая даты, время, место и цены."
 
-# Convert to OpenAI chat format
-chat_format = []
-
-for item in alpaca_data:
-    chat_item = {
-        "messages": [
-            {
-                "role": "system",
-                "content": system_prompt
-            },
-            {
-                "role": "user",
-                "content": item["instruction"]
-            },
-            {
-                "role": "assistant",
-                "content": item["output"]
-            }
-        ]
-    }
-    chat_format.append(chat_item)
-
-# Save the converted format
-with open('sft_dataset_chat.json', 'w', encoding='utf-8') as f:
-    json.dump(chat_format, f, ensure_ascii=False, indent=2)
-
-print(f"Converted {len(chat_format)} items")
-print(f"Saved to: sft_dataset_chat.json")
+FORMATS = {
+    'chat': ('sft_dataset_alpaca.json', 'sft_dataset_chat.jsonl'),
+    'sharegpt': ('sft_dataset_alpaca.json', 'sft_dataset_sharegpt.jsonl'),
+    'orpo': ('orpo_dataset.json', 'orpo_dataset_pairs.jsonl'),
+}
+
+
+def to_chat(item):
+    return {"messages": [
+        {"role": "user", "content": item["instruction"]},
+        {"role": "assistant", "content": item["output"]},
+    ]}
+
+
+def to_sharegpt(item):
+    return {"conversations": [
+        {"from": "human", "value": item["instruction"]},
+        {"from": "gpt", "value": item["output"]},
+    ]}
+
+
+def to_orpo(item, system):
+    """Drop the system message when it matches the header's"""
+    prompt = item["prompt"]
+    if prompt and prompt[0]["role"] == "system" and prompt[0]["content"] == system:
+        prompt = prompt[1:]
+    return dict(item, prompt=prompt)
+
+
+def orpo_system_prompt(item):
+    prompt = item.get("prompt") or []
+    if prompt and prompt[0]["role"] == "system":
+        return prompt[0]["content"]
+    return None
+
+
+def write_header(out, fmt, system):
+    header = {"header": True, "format": fmt, "system_prompt": system}
+    out.write(json.dumps(header, ensure_ascii=False) + '\n')
+
+
+def convert(fmt, input_path, output_path):
+    """Stream ``input_path`` into ``output_path``; returns the row count"""
+    count = 0
+    tmp_path = output_path + '.tmp'
+    with open(input_path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as out:
+        system = system_prompt if fmt != 'orpo' else None
+        for item in iter_array(src):
+            if count == 0:
+                # ORPO pairs carry their own system prompt; take it from the first row
+                if fmt == 'orpo':
+                    system = orpo_system_prompt(item)
+                write_header(out, fmt, system)
+
+            if fmt == 'chat':
+                row = to_chat(item)
+            elif fmt == 'sharegpt':
+                row = to_sharegpt(item)
+            else:
+                row = to_orpo(item, system)
+            out.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n')
+            count += 1
+        if count == 0:
+            # An empty dataset still gets its header, so readers see a valid file
+            write_header(out, fmt, system)
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def read_dataset(path):
+    """Rows of a converted JSONL file with the header's system prompt restored"""
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.readline()
+        if not first.strip():
+            return
+        header = json.loads(first)
+        fmt, system = header["format"], header.get("system_prompt")
+        for line in f:
+            row = json.loads(line)
+            if system:
+                if fmt == 'chat':
+                    row["messages"].insert(0, {"role": "system", "content": system})
+                elif fmt == 'sharegpt':
+                    row["conversations"].insert(0, {"from": "system", "value": system})
+                elif fmt == 'orpo' and (not row["prompt"] or row["prompt"][0]["role"] != "system"):
+                    row["prompt"].insert(0, {"role": "system", "content": system})
+            yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert generated datasets to compact JSONL")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='chat')
+    parser.add_argument('--input', help="source JSON array (default depends on --format)")
+    parser.add_argument('--output', help="target JSONL file (default depends on --format)")
+    args = parser.parse_args()
+
+    default_input, default_output = FORMATS[args.format]
+    input_path = args.input or default_input
+    output_path = args.output or default_output
+
+    count = convert(args.format, input_path, output_path)
+
+    print(f"Converted {count} items")
+    print(f"Saved to: {output_path} ({os.path.getsize(output_path) / 1024:.0f} KB, "
+          f"source {os.path.getsize(input_path) / 1024:.0f} KB)")
+
+
+if __name__ == '__main__':
+    main()
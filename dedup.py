@@ -0,0 +1,221 @@
+"""Near-duplicate removal for the SFT and ORPO datasets.
+
+Many generated questions are the same generic question in different
+words ("Где можно купить билеты?"), often with the same answer. Records
+are compared with MinHash signatures over character shingles, and
+candidate pairs come from LSH banding, so the cost grows about linearly
+with the dataset instead of with every pair.
+
+Two records are duplicates when their key texts (SFT ``instruction``,
+ORPO user ``prompt``) are at least ``--threshold`` similar AND their
+answers (``output`` / ``chosen``) are at least ``--answer-threshold``
+similar. The same question with an answer about a different event is
+kept. In each cluster the first record, in dataset order, is kept.
+
+    python dedup.py sft    # sft_dataset.json -> sft_dataset_dedup.json + sft_dataset_alpaca_dedup.json
+    python dedup.py orpo   # orpo_dataset.json -> orpo_dataset_dedup.json
+
+A report with counts and the largest clusters goes to dedup_report_<kind>.json.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import defaultdict
+
+from journal import write_json_array
+from json_stream import iter_array
+
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))                # Question similarity
+DEDUP_ANSWER_THRESHOLD = float(os.getenv("DEDUP_ANSWER_THRESHOLD", "0.6"))  # Answer similarity
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64"))                     # MinHash signature length
+SHINGLE_SIZE = 4
+
+
+def user_prompt(record):
+    """Last user message of an ORPO prompt"""
+    messages = [m for m in record.get('prompt', []) if m.get('role') == 'user']
+    return messages[-1]['content'] if messages else ''
+
+
+def first_content(messages):
+    return messages[0]['content'] if messages else ''
+
+
+# (input file, key text, answer text) per dataset kind
+DATASETS = {
+    'sft': ('sft_dataset.json', lambda r: r.get('instruction', ''), lambda r: r.get('output', '')),
+    'orpo': ('orpo_dataset.json', user_prompt, lambda r: first_content(r.get('chosen'))),
+}
+
+
+def normalize(text):
+    text = text.lower().replace('ё', 'е')
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    text = normalize(text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+
+    def __init__(self, num_perm=DEDUP_NUM_PERM, seed=1):
+        # Each "permutation" XORs the 64-bit shingle hashes with a random mask,
+        # which keeps the inner min() in C
+        rng = random.Random(seed)
+        self.masks = [rng.getrandbits(64) for _ in range(num_perm)]
+
+    def signature(self, text):
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+                  for s in shingles(text)]
+        return tuple(min(map(mask.__xor__, hashes)) for mask in self.masks)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+def lsh_params(num_perm, threshold):
+    """(bands, rows) whose S-curve threshold sits a bit below ``threshold``.
+
+    Candidates are verified afterwards, so erring low only costs a few
+    extra comparisons while erring high would miss duplicates.
+    """
+    target = max(0.05, threshold - 0.1)
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(options, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - target))
+
+
+def find_clusters(signatures, threshold, answer_threshold, num_perm):
+    """Groups of duplicate record indexes (size > 1), via LSH + union-find"""
+    bands, rows = lsh_params(num_perm, threshold)
+    parent = list(range(len(signatures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    compared = 0
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for i, (key_sig, _) in enumerate(signatures):
+            buckets[key_sig[band * rows:(band + 1) * rows]].append(i)
+        for members in buckets.values():
+            for n, i in enumerate(members):
+                for j in members[n + 1:]:
+                    if find(i) == find(j):
+                        continue
+                    compared += 1
+                    if (similarity(signatures[i][0], signatures[j][0]) >= threshold
+                            and similarity(signatures[i][1], signatures[j][1]) >= answer_threshold):
+                        parent[max(find(i), find(j))] = min(find(i), find(j))
+
+    groups = defaultdict(list)
+    for i in range(len(signatures)):
+        groups[find(i)].append(i)
+    return [members for members in groups.values() if len(members) > 1], compared
+
+
+def dedup(kind, input_path=None, threshold=DEDUP_THRESHOLD, answer_threshold=DEDUP_ANSWER_THRESHOLD,
+          num_perm=DEDUP_NUM_PERM):
+    """Write the deduplicated dataset and report; returns the report"""
+    default_input, key_text, answer_text = DATASETS[kind]
+    input_path = input_path or default_input
+    base = os.path.splitext(input_path)[0]
+    started = time.monotonic()
+
+    # Pass 1: signatures only, records are not kept in memory
+    hasher = MinHasher(num_perm)
+    signatures, keys = [], []
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for record in iter_array(f):
+            signatures.append((hasher.signature(key_text(record)), hasher.signature(answer_text(record))))
+            keys.append(key_text(record))
+
+    clusters, compared = find_clusters(signatures, threshold, answer_threshold, num_perm)
+    dropped = {i for members in clusters for i in members[1:]}
+
+    # Pass 2: stream the kept records out
+    def kept_records():
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for i, record in enumerate(iter_array(f)):
+                if i not in dropped:
+                    yield record
+
+    output_path = base + '_dedup.json'
+    kept = write_json_array(output_path, kept_records())
+    outputs = [output_path]
+    if kind == 'sft':
+        alpaca_path = base + '_alpaca_dedup.json'
+        write_json_array(alpaca_path, ({
+            "instruction": record["instruction"],
+            "input": record["input"],
+            "output": record["output"]
+        } for record in kept_records()))
+        outputs.append(alpaca_path)
+
+    clusters.sort(key=len, reverse=True)
+    report = {
+        'input': input_path,
+        'outputs': outputs,
+        'threshold': threshold,
+        'answer_threshold': answer_threshold,
+        'num_perm': num_perm,
+        'lsh_bands_rows': list(lsh_params(num_perm, threshold)),
+        'records': len(signatures),
+        'kept': kept,
+        'removed': len(dropped),
+        'removed_pct': round(100 * len(dropped) / max(1, len(signatures)), 1),
+        'clusters': len(clusters),
+        'pairs_compared': compared,
+        'seconds': round(time.monotonic() - started, 2),
+        'largest_clusters': [{'size': len(members), 'kept': keys[members[0]],
+                              'dropped': [keys[i] for i in members[1:6]]} for members in clusters[:20]],
+    }
+    with open(f'dedup_report_{kind}.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove near-duplicate records from a generated dataset")
+    parser.add_argument('kind', choices=sorted(DATASETS))
+    parser.add_argument('--input', help="dataset JSON array (default depends on kind)")
+    parser.add_argument('--threshold', type=float, default=DEDUP_THRESHOLD,
+                        help="min question similarity to count as a duplicate")
+    parser.add_argument('--answer-threshold', type=float, default=DEDUP_ANSWER_THRESHOLD,
+                        help="min answer similarity to count as a duplicate (0 = questions only)")
+    parser.add_argument('--num-perm', type=int, default=DEDUP_NUM_PERM)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"DEDUP {args.kind.upper()}")
+    print("=" * 60)
+
+    report = dedup(args.kind, args.input, args.threshold, args.answer_threshold, args.num_perm)
+
+    print(f"Records: {report['records']}")
+    print(f"Removed: {report['removed']} ({report['removed_pct']}%) in {report['clusters']} clusters")
+    print(f"Kept: {report['kept']}")
+    print(f"Pairs compared: {report['pairs_compared']}, {report['seconds']}s")
+    for cluster in report['largest_clusters'][:5]:
+        print(f"  x{cluster['size']}: {cluster['kept'][:70]}")
+    print("=" * 60)
+    for path in report['outputs']:
+        print(f"Saved to: {path}")
+    print(f"Report: dedup_report_{args.kind}.json")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Evaluation on a held-out set: ROUGE and BERTScore in batches, with cached reference embeddings.
+
+The held-out set is every QA pair of a fixed share of events, chosen by
+a hash of ``event_id``, so no event is both trained on and evaluated and
+the split stays the same as the dataset grows. The pipeline's split
+stage runs it on the checked, deduplicated dataset, and convert_chat
+builds the training data from the rest:
+
+    python evaluation.py split                     # eval_set.json + sft_dataset_alpaca_train.json
+    python convert_format.py --input sft_dataset_alpaca_train.json
+    python evaluation.py score outputs/checkpoint-500
+    python evaluation.py score predictions.json    # answers in eval_set.json order
+
+BERTScore follows bert_score (greedy cosine matching of token embeddings
+from layer ``EVAL_BERT_LAYER`` of ``EVAL_BERT_MODEL``, no idf, no
+baseline rescaling), but reference embeddings are stored on disk under
+``EVAL_CACHE_DIR``, keyed by model, layer and text, so a checkpoint
+only embeds its own answers. Texts are embedded sorted by length, and
+pairs are matched a batch at a time with one ``bmm``. Runs on CPU when
+there is no GPU.
+
+ROUGE-1/2/L are computed on lowercased ``\\w+`` tokens. ``rouge_score``
+(behind ``evaluate.load("rouge")``) keeps only ``[a-z0-9]``, so for
+Russian answers it only compared the numbers.
+
+Scores of every run are appended to ``eval_results.jsonl``.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import torch
+
+from journal import write_json_array
+from json_stream import iter_array
+
+EVAL_BERT_MODEL = os.getenv("EVAL_BERT_MODEL", "bert-base-multilingual-cased")
+EVAL_BERT_LAYER = int(os.getenv("EVAL_BERT_LAYER", "9"))           # bert_score's default for this model
+EVAL_CACHE_DIR = os.getenv("EVAL_CACHE_DIR", ".eval_cache")
+EVAL_EMBED_BATCH = int(os.getenv("EVAL_EMBED_BATCH", "64"))        # Texts per encoder forward pass
+EVAL_HOLDOUT = float(os.getenv("EVAL_HOLDOUT", "0.1"))             # Share of events held out
+
+EVAL_SET_PATH = 'eval_set.json'
+EVAL_RESULTS_PATH = 'eval_results.jsonl'
+TRAIN_SPLIT_PATH = 'sft_dataset_alpaca_train.json'
+SPLIT_INPUT_PATH = 'sft_dataset_verified_dedup.json'   # dedup_sft output, still with event_id
+
+WORD_RE = re.compile(r'\w+')
+
+
+def held_out(event_id, fraction=EVAL_HOLDOUT):
+    """Whether an event belongs to the held-out set; stable across runs and dataset versions"""
+    digest = hashlib.sha1(str(event_id).encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) < fraction * 0x100000000
+
+
+def split_dataset(input_path=SPLIT_INPUT_PATH, fraction=EVAL_HOLDOUT):
+    """Write the held-out pairs to eval_set.json and the rest, in Alpaca format, for training"""
+    held = []
+
+    def train_items(f):
+        for item in iter_array(f):
+            if held_out(item.get('event_id'), fraction):
+                held.append({'event_id': item.get('event_id'), 'instruction': item['instruction'],
+                             'input': item.get('input', ''), 'output': item['output']})
+            else:
+                yield {'instruction': item['instruction'], 'input': item.get('input', ''), 'output': item['output']}
+
+    with open(input_path, 'r', encoding='utf-8') as f:
+        train = write_json_array(TRAIN_SPLIT_PATH, train_items(f))
+    write_json_array(EVAL_SET_PATH, held)
+    return train, len(held)
+
+
+def load_eval_set(path=EVAL_SET_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return list(iter_array(f))
+
+
+def question(item):
+    return f"{item['instruction']}\n{item['input']}".strip() if item.get('input') else item['instruction']
+
+
+def tokens(text):
+    return WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def lcs_length(a, b):
+    """Longest common subsequence of two token lists, bit-parallel (Hyyrö, 2004)"""
+    if not a or not b:
+        return 0
+    masks = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count('1')
+
+
+def f_measure(overlap, predicted, reference):
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / predicted, overlap / reference
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge(predictions, references):
+    """Per-pair ROUGE-1, ROUGE-2 and ROUGE-L F-measures, as numpy arrays"""
+    scores = np.zeros((3, len(predictions)))
+    for i, (prediction, reference) in enumerate(zip(predictions, references)):
+        p, r = tokens(prediction), tokens(reference)
+        for n in (1, 2):
+            p_grams = Counter(zip(*(p[k:] for k in range(n))))
+            r_grams = Counter(zip(*(r[k:] for k in range(n))))
+            overlap = sum((p_grams & r_grams).values())
+            scores[n - 1, i] = f_measure(overlap, sum(p_grams.values()), sum(r_grams.values()))
+        scores[2, i] = f_measure(lcs_length(p, r), len(p), len(r))
+    return {'rouge1': scores[0], 'rouge2': scores[1], 'rougeL': scores[2]}
+
+
+class EmbeddingCache:
+    """Normalized token embeddings per text, one .npy file per entry"""
+
+    def __init__(self, model_name, layer, directory=EVAL_CACHE_DIR):
+        name = re.sub(r'[^\w.-]+', '_', model_name)
+        self.directory = os.path.join(directory, f"{name}-layer{layer}")
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, text):
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key + '.npy')
+
+    def get(self, text):
+        try:
+            embedding = np.load(self._path(text))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return embedding
+
+    def put(self, text, embedding):
+        path = self._path(text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, embedding)
+        os.replace(tmp_path, path)
+
+
+class BERTScorer:
+    """BERTScore with the encoder loaded once and reference embeddings cached on disk"""
+
+    def __init__(self, model_name=EVAL_BERT_MODEL, layer=EVAL_BERT_LAYER, batch_size=EVAL_EMBED_BATCH,
+                 device=None, cache_dir=EVAL_CACHE_DIR):
+        from transformers import AutoModel, AutoTokenizer
+
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).to(self.device).eval()
+        if hasattr(self.model, 'encoder') and hasattr(self.model.encoder, 'layer'):
+            # Layers above the one we read are never needed
+            self.model.encoder.layer = self.model.encoder.layer[:layer]
+        self.layer = layer
+        self.batch_size = batch_size
+        self.max_length = min(self.tokenizer.model_max_length, 512)
+        self.cache = EmbeddingCache(model_name, layer, cache_dir)
+
+    def encode(self, texts):
+        """Normalized embeddings of each text's tokens, without [CLS] and [SEP]"""
+        embeddings = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            inputs = self.tokenizer([texts[i] for i in batch], return_tensors='pt', padding=True, truncation=True,
+                                    max_length=self.max_length, return_special_tokens_mask=True)
+            special = inputs.pop('special_tokens_mask').bool()
+            inputs = inputs.to(self.device)
+            with torch.inference_mode():
+                hidden = self.model(**inputs, output_hidden_states=True).hidden_states[self.layer]
+            hidden = torch.nn.functional.normalize(hidden.float(), dim=-1).cpu()
+            keep = inputs['attention_mask'].cpu().bool() & ~special
+            for row, i in enumerate(batch):
+                embeddings[i] = hidden[row][keep[row]].numpy().astype(np.float16)
+        return embeddings
+
+    def embed(self, texts, cache=False):
+        """Embeddings for ``texts``; with ``cache`` they are read from and saved to disk"""
+        if not cache:
+            return self.encode(texts)
+        unique = list(dict.fromkeys(texts))
+        found = {text: self.cache.get(text) for text in unique}
+        missing = [text for text in unique if found[text] is None]
+        for text, embedding in zip(missing, self.encode(missing)):
+            self.cache.put(text, embedding)
+            found[text] = embedding
+        return [found[text] for text in texts]
+
+    def score(self, predictions, references, batch_size=256):
+        """Per-pair precision, recall and F1, as numpy arrays"""
+        candidates = self.embed(predictions)
+        targets = self.embed(references, cache=True)
+        scores = np.zeros((3, len(predictions)), dtype=np.float32)
+        for start in range(0, len(predictions), batch_size):
+            c, c_mask = pad(candidates[start:start + batch_size])
+            r, r_mask = pad(targets[start:start + batch_size])
+            sim = torch.bmm(c, r.transpose(1, 2))
+            sim = sim.masked_fill(~(c_mask[:, :, None] & r_mask[:, None, :]), -2.0)
+            # An empty answer or reference scores 0, as in bert_score
+            both = c_mask.any(dim=1) & r_mask.any(dim=1)
+            precision = masked_mean(sim.max(dim=2).values, c_mask) * both
+            recall = masked_mean(sim.max(dim=1).values, r_mask) * both
+            f1 = torch.where(precision + recall > 0, 2 * precision * recall / (precision + recall),
+                             torch.zeros_like(precision))
+            scores[:, start:start + len(c)] = torch.stack([precision, recall, f1]).numpy()
+        return {'precision': scores[0], 'recall': scores[1], 'f1': scores[2]}
+
+
+def pad(embeddings):
+    """[batch, tokens, dim] float32 tensor and its token mask"""
+    width = max(1, max(len(e) for e in embeddings))
+    dim = embeddings[0].shape[1]
+    batch = np.zeros((len(embeddings), width, dim), dtype=np.float32)
+    mask = np.zeros((len(embeddings), width), dtype=bool)
+    for i, e in enumerate(embeddings):
+        batch[i, :len(e)] = e
+        mask[i, :len(e)] = True
+    return torch.from_numpy(batch), torch.from_numpy(mask)
+
+
+def masked_mean(values, mask):
+    """Mean over the valid tokens; 0 for texts without tokens"""
+    counts = mask.sum(dim=1)
+    return torch.where(counts > 0, (values * mask).sum(dim=1) / counts.clamp(min=1), torch.zeros_like(values[:, 0]))
+
+
+def evaluate_answers(predictions, references, scorer=None):
+    """Mean ROUGE and BERTScore over the pairs"""
+    results = {name: float(values.mean()) for name, values in rouge(predictions, references).items()}
+    if scorer is not None:
+        bert = scorer.score(predictions, references)
+        results.update({f"bertscore_{name}": float(values.mean()) for name, values in bert.items()})
+    return results
+
+
+def checkpoint_predictions(checkpoint, eval_set):
+    """Answers of a checkpoint to the held-out questions, saved next to it"""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from inference import generate_answers
+
+    path = os.path.join(checkpoint, 'eval_predictions.json')
+    tokenizer = AutoTokenizer.from_pretrained(checkpoint)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(checkpoint)
+    model.to('cuda' if torch.cuda.is_available() else 'cpu').eval()
+    answers = generate_answers(model, tokenizer, [question(item) for item in eval_set], do_sample=False)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(answers, f, ensure_ascii=False, indent=2)
+    return answers, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Held-out evaluation with ROUGE and cached BERTScore")
+    sub = parser.add_subparsers(dest='command', required=True)
+    split = sub.add_parser('split', help="write eval_set.json and the training split")
+    split.add_argument('--input', default=SPLIT_INPUT_PATH)
+    split.add_argument('--fraction', type=float, default=EVAL_HOLDOUT)
+    score = sub.add_parser('score', help="score a checkpoint or a JSON list of answers")
+    score.add_argument('source', help="checkpoint directory or predictions JSON")
+    score.add_argument('--no-bertscore', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'split':
+        train, held = split_dataset(args.input, args.fraction)
+        print(f"Training split: {train} pairs -> {TRAIN_SPLIT_PATH}")
+        print(f"Held-out set: {held} pairs -> {EVAL_SET_PATH}")
+        return
+
+    if not os.path.exists(EVAL_SET_PATH):
+        print(f"No {EVAL_SET_PATH}, run `python evaluation.py split` first")
+        sys.exit(1)
+    eval_set = load_eval_set()
+
+    print("=" * 60)
+    print(f"EVALUATION ({len(eval_set)} held-out pairs)")
+    print("=" * 60)
+
+    started = time.monotonic()
+    if os.path.isdir(args.source):
+        predictions, path = checkpoint_predictions(args.source, eval_set)
+        print(f"Generated {len(predictions)} answers in {time.monotonic() - started:.1f}s -> {path}")
+    else:
+        with open(args.source, 'r', encoding='utf-8') as f:
+            predictions = json.load(f)
+    if len(predictions) != len(eval_set):
+        print(f"Expected {len(eval_set)} answers in eval_set.json order, got {len(predictions)}")
+        sys.exit(1)
+
+    scorer = None if args.no_bertscore else BERTScorer()
+    scoring_started = time.monotonic()
+    results = evaluate_answers(predictions, [item['output'] for item in eval_set], scorer)
+    seconds = time.monotonic() - scoring_started
+
+    for name, value in results.items():
+        print(f"  {name:<20} {value:.4f}")
+    if scorer is not None:
+        print(f"Reference embeddings: {scorer.cache.hits} cached, {scorer.cache.misses} computed")
+    print(f"Scored in {seconds:.1f}s on {scorer.device if scorer else 'cpu'}")
+
+    with open(EVAL_RESULTS_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'source': args.source,
+                            'pairs': len(eval_set), 'model': None if scorer is None else EVAL_BERT_MODEL,
+                            'seconds': round(seconds, 1), **results}, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
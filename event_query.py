@@ -0,0 +1,178 @@
+"""Structured filters from user questions: dates, category and price.
+
+Questions like "Какие концерты будут в эти выходные?" or "Спектакли до
+5000 тг в июне" are filters over the typed columns of the event store,
+not text search. ``question_filters`` turns a question into keyword
+arguments for ``EventStore.query`` (and ``EventIndex.search``):
+
+    >>> question_filters("Концерты в эти выходные до 5000 тг", ['Концерты'], date(2025, 6, 4))
+    {'category': 'Концерты', 'date_from': '2025-06-07', 'date_to': '2025-06-08', 'max_price': 5000}
+
+Understood: сегодня / завтра / послезавтра, weekdays ("в пятницу"),
+(следующие) выходные, (эта / следующая) неделя, этот месяц, "в июне", "15 июня", "до 5000",
+"дешевле 5 тыс", "бесплатно", and category names in any case form.
+
+    python event_query.py "Какие концерты будут в эти выходные?"
+"""
+import re
+import sys
+import time
+from calendar import isleap, monthrange
+from datetime import date, timedelta
+
+from event_store import open_store
+
+# Month stems, January first: "июнь", "июня", "июне"
+MONTHS = ('январ', 'феврал', 'март', 'апрел', 'ма[йяе](?!\\w)', 'июн', 'июл', 'август', 'сентябр', 'октябр',
+          'ноябр', 'декабр')
+MONTH_RE = re.compile(r'(?<!\w)(?:(\d{1,2})\s+)?(' + '|'.join(f'{m}\\w*' for m in MONTHS) + r')(?!\w)')
+PRICE_RE = re.compile(r'(?:до|дешевле|не дороже|меньше|максимум|в пределах)\s+(\d[\d\s ]*)\s*(?:(тыс\w*|k|к)(?!\w))?',
+                      re.IGNORECASE)
+WEEKDAY_RE = re.compile(r'(?<!\w)(понедельник|вторник|сред[уа]|четверг|пятниц[уа]|суббот[уа]|воскресенье)(?!\w)')
+WEEKDAYS = ('понедельник', 'вторник', 'сред', 'четверг', 'пятниц', 'суббот', 'воскресенье')
+FREE_RE = re.compile(r'бесплатн')
+TOMORROW_RE = re.compile(r'(?<!\w)завтра(?!\w)')
+DAY_AFTER_TOMORROW_RE = re.compile(r'(?<!\w)послезавтра(?!\w)')
+WORD_RE = re.compile(r'\w+')
+
+
+def month_number(word):
+    for number, stem in enumerate(MONTHS, 1):
+        if re.match(stem, word):
+            return number
+    return None
+
+
+def upcoming(day, today):
+    """``day`` in this year, or its next occurrence if it has already passed"""
+    if day >= today:
+        return day
+    year = day.year + 1
+    # 29 February only comes back in a leap year
+    while day.month == 2 and day.day == 29 and not isleap(year):
+        year += 1
+    return day.replace(year=year)
+
+
+def date_filters(text, today):
+    """(date_from, date_to) for the time expressions in ``text``, or (None, None)"""
+    if DAY_AFTER_TOMORROW_RE.search(text):
+        return today + timedelta(days=2), today + timedelta(days=2)
+    if TOMORROW_RE.search(text):
+        return today + timedelta(days=1), today + timedelta(days=1)
+    if 'сегодня' in text:
+        return today, today
+    if 'выходн' in text:
+        saturday = today + timedelta(days=(5 - today.weekday()) % 7)
+        if today.weekday() == 6:
+            saturday = today - timedelta(days=1)
+        if 'следующ' in text:
+            saturday += timedelta(days=7)
+        return max(saturday, today), saturday + timedelta(days=1)
+    match = WEEKDAY_RE.search(text)
+    if match:
+        weekday = next(i for i, name in enumerate(WEEKDAYS) if match.group(1).startswith(name))
+        day = today + timedelta(days=(weekday - today.weekday()) % 7)
+        if 'следующ' in text:
+            day += timedelta(days=7)
+        return day, day
+    if 'недел' in text:
+        monday = today - timedelta(days=today.weekday())
+        if 'следующ' in text:
+            return monday + timedelta(days=7), monday + timedelta(days=13)
+        return today, monday + timedelta(days=6)
+    if 'месяц' in text:
+        if 'следующ' in text:
+            first = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+            return first, first.replace(day=monthrange(first.year, first.month)[1])
+        return today, today.replace(day=monthrange(today.year, today.month)[1])
+
+    match = MONTH_RE.search(text)
+    if match:
+        month = month_number(match.group(2))
+        if match.group(1):
+            day_number = int(match.group(1))
+            if day_number <= monthrange(today.year, month)[1]:
+                day = upcoming(date(today.year, month, day_number), today)
+                return day, day
+        else:
+            first = date(today.year, month, 1)
+            last = first.replace(day=monthrange(first.year, month)[1])
+            if last < today:
+                first, last = first.replace(year=first.year + 1), last.replace(year=last.year + 1)
+            return max(first, today), last
+    return None, None
+
+
+def category_filter(text, categories):
+    """Category whose name appears in ``text`` in any case form ("детьми" -> "Детям").
+
+    Every word of four letters or more in the name must appear; shorter
+    ones ("в", "от", "для") would match almost any question. The most
+    specific matching category wins.
+    """
+    words = WORD_RE.findall(text)
+    best, best_stems = None, 0
+    for category in categories:
+        # Drop the ending: "концерты" -> "концерт", "детям" -> "дет"
+        stems = [name_word[:max(3, len(name_word) - 2)]
+                 for name_word in WORD_RE.findall(category.lower()) if len(name_word) >= 4]
+        if len(stems) > best_stems and all(any(word.startswith(stem) for word in words) for stem in stems):
+            best, best_stems = category, len(stems)
+    return best
+
+
+def price_filter(text):
+    """Highest acceptable ticket price in tenge, or None"""
+    if FREE_RE.search(text):
+        return 0
+    match = PRICE_RE.search(text)
+    if not match:
+        return None
+    price = int(re.sub(r'\D', '', match.group(1)))
+    if match.group(2) and price < 1000:
+        price *= 1000
+    # "дети до 7 лет" is an age, not a price
+    return price if price >= 100 else None
+
+
+def question_filters(question, categories=(), today=None):
+    """EventStore.query keyword arguments for the constraints in ``question``"""
+    text = question.lower().replace('ё', 'е')
+    today = today or date.today()
+    filters = {}
+
+    category = category_filter(text, categories)
+    if category:
+        filters['category'] = category
+    date_from, date_to = date_filters(text, today)
+    if date_from:
+        filters['date_from'] = date_from.isoformat()
+        filters['date_to'] = date_to.isoformat()
+    max_price = price_filter(text)
+    if max_price is not None:
+        filters['max_price'] = max_price
+    return filters
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python event_query.py "<question>"')
+        sys.exit(1)
+    question = ' '.join(sys.argv[1:])
+
+    with open_store() as store:
+        filters = question_filters(question, store.categories())
+        started = time.perf_counter()
+        events = store.query(**filters)
+        elapsed = time.perf_counter() - started
+
+    print(f"Filters: {filters or 'none'}")
+    print(f"Found {len(events)} events in {elapsed * 1000:.2f}ms")
+    for event in events[:20]:
+        print(f"  [{event['id']}] {event.get('name')} | {event.get('category')} | "
+              f"{event.get('ticket_price')} | {event.get('address')}")
+
+
+if __name__ == '__main__':
+    main()
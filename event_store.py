@@ -0,0 +1,341 @@
+"""Indexed SQLite store for scraped events.
+
+Replaces loading and rewriting the whole ``sxodim_data.json`` in every
+stage. Each event is one row holding the full record as JSON, plus
+indexed columns for the lookups the pipeline makes: ``id``,
+``category``, the first/last ``event_dates``, the lowest and highest
+``ticket_price`` in tenge and a ``needs_content`` flag for events still
+missing reader content. Every date an event is on also goes into the
+``event_days`` table. Stages read only the rows they need and update
+single rows in place.
+
+``query()`` answers structured questions ("concerts this weekend under
+5000 tg") from those indexes without decoding other rows:
+
+    store.query(category='Концерты', date_from='2025-06-07', date_to='2025-06-08', max_price=5000)
+
+``sxodim_data.json`` is still produced as an export for people and
+tools that want one file:
+
+    python event_store.py import [sxodim_data.json]
+    python event_store.py export [sxodim_data.json]
+    python event_store.py stats
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+EVENT_STORE_PATH = os.getenv("EVENT_STORE_PATH", "sxodim.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    category TEXT,
+    first_date TEXT,
+    last_date TEXT,
+    needs_content INTEGER NOT NULL DEFAULT 0,
+    removed INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    data TEXT NOT NULL,
+    price_min INTEGER,
+    price_max INTEGER
+);
+-- One row per day an active event is on, with copies of the filter
+-- columns so date queries never touch the wide events rows
+CREATE TABLE IF NOT EXISTS event_days (
+    day TEXT NOT NULL,
+    event_id INTEGER NOT NULL,
+    category TEXT,
+    price_min INTEGER,
+    PRIMARY KEY (day, event_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Created after MIGRATIONS, so older databases have the columns by then
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_events_category ON events(category, first_date);
+CREATE INDEX IF NOT EXISTS idx_events_dates ON events(first_date, last_date);
+CREATE INDEX IF NOT EXISTS idx_events_price ON events(price_min);
+CREATE INDEX IF NOT EXISTS idx_events_needs_content ON events(needs_content) WHERE needs_content = 1;
+CREATE INDEX IF NOT EXISTS idx_event_days_event ON event_days(event_id);
+"""
+
+# Columns added after the first release: (column, type)
+MIGRATIONS = [('price_min', 'INTEGER'), ('price_max', 'INTEGER')]
+
+DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+# "5000", "5 000", "5\xa0000"; a thousands separator needs exactly 3 digits after it
+PRICE_RE = re.compile(r'\d{1,3}(?:[ \u00a0\u202f]\d{3})+(?!\d)|\d+')
+FREE_RE = re.compile(r'бесплатн|вход свободный|free|(?<!\d)0\s*(?:тг|₸|тенге)', re.IGNORECASE)
+AGE_RE = re.compile(r'\d+\s*\+')
+
+
+def event_days(event):
+    """Sorted ISO dates mentioned in an event's event_dates"""
+    return sorted(set(DATE_RE.findall(json.dumps(event.get('event_dates') or [], ensure_ascii=False))))
+
+
+def date_range(event):
+    """First and last ISO date mentioned in an event's event_dates"""
+    days = event_days(event)
+    if not days:
+        return None, None
+    return days[0], days[-1]
+
+
+def parse_price(text):
+    """Lowest and highest price in tenge from a ticket_price string.
+
+    "от 5000 тг" -> (5000, None), "3 000 - 7 000 ₸" -> (3000, 7000),
+    "5000 тг" -> (5000, 5000), "Бесплатно" -> (0, 0), unknown -> (None, None).
+    """
+    if not text:
+        return None, None
+    text = str(text)
+    prices = [int(re.sub(r'\D', '', match)) for match in PRICE_RE.findall(AGE_RE.sub(' ', text))]
+    # "тыс" means thousands: "от 5 тыс. тг"
+    if 'тыс' in text.lower():
+        prices = [p * 1000 if p < 1000 else p for p in prices]
+    # Anything cheaper is a count or a date, not a ticket price
+    prices = [p for p in prices if p >= 100]
+    if not prices:
+        # "2000 тг, дети бесплатно" is a paid event
+        return (0, 0) if FREE_RE.search(text) else (None, None)
+    if len(prices) == 1 and re.search(r'(?<!\w)от(?!\w)', text.lower()):
+        return prices[0], None
+    return min(prices), max(prices)
+
+
+def needs_content(event):
+    return bool(event.get('url') and event.get('markdown_content') is None and not event.get('removed'))
+
+
+class EventStore:
+
+    def __init__(self, path=None):
+        self.path = path or EVENT_STORE_PATH
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.executescript(INDEXES)
+
+    def _migrate(self):
+        """Add columns missing from an older database and fill them in"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(events)")}
+        missing = [(name, kind) for name, kind in MIGRATIONS if name not in columns]
+        if not missing:
+            return
+        with self.conn:
+            for name, kind in missing:
+                self.conn.execute(f"ALTER TABLE events ADD COLUMN {name} {kind}")
+            self._write(list(self.iter_events(include_removed=True)))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, events, clear_days=True):
+        rows, days = [], []
+        updated_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        for event in events:
+            dates = event_days(event)
+            price_min, price_max = parse_price(event.get('ticket_price'))
+            rows.append((
+                event['id'], event.get('name'), event.get('category'),
+                dates[0] if dates else None, dates[-1] if dates else None,
+                int(needs_content(event)), int(bool(event.get('removed'))),
+                updated_at, json.dumps(event, ensure_ascii=False), price_min, price_max,
+            ))
+            if not event.get('removed'):
+                days.extend((day, event['id'], event.get('category'), price_min) for day in dates)
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO events "
+            "(id, name, category, first_date, last_date, needs_content, removed, updated_at, data, "
+            "price_min, price_max) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        if clear_days:
+            self.conn.executemany("DELETE FROM event_days WHERE event_id = ?", ((row[0],) for row in rows))
+        self.conn.executemany("INSERT INTO event_days (day, event_id, category, price_min) VALUES (?, ?, ?, ?)", days)
+
+    def upsert(self, events):
+        """Insert or replace whole event records"""
+        with self.conn:
+            self._write(events)
+
+    def replace_all(self, events):
+        """Make ``events`` the full contents of the store, in one transaction"""
+        with self.conn:
+            self.conn.execute("DELETE FROM events")
+            self.conn.execute("DELETE FROM event_days")
+            self._write(events, clear_days=False)
+
+    def update(self, event_id, **fields):
+        """Patch some fields of one event; returns the updated record or None"""
+        event = self.get(event_id)
+        if event is None:
+            return None
+        event.update(fields)
+        self.upsert([event])
+        return event
+
+    def get(self, event_id):
+        row = self.conn.execute("SELECT data FROM events WHERE id = ?", (event_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def iter_events(self, include_removed=False, category=None, date_from=None, date_to=None):
+        """Events in id order, optionally filtered by category and date overlap"""
+        query = "SELECT data FROM events WHERE 1=1"
+        params = []
+        if not include_removed:
+            query += " AND removed = 0"
+        if category is not None:
+            query += " AND category = ?"
+            params.append(category)
+        if date_from is not None:
+            query += " AND last_date >= ?"
+            params.append(date_from)
+        if date_to is not None:
+            query += " AND first_date <= ?"
+            params.append(date_to)
+        for (data,) in self.conn.execute(query + " ORDER BY id", params):
+            yield json.loads(data)
+
+    def query(self, category=None, date_from=None, date_to=None, max_price=None, min_price=None,
+              limit=None):
+        """Active events matching typed filters, soonest first.
+
+        Dates select events with at least one day in [date_from, date_to];
+        prices compare against the cheapest ticket. Events with an unknown
+        price never match a price filter.
+        """
+        where, params = query_filters(category, date_from, date_to, max_price, min_price)
+        sql = f"SELECT e.data FROM events e WHERE {where} ORDER BY e.first_date, e.id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [json.loads(data) for (data,) in self.conn.execute(sql, params)]
+
+    def categories(self):
+        """Distinct categories, one index seek each instead of a full scan"""
+        categories, last = [], ''
+        while True:
+            (category,) = self.conn.execute("SELECT MIN(category) FROM events WHERE category > ?", (last,)).fetchone()
+            if category is None:
+                return categories
+            categories.append(category)
+            last = category
+
+    def events_needing_content(self):
+        for (data,) in self.conn.execute("SELECT data FROM events WHERE needs_content = 1 ORDER BY id"):
+            yield json.loads(data)
+
+    def count(self, include_removed=False):
+        query = "SELECT COUNT(*) FROM events" + ("" if include_removed else " WHERE removed = 0")
+        return self.conn.execute(query).fetchone()[0]
+
+    def digest(self):
+        """Hash of the active event records; changes whenever any of them does"""
+        digest = hashlib.sha256()
+        for (data,) in self.conn.execute("SELECT data FROM events WHERE removed = 0 ORDER BY id"):
+            digest.update(data.encode('utf-8') + b'\n')
+        return digest.hexdigest()
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def import_json(self, path='sxodim_data.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.upsert(data['events'])
+        if data.get('scraped_at'):
+            self.set_meta('scraped_at', data['scraped_at'])
+        return len(data['events'])
+
+    def export_json(self, path='sxodim_data.json'):
+        """Write the sxodim_data.json snapshot, tombstones included"""
+        events = list(self.iter_events(include_removed=True))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'total_events': len(events),
+                'scraped_at': self.get_meta('scraped_at', time.strftime('%Y-%m-%d %H:%M:%S')),
+                'events': events
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return len(events)
+
+
+def query_filters(category=None, date_from=None, date_to=None, max_price=None, min_price=None):
+    """SQL condition on ``events e`` for the typed filters, and its parameters.
+
+    With dates, every filter runs on the narrow ``event_days`` rows
+    (a range scan on day) and only matching events are looked up.
+    """
+    where, params = [], []
+    if category is not None:
+        where.append("category = ?")
+        params.append(category)
+    if max_price is not None:
+        where.append("price_min <= ?")
+        params.append(max_price)
+    if min_price is not None:
+        where.append("price_min >= ?")
+        params.append(min_price)
+    if date_from is None and date_to is None:
+        return ' AND '.join(["e.removed = 0"] + [f"e.{condition}" for condition in where]), params
+    days = ' AND '.join(["day BETWEEN ? AND ?"] + where)
+    return (f"e.removed = 0 AND e.id IN (SELECT event_id FROM event_days WHERE {days})",
+            [date_from or '0000-00-00', date_to or '9999-99-99'] + params)
+
+
+def open_store(path=None, json_path='sxodim_data.json'):
+    """Open the store, importing sxodim_data.json the first time if it exists"""
+    store = EventStore(path)
+    if store.count(include_removed=True) == 0 and os.path.exists(json_path):
+        count = store.import_json(json_path)
+        print(f"Imported {count} events from {json_path} into {store.path}")
+    return store
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    json_path = sys.argv[2] if len(sys.argv) > 2 else 'sxodim_data.json'
+
+    with EventStore() as store:
+        if command == 'import':
+            print(f"Imported {store.import_json(json_path)} events into {store.path}")
+        elif command == 'export':
+            print(f"Exported {store.export_json(json_path)} events to {json_path}")
+        elif command == 'stats':
+            print(f"Events: {store.count()} active, {store.count(include_removed=True)} total")
+            print(f"Need reader content: {sum(1 for _ in store.events_needing_content())}")
+        else:
+            print(f"Unknown command: {command} (use import, export or stats)")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
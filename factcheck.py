@@ -0,0 +1,270 @@
+"""Fact check of generated answers against their source events.
+
+The generators keep whatever the model returns, and an answer can quote
+a price, date, time or address the event does not have. Each SFT
+``output`` and ORPO ``chosen`` answer is checked against the event it was
+generated from (looked up by ``event_id`` in the event store):
+
+    price     amounts in tenge ("от 3 000 тг", "2000-4000 тенге", "5 тыс ₸")
+              must be among the event's prices; a free event must be free
+              for everyone in the source too ("детям до 7 лет вход
+              бесплатный" is not), unless the answer quotes a price
+    date      "23 января", "23.01", "2025-01-23", "13-го числа" must be a
+              date of the event or appear in its description
+    time      "19:30" must appear in the event
+    address   "ул. Гоголя, 40Б": the street and house number must appear
+    number    any other number missing from the event (reported only)
+
+Facts of each event are extracted once, so the whole dataset is checked
+in one streaming pass. Answers with a mismatch in one of the
+FACTCHECK_DROP checks are dropped, as are answers whose event is not in
+the store; with ``--flag-only`` everything is kept and only reported:
+
+    python factcheck.py sft    # sft_dataset.json -> sft_dataset_verified.json
+    python factcheck.py orpo   # orpo_dataset.json -> orpo_dataset_verified.json
+
+A report with counts per check and the dropped answers goes to
+factcheck_report_<kind>.json.
+"""
+import argparse
+import json
+import os
+import re
+import time
+from collections import Counter
+
+from dedup import first_content, user_prompt
+from event_query import MONTH_RE, month_number
+from event_store import AGE_RE, DATE_RE, FREE_RE, PRICE_RE, event_days, open_store
+from journal import write_json_array
+from json_stream import iter_array
+
+FACTCHECK_DROP = os.getenv("FACTCHECK_DROP", "price,date,time,address").split(',')  # Checks that drop an answer
+MAX_EXAMPLES = 50
+
+# Amounts followed by a currency: "3000 тг", "от 2 000 до 4 000 тенге", "5-7 тыс. ₸"
+NUMBER = PRICE_RE.pattern
+MONEY_RE = re.compile(
+    rf'((?:(?:{NUMBER})\s*(?:тыс\.?\s*)?(?:-|–|—|до|или|и)\s*)*(?:{NUMBER}))\s*(тыс\.?\s*)?(?:тг|тенге|₸|kzt)',
+    re.IGNORECASE,
+)
+CURRENCY_RE = re.compile(r'тг|тенге|₸|kzt', re.IGNORECASE)
+NUMERIC_DATE_RE = re.compile(r'(?<![\d.])(\d{1,2})\.(\d{1,2})(?:\.(?:\d{4}|\d{2}))?(?![\d.])')
+DAY_ONLY_RE = re.compile(r'(?<!\d)(\d{1,2})-?го\s+числа')
+TIME_RE = re.compile(r'(?<![\d:])([01]?\d|2[0-3]):([0-5]\d)(?![\d:])')
+STREET_TYPES = (r'ул\.|улиц[аеыу]|пр\.|пр-т|просп\.|проспект[аеу]?|мкр\.?|микрорайон[аеу]?|бульвар[аеу]?|б-р|'
+                r'пер\.|переул(?:ок|ке|ка)|шоссе')
+# "ул. Гоголя, 40Б": street name and house number
+ADDRESS_RE = re.compile(
+    rf'(?<!\w)(?:{STREET_TYPES})\s*([А-ЯЁA-Z][\w-]*)(?:,?\s*(?:д\.\s*)?(\d+[а-яА-Яa-zA-Z]?(?:/\d+)?)(?![\w/]))?'
+)
+HOUSE_RE = re.compile(r'(?<!\d)\d+[а-яa-z]?(?:/\d+)?(?![\w/])')
+TAG_RE = re.compile(r'<[^>]+>')
+SENTENCE_RE = re.compile(r'[.!?;\n]+')
+# "Бесплатно" for some visitors only: children, students, pensioners
+SOME_VISITORS_RE = re.compile(r'дет|ребен|малыш|школьник|студент|пенсионер|льгот|до\s*\d+\s*(?:лет|года)')
+
+# (input file, question text, answer text) per dataset kind
+DATASETS = {
+    'sft': ('sft_dataset.json', lambda r: r.get('instruction', ''), lambda r: r.get('output', '')),
+    'orpo': ('orpo_dataset.json', user_prompt, lambda r: first_content(r.get('chosen'))),
+}
+
+
+def number(text):
+    return int(re.sub(r'\D', '', text))
+
+
+def money(text):
+    """Amounts in tenge quoted in ``text``"""
+    amounts = set()
+    if not CURRENCY_RE.search(text):
+        return amounts
+    for match in MONEY_RE.finditer(text):
+        values = [number(n) for n in PRICE_RE.findall(match.group(1))]
+        if 'тыс' in match.group(0).lower():
+            values = [v * 1000 if v < 1000 else v for v in values]
+        amounts.update(v for v in values if v > 0)
+    return amounts
+
+
+def day_months(text):
+    """(day, month) pairs of the dates written in ``text``"""
+    dates = set()
+    for match in MONTH_RE.finditer(text):
+        if match.group(1):
+            dates.add((int(match.group(1)), month_number(match.group(2))))
+    for match in NUMERIC_DATE_RE.finditer(text):
+        day, month = int(match.group(1)), int(match.group(2))
+        if 1 <= day <= 31 and 1 <= month <= 12:
+            dates.add((day, month))
+    for iso in DATE_RE.findall(text):
+        dates.add((int(iso[8:10]), int(iso[5:7])))
+    return dates
+
+
+def times(text):
+    return {f"{int(h)}:{m}" for h, m in TIME_RE.findall(text)}
+
+
+def claims_free(text):
+    """``text`` says the event itself is free, not only for some visitors"""
+    return any(FREE_RE.search(sentence) and not SOME_VISITORS_RE.search(sentence)
+               for sentence in SENTENCE_RE.split(text))
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def source_facts(event):
+    """Everything an answer about ``event`` may quote, extracted once per event"""
+    content = event.get('markdown_content') or TAG_RE.sub(' ', event.get('content_html') or '')
+    text = normalize('\n'.join(str(part) for part in (
+        event.get('name'), event.get('category'), event.get('address'), event.get('ticket_price'),
+        event.get('description'), content, json.dumps(event.get('event_dates') or [], ensure_ascii=False),
+    ) if part))
+
+    # A bare "3000 - 5000" in ticket_price is a price too
+    ticket_price = normalize(str(event.get('ticket_price') or ''))
+    prices = {number(n) for n in PRICE_RE.findall(AGE_RE.sub(' ', ticket_price))}
+    if 'тыс' in ticket_price:
+        prices = {p * 1000 if p < 1000 else p for p in prices}
+    dates = day_months(text) | {(int(day[8:10]), int(day[5:7])) for day in event_days(event)}
+    return {
+        'text': text,
+        'prices': {p for p in prices if p >= 100} | money(text),
+        'free': claims_free(text),
+        'dates': dates,
+        'days': {day for day, _ in dates},
+        'times': times(text),
+        'houses': set(HOUSE_RE.findall(text)),
+        'numbers': {number(n) for n in PRICE_RE.findall(text)},
+    }
+
+
+def check_answer(answer, facts):
+    """Mismatches of ``answer`` against the event facts: [(check, value)]"""
+    text = normalize(answer)
+    mismatches = []
+    checked = set()
+
+    amounts = money(text)
+    checked |= amounts
+    mismatches += [('price', amount) for amount in sorted(amounts - facts['prices'])]
+    # A paid event can still be free for children; with a price quoted that is what "бесплатно" means
+    if not amounts and claims_free(text) and not facts['free']:
+        mismatches.append(('price', 'бесплатно'))
+
+    dates = day_months(text)
+    checked |= {n for date in dates for n in date}
+    mismatches += [('date', f"{day:02d}.{month:02d}") for day, month in sorted(dates - facts['dates'])]
+    for day in DAY_ONLY_RE.findall(text):
+        checked.add(int(day))
+        if int(day) not in facts['days']:
+            mismatches.append(('date', f"{day}-го"))
+
+    quoted_times = times(text)
+    checked |= {int(n) for t in quoted_times for n in t.split(':')}
+    mismatches += [('time', t) for t in sorted(quoted_times - facts['times'])]
+
+    for street, house in ADDRESS_RE.findall(answer):
+        street = normalize(street)
+        if street[:max(4, len(street) - 2)] not in facts['text']:
+            mismatches.append(('address', street))
+        if house:
+            checked.add(number(house.split('/')[0]))
+            if normalize(house) not in facts['houses']:
+                mismatches.append(('address', f"{street} {house}"))
+
+    for value in sorted({number(n) for n in PRICE_RE.findall(AGE_RE.sub(' ', text))} - checked):
+        if value >= 10 and value not in facts['numbers']:
+            mismatches.append(('number', value))
+    return mismatches
+
+
+def factcheck(kind, input_path=None, drop=FACTCHECK_DROP, flag_only=False):
+    """Write the verified dataset and report; returns the report"""
+    default_input, question_text, answer_text = DATASETS[kind]
+    input_path = input_path or default_input
+    output_path = os.path.splitext(input_path)[0] + '_verified.json'
+    started = time.monotonic()
+
+    counts = Counter()
+    examples = []
+    facts = {}
+
+    with open_store() as store:
+        def checked_records(f):
+            for record in iter_array(f):
+                counts['records'] += 1
+                event_id = record.get('event_id')
+                if event_id not in facts:
+                    event = store.get(event_id)
+                    facts[event_id] = source_facts(event) if event else None
+
+                if facts[event_id] is None:
+                    mismatches = [('no_source', event_id)]
+                else:
+                    mismatches = check_answer(answer_text(record), facts[event_id])
+                for check in {check for check, _ in mismatches}:
+                    counts[check] += 1
+
+                dropped = any(check in drop or check == 'no_source' for check, _ in mismatches)
+                if mismatches and len(examples) < MAX_EXAMPLES and (dropped or flag_only):
+                    examples.append({'event_id': event_id, 'question': question_text(record),
+                                     'answer': answer_text(record), 'mismatches': mismatches})
+                if dropped and not flag_only:
+                    counts['dropped'] += 1
+                    continue
+                yield record
+
+        with open(input_path, 'r', encoding='utf-8') as f:
+            kept = write_json_array(output_path, checked_records(f))
+
+    report = {
+        'input': input_path,
+        'output': output_path,
+        'drop': [] if flag_only else list(drop) + ['no_source'],
+        'records': counts['records'],
+        'events': len(facts),
+        'kept': kept,
+        'dropped': counts['dropped'],
+        'dropped_pct': round(100 * counts['dropped'] / max(1, counts['records']), 1),
+        'mismatches': {check: counts[check] for check in ('price', 'date', 'time', 'address', 'number',
+                                                          'no_source')},
+        'seconds': round(time.monotonic() - started, 2),
+        'examples': examples,
+    }
+    with open(f'factcheck_report_{kind}.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drop generated answers whose facts do not match their event")
+    parser.add_argument('kind', choices=sorted(DATASETS))
+    parser.add_argument('--input', help="dataset JSON array (default depends on kind)")
+    parser.add_argument('--flag-only', action='store_true', help="keep every record, only report mismatches")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"FACT CHECK {args.kind.upper()}")
+    print("=" * 60)
+
+    report = factcheck(args.kind, args.input, flag_only=args.flag_only)
+
+    print(f"Records: {report['records']} about {report['events']} events")
+    print("Answers with mismatches: " + ', '.join(f"{check} {n}" for check, n in report['mismatches'].items()))
+    print(f"Dropped: {report['dropped']} ({report['dropped_pct']}%), kept: {report['kept']}, "
+          f"{report['seconds']}s")
+    for example in report['examples'][:5]:
+        print(f"  [{example['event_id']}] {example['answer'][:70]}... {example['mismatches'][:3]}")
+    print("=" * 60)
+    print(f"Saved to: {report['output']}")
+    print(f"Report: factcheck_report_{args.kind}.json")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
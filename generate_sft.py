@@ -1,23 +1,32 @@
-import json
-import time
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
+from generation import GenerationTask, event_text, run
+from journal import write_json_array
 
-load_dotenv()
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+class SFTTask(GenerationTask):
+    """12-15 question-answer pairs per event"""
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY,
-)
+    name = "SFT DATASET GENERATOR"
+    stage = 'sft'
+    journal_path = 'sft_dataset.jsonl'
 
-def generate_qa_pairs(event):
-    """Generate question-answer pairs for an event using Gemini"""
+    batch_task = 'создай 12-15 разнообразных пар "вопрос-ответ" на русском языке'
+    item_example = '{"question": "вопрос пользователя", "answer": "ответ ассистента"}'
+
+    requirements = """Требования к вопросам:
+1. Вопросы должны быть естественными, как если бы их задавал пользователь в чате
+2. Включи разные типы вопросов:
+   - Общие вопросы ("Что посоветуешь на выходные?", "Куда сходить сегодня?")
+   - Конкретные вопросы о мероприятии ("Когда начало концерта X?", "Сколько стоят билеты на Y?")
+   - Вопросы о месте проведения ("Где находится Z?", "Как добраться до X?")
+   - Рекомендательные вопросы ("Что интересного для детей?", "Какие концерты есть в эти выходные?")
+
+3. Ответы должны быть:
+   - Информативными и полезными
+   - Дружелюбными в тоне
+   - Содержать конкретные данные из мероприятия (дата, время, цена, адрес)"""
 
-    # Prepare event context
-    event_context = f"""
+    def event_context(self, event):
+        return f"""
 Название: {event.get('name', 'Не указано')}
 Категория: {event.get('category', 'Не указано')}
 Город: {event.get('city', 'Алматы')}
@@ -27,132 +36,58 @@ def generate_qa_pairs(event):
 URL: {event.get('url', '')}
 
 Полное содержимое:
-{event.get('markdown_content', event.get('content_html', 'Нет информации'))[:4000]}
+{event_text(event, 4000) or 'Нет информации'}
 """
 
-    prompt = f"""На основе информации о мероприятии в Алматы, создай 12-15 разнообразных пар "вопрос-ответ" на русском языке.
+    def build_prompt(self, event):
+        return f"""На основе информации о мероприятии в Алматы, {self.batch_task}.
 
 Информация о мероприятии:
-{event_context}
-
-Требования к вопросам:
-1. Вопросы должны быть естественными, как если бы их задавал пользователь в чате
-2. Включи разные типы вопросов:
-   - Общие вопросы ("Что посоветуешь на выходные?", "Куда сходить сегодня?")
-   - Конкретные вопросы о мероприятии ("Когда начало концерта X?", "Сколько стоят билеты на Y?")
-   - Вопросы о месте проведения ("Где находится Z?", "Как добраться до X?")
-   - Рекомендательные вопросы ("Что интересного для детей?", "Какие концерты есть в эти выходные?")
+{self.event_context(event)}
 
-3. Ответы должны быть:
-   - Информативными и полезными
-   - Дружелюбными в тоне
-   - Содержать конкретные данные из мероприятия (дата, время, цена, адрес)
+{self.requirements}
 
 Формат ответа - JSON массив:
 [
-  {{"question": "вопрос пользователя", "answer": "ответ ассистента"}},
+  {self.item_example},
   ...
 ]
 
 Отвечай ТОЛЬКО JSON массивом, без дополнительного текста."""
 
-    try:
-        response = client.chat.completions.create(
-            model="google/gemini-3-flash-preview",
-            messages=[{"role": "user", "content": prompt}],
-            extra_body={
-                "reasoning": {"enabled": True},
-                "provider": {"allow_fallbacks": False, "only": ["google-ai-studio"]}
-            }
-        )
-
-        content = response.choices[0].message.content
-
-        # Clean up response - remove markdown code blocks if present
-        content = content.strip()
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
-
-        qa_pairs = json.loads(content)
-        return qa_pairs
-
-    except json.JSONDecodeError as e:
-        print(f"  JSON parse error: {e}")
-        print(f"  Raw content: {content[:200]}...")
-        return []
-    except Exception as e:
-        print(f"  API error: {e}")
-        return []
-
-def main():
-    # Load events data
-    with open('sxodim_data.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    events = data['events']
-
-    print("=" * 60)
-    print("SFT DATASET GENERATOR")
-    print("=" * 60)
-    print(f"Total events: {len(events)}")
-    print("=" * 60)
-
-    sft_dataset = []
-
-    for i, event in enumerate(events):
-        name = event.get('name', 'Unknown')[:45]
-        print(f"[{i+1}/{len(events)}] {name}...", end=" ", flush=True)
-
-        qa_pairs = generate_qa_pairs(event)
-
-        if qa_pairs:
-            for qa in qa_pairs:
-                sft_dataset.append({
-                    "instruction": qa.get("question", ""),
-                    "input": "",
-                    "output": qa.get("answer", ""),
-                    "event_id": event.get("id"),
-                    "event_name": event.get("name"),
-                    "category": event.get("category")
-                })
-            print(f"OK (+{len(qa_pairs)} pairs)")
-        else:
-            print("SKIP")
-
-        # Save progress every 10 events
-        if (i + 1) % 10 == 0:
-            with open('sft_dataset.json', 'w', encoding='utf-8') as f:
-                json.dump(sft_dataset, f, ensure_ascii=False, indent=2)
-            print(f"  [SAVED] {len(sft_dataset)} pairs total")
-
-        time.sleep(1)  # Rate limiting
-
-    # Final save
-    with open('sft_dataset.json', 'w', encoding='utf-8') as f:
-        json.dump(sft_dataset, f, ensure_ascii=False, indent=2)
-
-    # Also save in Alpaca format
-    alpaca_format = []
-    for item in sft_dataset:
-        alpaca_format.append({
+    def make_items(self, event, qa_pairs):
+        return [{
+            "instruction": qa.get("question", ""),
+            "input": "",
+            "output": qa.get("answer", ""),
+            "event_id": event.get("id"),
+            "event_name": event.get("name"),
+            "category": event.get("category")
+        } for qa in qa_pairs]
+
+    def write_outputs(self, items):
+        total = write_json_array('sft_dataset.json', items())
+
+        # Also save in Alpaca format
+        write_json_array('sft_dataset_alpaca.json', ({
             "instruction": item["instruction"],
             "input": item["input"],
             "output": item["output"]
-        })
+        } for item in items()))
+
+        return (f"DONE! Generated {total} QA pairs\n"
+                f"Saved to: sft_dataset.json\n"
+                f"Saved to: sft_dataset_alpaca.json (Alpaca format)")
+
+
+def generate_qa_pairs(event):
+    """Generate question-answer pairs for an event using Gemini"""
+    return SFTTask().generate(event)
 
-    with open('sft_dataset_alpaca.json', 'w', encoding='utf-8') as f:
-        json.dump(alpaca_format, f, ensure_ascii=False, indent=2)
 
-    print("\n" + "=" * 60)
-    print(f"DONE! Generated {len(sft_dataset)} QA pairs")
-    print(f"Saved to: sft_dataset.json")
-    print(f"Saved to: sft_dataset_alpaca.json (Alpaca format)")
-    print("=" * 60)
+def main():
+    run(SFTTask())
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,427 @@
+"""Shared generation engine for the SFT and ORPO datasets.
+
+A ``GenerationTask`` describes one kind of dataset built per event: how
+to prompt the model, how to turn its JSON reply into dataset rows and
+which files to compact the results into. ``run_task`` drives any task the
+same way:
+
+* up to ``GENERATION_CONCURRENCY`` model requests are in flight, each
+  going through the shared rate limiter, retry logic and response cache;
+* every finished event that yielded items is appended to the task's
+  journal together with a hash of its prompt, and to a small ``.idx``
+  sidecar holding just ``[event_id, key, journal size]``; events without
+  items are retried on the next run;
+* on start only the index is read, so deciding whether an event is
+  already done is a dict lookup. The index is rebuilt from the journal
+  when the journal is missing or shorter than the index says. Events
+  are regenerated when their prompt changes, i.e. when the event itself
+  or the template changed;
+* compaction yields journal items in source-event order, so outputs do
+  not depend on completion order.
+
+With ``GENERATION_BATCH_EVENTS`` > 1, several events are packed into one
+request (up to ``BATCH_TOKEN_BUDGET`` estimated prompt tokens) so the
+instruction block is paid for once per batch. The model answers with a
+JSON object keyed by event id, which is split back into per-event
+results; events missing from a batch reply are retried on their own.
+
+The journal is kept after compaction; delete it (and its ``.idx``) to
+start from scratch. A stale ``.idx`` left behind is rebuilt anyway.
+
+Request latency, token usage (and cost, when the API reports it), cache
+hits, reply outcomes and skipped events are recorded in ``metrics``; the
+run report goes to ``metrics/<stage>.json``.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai import OpenAI, APIConnectionError
+from dotenv import load_dotenv
+
+import metrics
+from event_store import open_store
+from journal import Journal, read_journal, repair_tail
+from json_stream import JSONStreamExtractor
+from llm_cache import ResponseCache, cache_key
+from rate_limit import get_bucket, call_with_backoff
+
+load_dotenv()
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+MODEL = "google/gemini-3-flash-preview"
+EXTRA_BODY = {
+    "reasoning": {"enabled": True},
+    "provider": {"allow_fallbacks": False, "only": ["google-ai-studio"]}
+}
+
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "4"))  # Model requests in flight
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "180"))           # Seconds per model request
+GENERATION_BATCH_EVENTS = int(os.getenv("GENERATION_BATCH_EVENTS", "1"))  # Events per request
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", "12000"))       # Prompt tokens per batch
+GENERATION_STREAM = os.getenv("GENERATION_STREAM", "0") == "1"            # Use the streaming API
+
+client = OpenAI(
+    base_url=OPENROUTER_BASE_URL,
+    api_key=OPENROUTER_API_KEY,
+    max_retries=0,  # Retries are handled by call_with_backoff
+    timeout=REQUEST_TIMEOUT,
+)
+
+response_cache = ResponseCache()
+
+# Reply parsing totals for the run: fully valid vs partially salvaged replies
+parse_stats = {'complete': 0, 'partial': 0, 'recovered': 0, 'lost': 0}
+parse_stats_lock = threading.Lock()
+
+
+def load_events(**filters):
+    """Scraped events from the event store, minus tombstoned ones.
+
+    ``filters`` are passed to ``EventStore.iter_events`` (category,
+    date_from, date_to).
+    """
+    with open_store() as store:
+        return list(store.iter_events(**filters))
+
+
+def event_text(event, limit):
+    """Best available page content for an event, truncated to ``limit`` chars"""
+    return (event.get('markdown_content') or event.get('content_html') or '')[:limit]
+
+
+def estimate_tokens(text):
+    """Rough token count for mixed Russian/English text"""
+    return len(text) // 3
+
+
+def record_usage(usage, seconds, label):
+    """Token usage, cost and latency of one model request"""
+    metrics.inc('llm_requests_total', model=MODEL)
+    metrics.observe('llm_request_seconds', seconds, model=MODEL)
+    metrics.track('llm_request_seconds', seconds, label=label)
+    if usage is None:
+        metrics.inc('llm_usage_missing_total', model=MODEL)
+        return
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    metrics.inc('llm_tokens_total', prompt_tokens, kind='prompt', model=MODEL)
+    metrics.inc('llm_tokens_total', completion_tokens, kind='completion', model=MODEL)
+    metrics.observe('llm_request_tokens', prompt_tokens + completion_tokens, buckets=metrics.TOKEN_BUCKETS,
+                    model=MODEL)
+    metrics.track('llm_request_tokens', prompt_tokens + completion_tokens, label=label)
+    # OpenRouter reports the price of the request in credits (USD)
+    cost = getattr(usage, 'cost', None)
+    if cost is not None:
+        metrics.inc('llm_cost_total', cost, model=MODEL)
+        metrics.track('llm_request_cost', cost, label=label)
+
+
+def chat_completion(prompt, extractor, label=None):
+    """Raw reply text for a prompt, fed to ``extractor`` as it arrives.
+
+    With GENERATION_STREAM the reply is streamed, so whatever arrived
+    before a dropped connection is still returned and can be salvaged.
+    ``label`` names the request (event ids) in the metrics outliers.
+    """
+    request = lambda **kwargs: client.chat.completions.create(
+        model=MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        # Asking for usage does not change the request's cache key
+        extra_body=dict(EXTRA_BODY, usage={"include": True}),
+        **kwargs
+    )
+
+    started = time.monotonic()
+    if not GENERATION_STREAM:
+        response = call_with_backoff(request, get_bucket('openrouter'), transient=(APIConnectionError,))
+        record_usage(response.usage, time.monotonic() - started, label)
+        raw = response.choices[0].message.content or ''
+        extractor.feed(raw)
+        return raw
+
+    stream = call_with_backoff(lambda: request(stream=True, stream_options={"include_usage": True}),
+                               get_bucket('openrouter'), transient=(APIConnectionError,))
+    parts = []
+    usage = None
+    try:
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                extractor.feed(delta)
+            usage = getattr(chunk, 'usage', None) or usage
+    except Exception as e:
+        metrics.inc('llm_stream_interrupted_total', model=MODEL)
+        print(f"  Stream interrupted: {e}")
+    record_usage(usage, time.monotonic() - started, label)
+    return ''.join(parts)
+
+
+def record_parse(stats):
+    with parse_stats_lock:
+        parse_stats['complete' if stats['complete'] else 'partial'] += 1
+        parse_stats['recovered'] += stats['recovered']
+        parse_stats['lost'] += stats['lost']
+
+
+def request_json(prompt, label=None):
+    """Send a prompt and extract the JSON reply; returns [] on failure.
+
+    Complete elements of a partially valid reply are kept. Only fully
+    valid, non-empty replies are cached by (model, prompt, extra_body).
+    """
+    key = cache_key(MODEL, prompt, EXTRA_BODY)
+    raw = response_cache.get(key)
+    cached = raw is not None
+    metrics.inc('llm_cache_total', result='hit' if cached else 'miss')
+    extractor = JSONStreamExtractor()
+
+    try:
+        if cached:
+            extractor.feed(raw)
+        else:
+            raw = chat_completion(prompt, extractor, label)
+    except Exception as e:
+        metrics.inc('llm_replies_total', outcome='api_error')
+        print(f"  API error: {e}")
+        return []
+
+    stats = extractor.finish()
+    record_parse(stats)
+    metrics.inc('llm_replies_total', outcome='complete' if stats['complete'] else
+                'partial' if stats['recovered'] else 'unparseable')
+    if not stats['complete']:
+        print(f"  Partial JSON: recovered {stats['recovered']}, lost {stats['lost']}")
+        if not stats['recovered']:
+            print(f"  Raw content: {raw[:200]}...")
+    elif not cached and extractor.items:
+        response_cache.put(key, raw, model=MODEL)
+    return extractor.result()
+
+
+def dict_items(value):
+    """JSON objects from a reply that should be a list of them"""
+    if not isinstance(value, list):
+        return []
+    return [item for item in value if isinstance(item, dict)]
+
+
+class GenerationTask:
+    """One kind of per-event dataset; subclasses fill in the specifics"""
+
+    name = None
+    stage = None          # Short name for metrics reports
+    journal_path = None
+
+    # Prompt parts shared by the single-event and batched prompts
+    batch_task = None     # What to create for each event
+    requirements = None   # Instruction block
+    item_example = None   # One JSON item of the expected reply
+
+    def event_context(self, event):
+        raise NotImplementedError
+
+    def build_prompt(self, event):
+        raise NotImplementedError
+
+    def build_batch_prompt(self, events):
+        blocks = "\n".join(f"=== Мероприятие id={event.get('id')} ===\n{self.event_context(event)}" for event in events)
+        return f"""Ниже информация о нескольких мероприятиях в Алматы ({len(events)} шт.). Для КАЖДОГО мероприятия отдельно {self.batch_task}.
+
+{blocks}
+
+{self.requirements}
+
+Формат ответа - JSON объект, где ключ - id мероприятия, а значение - JSON массив для этого мероприятия:
+{{
+  "<id мероприятия>": [
+    {self.item_example},
+    ...
+  ],
+  ...
+}}
+
+Отвечай ТОЛЬКО JSON объектом, без дополнительного текста."""
+
+    def make_items(self, event, result):
+        """Dataset rows for one event's parsed model output"""
+        raise NotImplementedError
+
+    def write_outputs(self, items):
+        """Compact the task's items into its final files; returns a summary"""
+        raise NotImplementedError
+
+    def input_key(self, event):
+        """Changes whenever the request for this event would change"""
+        return cache_key(MODEL, self.build_prompt(event), EXTRA_BODY)
+
+    def generate(self, event):
+        return dict_items(request_json(self.build_prompt(event), label=f"event {event.get('id')}"))
+
+    def generate_batch(self, events):
+        """{event_id: result} for a batch, falling back to single requests"""
+        if len(events) == 1:
+            return {events[0].get('id'): self.generate(events[0])}
+
+        reply = request_json(self.build_batch_prompt(events),
+                             label=f"events {','.join(str(e.get('id')) for e in events)}")
+        results = {}
+        for event in events:
+            result = dict_items(reply.get(str(event.get('id')))) if isinstance(reply, dict) else []
+            if not result:
+                result = self.generate(event)
+            results[event.get('id')] = result
+        return results
+
+
+def make_batches(task, events, max_events, token_budget):
+    """Greedily pack events into batches under the prompt token budget"""
+    batches = []
+    batch, used = [], 0
+    overhead = estimate_tokens(task.build_batch_prompt([])) if max_events > 1 else 0
+    for event in events:
+        cost = estimate_tokens(task.event_context(event))
+        if batch and (len(batch) >= max_events or overhead + used + cost > token_budget):
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append(event)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def index_path(journal_path):
+    return journal_path + '.idx'
+
+
+def load_index(journal_path):
+    """{event_id: key} of completed events, rebuilt from the journal if needed.
+
+    The index is only trusted when the journal exists and is at least as
+    long as the journal sizes recorded in it; a journal deleted or
+    replaced since would otherwise leave every event marked as done.
+    """
+    path = index_path(journal_path)
+    index = {}
+    if os.path.exists(path) and os.path.exists(journal_path):
+        repair_tail(path)
+        covered = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                index[entry[0]] = entry[1]
+                if len(entry) > 2:
+                    covered = max(covered, entry[2])
+        if os.path.getsize(journal_path) >= covered:
+            return index
+        index = {}
+
+    for record in read_journal(journal_path):
+        index[record['event_id']] = record.get('key')
+    size = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for event_id, key in index.items():
+            f.write(json.dumps([event_id, key, size]) + '\n')
+    return index
+
+
+def is_done(index, event_id, key):
+    """Completed with the same input; records without a key are stale"""
+    return event_id in index and index[event_id] == key
+
+
+def run_task(task, events, concurrency=None, batch_events=None):
+    """Generate items for every event whose input is not in the journal yet"""
+    concurrency = concurrency or GENERATION_CONCURRENCY
+    batch_events = batch_events or GENERATION_BATCH_EVENTS
+    index = load_index(task.journal_path)
+    keys = {e.get('id'): task.input_key(e) for e in events}
+    pending = [e for e in events if not is_done(index, e.get('id'), keys[e.get('id')])]
+    batches = make_batches(task, pending, batch_events, BATCH_TOKEN_BUDGET)
+    stats = {'already_done': len(events) - len(pending), 'batches': len(batches),
+             'generated': 0, 'skipped': 0, 'items': 0}
+
+    metrics.inc('events_skipped_total', stats['already_done'], stage=task.stage, reason='already_done')
+    if stats['already_done']:
+        print(f"Resuming: {stats['already_done']} events already in {task.journal_path}")
+    print(f"Pending: {len(pending)} events in {len(batches)} requests, concurrency {concurrency}")
+
+    with Journal(task.journal_path) as journal, \
+            Journal(index_path(task.journal_path)) as index_file, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(timed_batch, task, batch): batch for batch in batches}
+        n = 0
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"  Worker error: {e}")
+                results = None
+
+            for event in futures[future]:
+                n += 1
+                name = (event.get('name') or 'Unknown')[:45]
+                result = (results or {}).get(event.get('id'))
+                # An event without items is not journaled, so the next run retries it
+                items = task.make_items(event, result) if result else []
+                if items:
+                    key = keys[event.get('id')]
+                    end = journal.append({"event_id": event.get("id"), "key": key, "items": items})
+                    index_file.append([event.get("id"), key, end])
+                    stats['generated'] += 1
+                    stats['items'] += len(items)
+                    metrics.inc('events_generated_total', stage=task.stage)
+                    metrics.inc('items_generated_total', len(items), stage=task.stage)
+                    print(f"[{n}/{len(pending)}] {name}... OK (+{len(items)} pairs)")
+                else:
+                    stats['skipped'] += 1
+                    reason = 'worker_error' if results is None else 'empty_reply'
+                    metrics.inc('events_skipped_total', stage=task.stage, reason=reason)
+                    print(f"[{n}/{len(pending)}] {name}... SKIP")
+
+    return stats
+
+
+def timed_batch(task, batch):
+    with metrics.timer('generation_batch_seconds', stage=task.stage):
+        return task.generate_batch(batch)
+
+
+def ordered_items(journal_path, events):
+    """Journal items in source event order, independent of completion order.
+
+    The latest record per event wins. Records for events that are no
+    longer in ``events`` are dropped.
+    """
+    by_event = {}
+    for record in read_journal(journal_path):
+        by_event[record['event_id']] = record['items']
+    for event in events:
+        yield from by_event.get(event.get('id'), [])
+
+
+def run(task, events=None):
+    """Generate, then compact the task's journal into its outputs"""
+    events = load_events() if events is None else events
+
+    print("=" * 60)
+    print(task.name)
+    print("=" * 60)
+    print(f"Total events: {len(events)}")
+    print("=" * 60)
+
+    stats = run_task(task, events)
+    summary = task.write_outputs(lambda: ordered_items(task.journal_path, events))
+
+    print("\n" + "=" * 60)
+    print(summary)
+    print(f"LLM cache: {response_cache.stats()}")
+    print(f"Replies: {parse_stats}")
+    print(f"Metrics: {metrics.write_report(task.stage)}")
+    print("=" * 60)
+    return stats
@@ -0,0 +1,166 @@
+"""Small HTML -> markdown converter built on the standard library.
+
+Good enough for the event descriptions sxodim.com returns in ``content``:
+paragraphs, headings, emphasis, links, images, lists, blockquotes and
+simple tables. Scripts, styles and other non-content tags are dropped.
+"""
+import re
+from html.parser import HTMLParser
+
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'figure', 'figcaption', 'table', 'tr'}
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'iframe', 'head', 'nav', 'form', 'button'}
+VOID_TAGS = {'br', 'hr', 'img', 'meta', 'link', 'input', 'source', 'wbr'}
+
+
+class MarkdownConverter(HTMLParser):
+
+    def __init__(self, root_tags=None):
+        super().__init__(convert_charrefs=True)
+        self.root_tags = set(root_tags or ())
+        self.root_depth = 0 if not self.root_tags else None
+        self.out = []
+        self.skip_depth = 0
+        self.lists = []      # Stack of ['ul'|'ol', counter]
+        self.links = []      # Stack of hrefs for open <a> tags
+        self.quote_depth = 0
+        self.cell_count = 0
+
+    # Output helpers
+
+    def capturing(self):
+        return self.root_depth is not None and self.skip_depth == 0
+
+    def write(self, text):
+        if self.capturing():
+            self.out.append(text)
+
+    def newline(self, count=1):
+        if not self.capturing():
+            return
+        prefix = '> ' * self.quote_depth
+        self.out.append(('\n' + prefix) * count)
+
+    # Parser callbacks
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self.root_depth is None:
+            if tag in self.root_tags:
+                self.root_depth = 0
+            else:
+                return
+        if tag not in VOID_TAGS:
+            self.root_depth += 1
+
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+            return
+
+        if tag in BLOCK_TAGS:
+            self.newline(2)
+        elif re.fullmatch(r'h[1-6]', tag):
+            self.newline(2)
+            self.write('#' * int(tag[1]) + ' ')
+        elif tag == 'br':
+            self.newline()
+        elif tag == 'hr':
+            self.newline(2)
+            self.write('---')
+            self.newline(2)
+        elif tag in ('strong', 'b'):
+            self.write('**')
+        elif tag in ('em', 'i'):
+            self.write('*')
+        elif tag == 'a':
+            self.links.append(attrs.get('href'))
+            self.write('[')
+        elif tag == 'img':
+            if attrs.get('src'):
+                self.write(f"![{attrs.get('alt') or ''}]({attrs['src']})")
+        elif tag in ('ul', 'ol'):
+            self.lists.append([tag, 0])
+            self.newline()
+        elif tag == 'li':
+            self.newline()
+            indent = '  ' * (len(self.lists) - 1)
+            if self.lists and self.lists[-1][0] == 'ol':
+                self.lists[-1][1] += 1
+                self.write(f"{indent}{self.lists[-1][1]}. ")
+            else:
+                self.write(f"{indent}- ")
+        elif tag == 'blockquote':
+            self.quote_depth += 1
+            self.newline(2)
+        elif tag in ('td', 'th'):
+            self.write(' | ' if self.cell_count else '| ')
+            self.cell_count += 1
+
+    def handle_endtag(self, tag):
+        if self.root_depth is None:
+            return
+        if tag not in VOID_TAGS:
+            self.root_depth -= 1
+
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS or re.fullmatch(r'h[1-6]', tag):
+            if tag == 'tr' and self.cell_count:
+                self.write(' |')
+                self.cell_count = 0
+            self.newline(2)
+        elif tag in ('strong', 'b'):
+            self.write('**')
+        elif tag in ('em', 'i'):
+            self.write('*')
+        elif tag == 'a':
+            href = self.links.pop() if self.links else None
+            self.write(f"]({href})" if href else ']')
+        elif tag in ('ul', 'ol'):
+            if self.lists:
+                self.lists.pop()
+            self.newline()
+        elif tag == 'blockquote':
+            self.quote_depth = max(0, self.quote_depth - 1)
+            self.newline(2)
+
+        if self.root_tags and self.root_depth <= 0:
+            self.root_depth = None
+
+    def handle_data(self, data):
+        text = re.sub(r'\s+', ' ', data)
+        if text.strip() or (self.out and not self.out[-1].endswith((' ', '\n'))):
+            self.write(text)
+
+    def markdown(self):
+        text = ''.join(self.out)
+        text = re.sub(r'\*\*(\s*)\*\*', r'\1', text)  # Empty <b></b>
+
+        # Trim whitespace and collapse runs of blank (or blank quoted) lines
+        lines = []
+        for line in text.split('\n'):
+            line = line.rstrip()
+            if not re.match(r'\s*(- |\d+\. )', line):
+                line = line.lstrip()
+            if not line.strip('> '):
+                quoted = line.startswith('>') and lines and lines[-1].startswith('> ')
+                if lines and not lines[-1].strip('> '):
+                    continue
+                line = '>' if quoted else ''
+            elif lines and lines[-1] == '>' and not line.startswith('>'):
+                lines[-1] = ''
+            lines.append(line)
+        return '\n'.join(lines).strip()
+
+
+def html_to_markdown(html, root_tags=None):
+    """Convert an HTML fragment to markdown.
+
+    ``root_tags`` limits the output to the content of matching elements
+    (e.g. ``('article', 'main')`` for a full page).
+    """
+    if not html:
+        return ''
+    converter = MarkdownConverter(root_tags)
+    converter.feed(html)
+    converter.close()
+    return converter.markdown()
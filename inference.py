@@ -0,0 +1,146 @@
+"""Batched answer generation with the fine-tuned model.
+
+``generate_answers`` replaces the notebook's one-question-at-a-time
+``generate_answer`` loop. Questions are sorted by prompt length and
+generated ``batch_size`` at a time with left padding, so every prompt in
+a batch ends at the same position. The answer is exactly the tokens after
+that position (no splitting on "assistant"). Results come back in input
+order, and question lists of any size are processed batch by batch.
+
+    from inference import generate_answers
+    answers = generate_answers(model, tokenizer, questions, batch_size=16)
+
+Every prompt starts with the same system prompt, which is most of its
+tokens. ``PrefixCache`` runs that shared prefix through the model once
+and reuses its KV cache for every request: each batch is laid out as
+``[prefix][padding][question]``, with the padding masked out, so only the
+question tokens are prefilled. Outputs are the same as without the
+cache; prompts whose tokens do not start with the cached prefix are
+generated without it.
+
+    cache = PrefixCache(model, tokenizer)
+    answers = generate_answers(model, tokenizer, questions, prefix_cache=cache)
+"""
+import copy
+import os
+
+import torch
+
+# Same system prompt as in convert_format.py and train.ipynb
+SYSTEM_PROMPT = "Ты — дружелюбный помощник по мероприятиям в Алматы. Помогаешь пользователям найти интересные события, концерты, спектакли, выставки и развлечения в городе. Отвечай информативно, указывая даты, время, место и цены."
+
+EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "16"))
+
+
+def build_prompt(tokenizer, question, system_prompt=SYSTEM_PROMPT):
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": question}
+    ]
+    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+
+def generation_kwargs(tokenizer, max_new_tokens=200, do_sample=True, temperature=0.7, top_p=0.9):
+    """Sampling settings used by the notebook"""
+    kwargs = {
+        'max_new_tokens': max_new_tokens,
+        'do_sample': do_sample,
+        'pad_token_id': tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
+        'eos_token_id': tokenizer.eos_token_id,
+    }
+    if do_sample:
+        kwargs.update(temperature=temperature, top_p=top_p)
+    return kwargs
+
+
+def prompt_ids(tokenizer, question, system_prompt=SYSTEM_PROMPT):
+    return tokenizer(build_prompt(tokenizer, question, system_prompt), add_special_tokens=False)['input_ids']
+
+
+class PrefixCache:
+    """KV cache of the prompt tokens shared by every question"""
+
+    def __init__(self, model, tokenizer, system_prompt=SYSTEM_PROMPT):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.system_prompt = system_prompt
+
+        # The shared prefix is whatever two different questions have in common
+        a = prompt_ids(tokenizer, "а", system_prompt)
+        b = prompt_ids(tokenizer, "б", system_prompt)
+        length = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+        self.prefix_ids = a[:length]
+
+        with torch.no_grad():
+            output = model(input_ids=torch.tensor([self.prefix_ids], device=model.device), use_cache=True)
+        self.cache = output.past_key_values
+
+    def matches(self, ids):
+        # At least one token after the prefix is needed to start generating
+        return len(ids) > len(self.prefix_ids) and ids[:len(self.prefix_ids)] == self.prefix_ids
+
+    def generate(self, batch_ids, **kwargs):
+        """Generated token ids for prompts that all start with the prefix"""
+        prefix_len = len(self.prefix_ids)
+        suffixes = [ids[prefix_len:] for ids in batch_ids]
+        width = max(len(suffix) for suffix in suffixes)
+        pad = kwargs['pad_token_id']
+
+        # [prefix][padding][question]: padding sits after the cached part
+        input_ids = [self.prefix_ids + [pad] * (width - len(s)) + s for s in suffixes]
+        attention_mask = [[1] * prefix_len + [0] * (width - len(s)) + [1] * len(s) for s in suffixes]
+        cache = copy.deepcopy(self.cache)
+        cache.batch_repeat_interleave(len(batch_ids))
+
+        device = self.model.device
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=torch.tensor(input_ids, device=device),
+                attention_mask=torch.tensor(attention_mask, device=device),
+                past_key_values=cache,
+                **kwargs
+            )
+        return outputs[:, prefix_len + width:]
+
+
+def iter_answers(model, tokenizer, questions, batch_size=EVAL_BATCH_SIZE, system_prompt=SYSTEM_PROMPT,
+                 prefix_cache=None, **gen):
+    """Yields (index, answer) per question, one batch at a time"""
+    prompts = [build_prompt(tokenizer, q, system_prompt) for q in questions]
+    ids = [tokenizer(p, add_special_tokens=False)['input_ids'] for p in prompts]
+    order = sorted(range(len(prompts)), key=lambda i: len(ids[i]))
+    kwargs = generation_kwargs(tokenizer, **gen)
+
+    if prefix_cache is not None and prefix_cache.system_prompt == system_prompt:
+        cached = [i for i in order if prefix_cache.matches(ids[i])]
+        for start in range(0, len(cached), batch_size):
+            batch = cached[start:start + batch_size]
+            new_tokens = prefix_cache.generate([ids[i] for i in batch], **kwargs)
+            for i, answer in zip(batch, tokenizer.batch_decode(new_tokens, skip_special_tokens=True)):
+                yield i, answer.strip()
+        order = [i for i in order if not prefix_cache.matches(ids[i])]
+
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = 'left'
+    try:
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = tokenizer([prompts[i] for i in batch], return_tensors='pt', padding=True,
+                               add_special_tokens=False).to(model.device)
+            with torch.no_grad():
+                outputs = model.generate(**inputs, **kwargs)
+            # With left padding every prompt ends at input_ids.shape[1]
+            new_tokens = outputs[:, inputs['input_ids'].shape[1]:]
+            for i, answer in zip(batch, tokenizer.batch_decode(new_tokens, skip_special_tokens=True)):
+                yield i, answer.strip()
+    finally:
+        tokenizer.padding_side = padding_side
+
+
+def generate_answers(model, tokenizer, questions, batch_size=EVAL_BATCH_SIZE, system_prompt=SYSTEM_PROMPT,
+                     prefix_cache=None, **gen):
+    """Answers for ``questions``, in order"""
+    answers = [None] * len(questions)
+    for i, answer in iter_answers(model, tokenizer, questions, batch_size, system_prompt, prefix_cache, **gen):
+        answers[i] = answer
+    return answers
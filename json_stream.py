@@ -0,0 +1,170 @@
+"""Incremental extraction of JSON values from model replies.
+
+Models wrap their JSON in code fences or prose and sometimes stop in the
+middle of it. ``JSONStreamExtractor`` is fed the reply chunk by chunk
+(as it arrives from the streaming API, or all at once) and picks out
+every complete top-level element of the first JSON array or object it
+finds. One broken or truncated element costs only that element, not the
+whole reply. A root that closes without a single object in it ("см. [1]"
+in the prose before the JSON) is skipped and the search goes on.
+
+For an object root (the batched ``{"<event id>": [...]}`` replies) a
+truncated last value is salvaged one level deeper, so the complete items
+of a half-written event are still recovered.
+"""
+import json
+
+
+class JSONStreamExtractor:
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0            # Next character of buffer to scan
+        self.root = None        # '[' or '{' once the root value is found
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.segment_start = 0  # Start of the current top-level element in buffer
+        self.closed = False
+        self.truncated = False  # Reply ended before the root was closed
+        self.items = []         # Array elements, or (key, value) pairs for an object
+        self.lost = 0
+        self.has_objects = False  # Some element is, or holds, a JSON object
+
+    def feed(self, chunk):
+        """Consume a chunk; returns the elements completed by it"""
+        if self.closed or not chunk:
+            return []
+        self.buffer += chunk
+        before = len(self.items)
+
+        buffer = self.buffer
+        i = self.pos
+        while i < len(buffer) and not self.closed:
+            ch = buffer[i]
+            if self.root is None:
+                if ch in '[{':
+                    self.root = ch
+                    self.depth = 1
+                    self.segment_start = i + 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in '[{':
+                self.depth += 1
+            elif ch in ']}':
+                self.depth -= 1
+                if self.depth == 0:
+                    self._end_segment(buffer[self.segment_start:i])
+                    if self.has_objects:
+                        self.closed = True
+                    else:
+                        # Brackets in prose, not the reply: look for the next root
+                        self.root = None
+                        self.items = []
+                        self.lost = 0
+                        self.segment_start = i + 1
+                        before = 0
+            elif ch == ',' and self.depth == 1:
+                self._end_segment(buffer[self.segment_start:i])
+                self.segment_start = i + 1
+            i += 1
+
+        # Drop the scanned prefix so memory stays bounded by one element
+        if self.root is not None:
+            self.buffer = buffer[self.segment_start:]
+            self.pos = i - self.segment_start
+            self.segment_start = 0
+        else:
+            self.buffer = ''
+            self.pos = 0
+        return self.items[before:]
+
+    def _end_segment(self, text):
+        if not text.strip():
+            return
+        try:
+            if self.root == '[':
+                values = [json.loads(text)]
+                self.items.extend(values)
+            else:
+                pairs = json.loads('{' + text + '}').items()
+                values = [value for _, value in pairs]
+                self.items.extend(pairs)
+        except json.JSONDecodeError:
+            self.lost += 1
+            return
+        for value in values:
+            if isinstance(value, dict) or isinstance(value, list) and any(isinstance(v, dict) for v in value):
+                self.has_objects = True
+
+    def finish(self):
+        """Close the stream, salvaging what is left of a truncated reply"""
+        if self.root is not None and not self.closed:
+            self.truncated = True
+            tail = self.buffer[self.segment_start:]
+            if tail.strip():
+                self.lost += 1
+                if self.root == '{':
+                    self._salvage_pair(tail)
+            self.closed = True
+        return self.stats()
+
+    def _salvage_pair(self, text):
+        """Recover complete items from a truncated ``"key": [...`` pair"""
+        try:
+            key, end = json.JSONDecoder().raw_decode(text.strip())
+        except json.JSONDecodeError:
+            return
+        rest = text.strip()[end:].lstrip()
+        if not rest.startswith(':'):
+            return
+        inner = JSONStreamExtractor()
+        inner.feed(rest[1:])
+        inner.finish()
+        if inner.items and inner.root == '[':
+            self.items.append((key, inner.items))
+
+    def result(self):
+        """The recovered value: a list for an array root, a dict for an object"""
+        if self.root == '{':
+            return dict(self.items)
+        return list(self.items)
+
+    def stats(self):
+        return {
+            'complete': self.closed and not self.truncated and self.lost == 0 and self.root is not None,
+            'recovered': len(self.items),
+            'lost': self.lost,
+        }
+
+
+def extract_json(text):
+    """One-shot extraction; returns (value, stats)"""
+    extractor = JSONStreamExtractor()
+    extractor.feed(text)
+    stats = extractor.finish()
+    return extractor.result(), stats
+
+
+def iter_array(f, chunk_size=16384):
+    """Elements of the JSON array in file ``f``, read chunk by chunk.
+
+    Memory stays bounded by one element and one chunk, however large
+    the file is.
+    """
+    extractor = JSONStreamExtractor()
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        yield from extractor.feed(chunk)
+        extractor.items.clear()
+    extractor.finish()
+    yield from extractor.items
@@ -0,0 +1,133 @@
+"""Content-addressed on-disk cache for LLM completions.
+
+Entries are keyed by a hash of (model, prompt, extra_body), so a rerun
+only calls the API for prompts that actually changed. Each entry is a
+small JSON file under ``LLM_CACHE_DIR`` (default ``.llm_cache``), sharded
+by the first two hex digits of the key. Entries older than
+``LLM_CACHE_MAX_AGE_DAYS`` are deleted when read or evicted, and the
+least recently used entries are dropped once the cache grows past
+``LLM_CACHE_MAX_MB``.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def cache_key(model, prompt, extra_body=None):
+    payload = json.dumps(
+        {'model': model, 'prompt': prompt, 'extra_body': extra_body},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Raw completion text stored per cache key, with hit/miss counters"""
+
+    def __init__(self, directory=None, max_bytes=None, max_age=None, evict_every=50):
+        self.directory = directory or os.getenv("LLM_CACHE_DIR", ".llm_cache")
+        if max_bytes is None:
+            max_bytes = float(os.getenv("LLM_CACHE_MAX_MB", "500")) * 1024 * 1024
+        if max_age is None:
+            max_age = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30")) * 86400
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        """Cached completion for ``key`` or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except OSError:
+            entry = None
+        except ValueError:
+            entry = {}  # Corrupt file, dropped below
+
+        created = entry.get('created') if isinstance(entry, dict) else None
+        if created is None or time.time() - created > self.max_age:
+            if entry is not None:
+                # Expired or malformed: evict() goes by mtime, which a read would keep fresh
+                self._remove(path)
+            with self.lock:
+                self.misses += 1
+            return None
+
+        os.utime(path)  # Mark as recently used for eviction
+        with self.lock:
+            self.hits += 1
+        return entry.get('content')
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            self.evicted += 1
+
+    def put(self, key, content, model=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.time(), 'model': model, 'content': content}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.writes += 1
+            due = self.writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones over the size limit"""
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        with self.lock:
+            self.evicted += removed
+        return removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'writes': self.writes,
+            'evicted': self.evicted,
+        }
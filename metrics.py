@@ -0,0 +1,246 @@
+"""Run metrics for the pipeline scripts: counters, latency histograms, outliers.
+
+One process-wide registry collects everything a stage does:
+
+    metrics.inc('llm_tokens_total', usage.prompt_tokens, kind='prompt', model=MODEL)
+    with metrics.timer('http_request_seconds', endpoint='jina'):
+        ...
+    metrics.track('llm_request_tokens', total, label='event 123')  # keeps the top 10
+
+HTTP and LLM calls are measured where every client goes through anyway
+(``rate_limit``), as are journal and JSON writes, the LLM cache and
+generation. At the end of ``main()`` a stage calls
+``metrics.write_report('sft')``, which writes:
+
+    metrics/sft.json     counters, histogram summaries (p50/p95/max) and outliers
+    metrics/sft.prom     the same in Prometheus text format
+    metrics/runs.jsonl   one line per run, for comparing runs
+
+``python metrics.py`` summarises the latest runs per stage: time,
+requests, bytes, tokens, cost, cache hit rate, retries and skips.
+"""
+import bisect
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+TOP_K = 10
+
+# Upper bounds in seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding the q-th value"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(self.max, low + (high - low) * (rank - seen) / n)
+            seen += n
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+            'p50': round(self.quantile(0.5), 6),
+            'p95': round(self.quantile(0.95), 6),
+            'max': round(self.max, 6),
+        }
+
+
+def label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+            self.top = {}
+            self.seq = 0
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def track(self, name, value, **info):
+        """Keep the TOP_K largest values of ``name`` with what they belong to"""
+        with self.lock:
+            self.seq += 1
+            heap = self.top.setdefault(name, [])
+            entry = (value, self.seq, info)
+            if len(heap) < TOP_K:
+                heapq.heappush(heap, entry)
+            elif value > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    def report(self, stage=None):
+        with self.lock:
+            return {
+                'stage': stage,
+                'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                'wall_seconds': round(time.time() - self.started, 3),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'histograms': [dict({'name': name, 'labels': dict(labels)}, **hist.summary())
+                               for (name, labels), hist in sorted(self.histograms.items())],
+                'outliers': {name: [dict(info, value=value) for value, _, info in sorted(heap, reverse=True)]
+                             for name, heap in sorted(self.top.items())},
+            }
+
+    def prometheus(self):
+        """Prometheus text exposition format"""
+
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{fmt(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, n in zip(list(hist.buckets) + ['+Inf'], hist.counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{fmt(labels)} {hist.sum}")
+                lines.append(f"{name}_count{fmt(labels)} {hist.count}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+track = registry.track
+
+
+def write_report(stage, directory=None):
+    """Write <stage>.json and <stage>.prom and append the run to runs.jsonl"""
+    directory = directory or METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    report = registry.report(stage)
+    path = os.path.join(directory, f"{stage}.json")
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+    with open(os.path.join(directory, f"{stage}.prom"), 'w', encoding='utf-8') as f:
+        f.write(registry.prometheus())
+    with open(os.path.join(directory, 'runs.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(report, ensure_ascii=False) + '\n')
+    return path
+
+
+def total(report, name, **labels):
+    """Sum of a counter over the series matching ``labels``"""
+    return sum(c['value'] for c in report['counters'] if c['name'] == name
+               and all(c['labels'].get(k) == str(v) for k, v in labels.items()))
+
+
+def summarize(report):
+    """One line of the numbers that matter most for a run"""
+    hits, misses = total(report, 'llm_cache_total', result='hit'), total(report, 'llm_cache_total', result='miss')
+    parts = [
+        f"{report['stage']:<10} {report['started_at']}  {report['wall_seconds']:8.1f}s",
+        f"http {total(report, 'http_requests_total')} req / {total(report, 'http_response_bytes_total') / 1e6:.1f} MB",
+        f"llm {total(report, 'llm_requests_total')} req / "
+        f"{total(report, 'llm_tokens_total', kind='prompt')}+{total(report, 'llm_tokens_total', kind='completion')} tok",
+        f"cost ${total(report, 'llm_cost_total'):.4f}",
+        f"cache {hits}/{hits + misses}",
+        f"retries {total(report, 'retries_total')}",
+        f"skipped {total(report, 'events_skipped_total')}",
+    ]
+    return '  '.join(parts)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(METRICS_DIR, 'runs.jsonl')
+    if not os.path.exists(path):
+        print(f"No runs recorded in {path}")
+        sys.exit(1)
+    with open(path, 'r', encoding='utf-8') as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+
+    print("=" * 60)
+    print(f"RUNS ({len(runs)} in {path}, last 20)")
+    print("=" * 60)
+    for report in runs[-20:]:
+        print(summarize(report))
+
+    latest = runs[-1]
+    slowest = sorted((h for h in latest['histograms'] if h['name'].endswith('_seconds')),
+                     key=lambda h: h['sum'], reverse=True)[:5]
+    print("\n" + "=" * 60)
+    print(f"WHERE THE TIME WENT ({latest['stage']}, {latest['started_at']})")
+    print("=" * 60)
+    for h in slowest:
+        labels = ', '.join(f"{k}={v}" for k, v in h['labels'].items())
+        print(f"  {h['name']:<28} {labels:<28} n={h['count']:<5} total {h['sum']:8.2f}s  "
+              f"p50 {h['p50']:.3f}s  p95 {h['p95']:.3f}s  max {h['max']:.3f}s")
+    for name, items in latest['outliers'].items():
+        print(f"  top {name}: " + ', '.join(f"{i.get('label')}={i['value']:.4g}" for i in items[:3]))
+
+
+if __name__ == '__main__':
+    main()
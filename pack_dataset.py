@@ -0,0 +1,335 @@
+"""Offline tokenization and packing of the training datasets.
+
+Tokenizes the converted chat (SFT) and ORPO datasets once and stores the
+token ids as ``.npy`` files that training memory-maps instead of running
+``apply_chat_template`` and the tokenizer at the start of every session.
+
+SFT samples are packed into sequences of up to ``MAX_SEQ_LENGTH`` tokens
+(best-fit decreasing), so short QA pairs no longer pad out a whole row.
+Sample boundaries are kept: ``PackedDataset`` restarts ``position_ids``
+at every sample and masks the label of each sample's first token, and
+``collate_packed`` builds a block-diagonal causal mask so samples in one
+sequence never attend to each other.
+
+Output goes to ``packed/<tokenizer hash>/``, so switching tokenizers never
+picks up stale ids, and a build is skipped when its inputs are unchanged:
+
+    packed/<hash>/manifest.json
+    packed/<hash>/sft_input_ids.npy       flat token ids, packed order
+    packed/<hash>/sft_sample_offsets.npy  sample boundaries in the flat ids
+    packed/<hash>/sft_seq_offsets.npy     packed sequence boundaries
+    packed/<hash>/orpo_{prompt,chosen,rejected}_ids.npy (+ _offsets.npy)
+
+Needs numpy and transformers (torch only for ``collate_packed``), which
+the training notebook installs.
+
+    python pack_dataset.py [--tokenizer NAME] [--max-seq-length 2048]
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from convert_format import read_dataset
+
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME", "unsloth/Qwen2.5-3B-bnb-4bit")  # Same as MODEL_NAME in train.ipynb
+MAX_SEQ_LENGTH = int(os.getenv("MAX_SEQ_LENGTH", "2048"))
+PACKED_DIR = os.getenv("PACKED_DIR", "packed")
+
+SFT_DATASET = 'sft_dataset_chat.jsonl'
+ORPO_DATASET = 'orpo_dataset_pairs.jsonl'
+
+# ChatML template used by train.ipynb when the tokenizer has none
+CHATML_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% if message['role'] == 'system' %}"
+    "{{ '<|im_start|>system\n' + message['content'] + '<|im_end|>\n' }}"
+    "{% elif message['role'] == 'user' %}"
+    "{{ '<|im_start|>user\n' + message['content'] + '<|im_end|>\n' }}"
+    "{% elif message['role'] == 'assistant' %}"
+    "{{ '<|im_start|>assistant\n' + message['content'] + '<|im_end|>\n' }}"
+    "{% endif %}"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}"
+    "{{ '<|im_start|>assistant\n' }}"
+    "{% endif %}"
+)
+
+TOKEN_DTYPE = np.uint32
+
+
+def load_tokenizer(name=None):
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(name or TOKENIZER_NAME)
+    if tokenizer.chat_template is None:
+        tokenizer.chat_template = CHATML_TEMPLATE
+    return tokenizer
+
+
+def tokenizer_hash(tokenizer):
+    """Hash of everything that decides the token ids we produce"""
+    h = hashlib.sha256()
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        h.update(backend.to_str().encode('utf-8'))
+    else:
+        h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode('utf-8'))
+    h.update((tokenizer.chat_template or '').encode('utf-8'))
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chat_ids(tokenizer, messages, add_generation_prompt=False):
+    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=add_generation_prompt)
+    return tokenizer(text, add_special_tokens=False)['input_ids']
+
+
+class ArrayWriter:
+    """Appends variable-length token lists to a flat .npy file plus offsets.
+
+    Ids are streamed to a raw temp file first, so memory does not grow
+    with the dataset.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.raw_path = path + '.raw'
+        self.raw = open(self.raw_path, 'wb')
+        self.offsets = [0]
+
+    def append(self, ids):
+        self.raw.write(np.asarray(ids, dtype=TOKEN_DTYPE).tobytes())
+        self.offsets.append(self.offsets[-1] + len(ids))
+
+    def close(self):
+        self.raw.close()
+        flat = np.lib.format.open_memmap(self.path, mode='w+', dtype=TOKEN_DTYPE, shape=(self.offsets[-1],))
+        if self.offsets[-1]:
+            flat[:] = np.memmap(self.raw_path, dtype=TOKEN_DTYPE, mode='r')
+        flat.flush()
+        del flat
+        os.remove(self.raw_path)
+        np.save(self.path.replace('_ids.npy', '_offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+        return len(self.offsets) - 1
+
+
+def pack_bins(lengths, capacity):
+    """Best-fit decreasing: lists of sample indexes whose lengths fit ``capacity``"""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    free = []   # Sorted (remaining capacity, bin index)
+    bins = []
+    for i in order:
+        length = min(lengths[i], capacity)
+        pos = bisect.bisect_left(free, (length, -1))
+        if pos < len(free):
+            remaining, b = free.pop(pos)
+        else:
+            remaining, b = capacity, len(bins)
+            bins.append([])
+        bins[b].append(i)
+        bisect.insort(free, (remaining - length, b))
+    return bins
+
+
+def build_sft(tokenizer, out_dir, max_seq_length, source=SFT_DATASET):
+    """Tokenize and pack the SFT chat dataset; returns stats"""
+    tmp = ArrayWriter(os.path.join(out_dir, 'sft_unpacked_ids.npy'))
+    for row in read_dataset(source):
+        tmp.append(chat_ids(tokenizer, row['messages'])[:max_seq_length])
+    n_samples = tmp.close()
+
+    unpacked = np.load(os.path.join(out_dir, 'sft_unpacked_ids.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(out_dir, 'sft_unpacked_offsets.npy'))
+    lengths = np.diff(offsets).tolist()
+    bins = pack_bins(lengths, max_seq_length)
+
+    # Copy samples into packed order
+    flat = np.lib.format.open_memmap(os.path.join(out_dir, 'sft_input_ids.npy'), mode='w+',
+                                     dtype=TOKEN_DTYPE, shape=(int(offsets[-1]),))
+    sample_offsets, seq_offsets = [0], [0]
+    for b in bins:
+        for i in b:
+            start = sample_offsets[-1]
+            flat[start:start + lengths[i]] = unpacked[offsets[i]:offsets[i + 1]]
+            sample_offsets.append(start + lengths[i])
+        seq_offsets.append(sample_offsets[-1])
+    flat.flush()
+    del flat, unpacked
+    np.save(os.path.join(out_dir, 'sft_sample_offsets.npy'), np.asarray(sample_offsets, dtype=np.int64))
+    np.save(os.path.join(out_dir, 'sft_seq_offsets.npy'), np.asarray(seq_offsets, dtype=np.int64))
+    os.remove(os.path.join(out_dir, 'sft_unpacked_ids.npy'))
+    os.remove(os.path.join(out_dir, 'sft_unpacked_offsets.npy'))
+
+    tokens = int(sum(lengths))
+    return {
+        'samples': n_samples,
+        'tokens': tokens,
+        'sequences': len(bins),
+        'fill': round(tokens / max(1, len(bins) * max_seq_length), 3),
+        'padded_tokens_unpacked': int(n_samples * max(lengths, default=0)),
+    }
+
+
+def build_orpo(tokenizer, out_dir, source=ORPO_DATASET):
+    """Tokenize ORPO prompts and the chosen/rejected completions after them"""
+    writers = {part: ArrayWriter(os.path.join(out_dir, f'orpo_{part}_ids.npy'))
+               for part in ('prompt', 'chosen', 'rejected')}
+    for row in read_dataset(source):
+        prompt = chat_ids(tokenizer, row['prompt'], add_generation_prompt=True)
+        writers['prompt'].append(prompt)
+        for part in ('chosen', 'rejected'):
+            full = chat_ids(tokenizer, row['prompt'] + row[part])
+            # The completion is whatever follows the prompt tokens
+            writers[part].append(full[len(prompt):] if full[:len(prompt)] == prompt else full)
+    counts = {part: writer.close() for part, writer in writers.items()}
+    return {'pairs': counts['prompt']}
+
+
+def build(tokenizer_name=None, max_seq_length=MAX_SEQ_LENGTH, packed_dir=PACKED_DIR,
+          sft_source=SFT_DATASET, orpo_source=ORPO_DATASET, force=False):
+    """Build (or reuse) the packed data for a tokenizer; returns the output dir"""
+    tokenizer = load_tokenizer(tokenizer_name)
+    out_dir = os.path.join(packed_dir, tokenizer_hash(tokenizer))
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    inputs = {
+        'tokenizer': tokenizer_name or TOKENIZER_NAME,
+        'max_seq_length': max_seq_length,
+        'sft_source': sft_source,
+        'sft_sha256': file_hash(sft_source) if os.path.exists(sft_source) else None,
+        'orpo_source': orpo_source,
+        'orpo_sha256': file_hash(orpo_source) if os.path.exists(orpo_source) else None,
+    }
+
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            if json.load(f).get('inputs') == inputs:
+                print(f"Up to date: {out_dir}")
+                return out_dir
+
+    os.makedirs(out_dir, exist_ok=True)
+    started = time.monotonic()
+    manifest = {'inputs': inputs, 'pad_token_id': tokenizer.pad_token_id}
+    if inputs['sft_sha256']:
+        manifest['sft'] = build_sft(tokenizer, out_dir, max_seq_length, sft_source)
+    if inputs['orpo_sha256']:
+        manifest['orpo'] = build_orpo(tokenizer, out_dir, orpo_source)
+    manifest['seconds'] = round(time.monotonic() - started, 2)
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return out_dir
+
+
+class PackedDataset:
+    """Packed SFT sequences, memory-mapped; usable as a torch Dataset"""
+
+    def __init__(self, out_dir):
+        self.input_ids = np.load(os.path.join(out_dir, 'sft_input_ids.npy'), mmap_mode='r')
+        self.sample_offsets = np.load(os.path.join(out_dir, 'sft_sample_offsets.npy'))
+        self.seq_offsets = np.load(os.path.join(out_dir, 'sft_seq_offsets.npy'))
+        with open(os.path.join(out_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            self.pad_token_id = json.load(f).get('pad_token_id') or 0
+
+    def __len__(self):
+        return len(self.seq_offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = int(self.seq_offsets[i]), int(self.seq_offsets[i + 1])
+        ids = np.asarray(self.input_ids[start:end], dtype=np.int64)
+        lo = np.searchsorted(self.sample_offsets, start)
+        hi = np.searchsorted(self.sample_offsets, end)
+        starts = self.sample_offsets[lo:hi] - start
+        lengths = np.diff(np.append(starts, end - start))
+
+        position_ids = np.arange(end - start) - np.repeat(starts, lengths)
+        labels = ids.copy()
+        labels[starts] = -100  # Never predict a sample's first token from the previous sample
+        return {'input_ids': ids, 'labels': labels, 'position_ids': position_ids, 'sample_lengths': lengths}
+
+
+def block_causal_mask(sample_lengths, total_length):
+    """Boolean [L, L] mask: causal within each sample, nothing across samples"""
+    segment = np.repeat(np.arange(len(sample_lengths)), sample_lengths)
+    segment = np.concatenate([segment, np.full(total_length - len(segment), -1)])
+    causal = np.tril(np.ones((total_length, total_length), dtype=bool))
+    return causal & (segment[:, None] == segment[None, :]) & (segment[:, None] >= 0)
+
+
+def lengths_from_positions(position_ids):
+    """Sample lengths of a packed sequence: every position 0 starts a new sample"""
+    position_ids = np.asarray(position_ids)
+    starts = np.flatnonzero(position_ids == 0)
+    return np.diff(np.append(starts, len(position_ids)))
+
+
+def collate_packed(batch, pad_token_id=0):
+    """Pad packed sequences and build the 4D block-diagonal attention mask.
+
+    Sample boundaries come from ``position_ids``, so the collator also works
+    when Trainer has dropped ``sample_lengths`` (remove_unused_columns=True).
+    """
+    import torch
+    length = max(len(item['input_ids']) for item in batch)
+    input_ids = torch.full((len(batch), length), pad_token_id, dtype=torch.long)
+    labels = torch.full((len(batch), length), -100, dtype=torch.long)
+    position_ids = torch.zeros((len(batch), length), dtype=torch.long)
+    mask = torch.zeros((len(batch), 1, length, length), dtype=torch.bool)
+    for b, item in enumerate(batch):
+        n = len(item['input_ids'])
+        input_ids[b, :n] = torch.from_numpy(item['input_ids'])
+        labels[b, :n] = torch.from_numpy(item['labels'])
+        position_ids[b, :n] = torch.from_numpy(item['position_ids'])
+        lengths = item.get('sample_lengths')
+        if lengths is None:
+            lengths = lengths_from_positions(item['position_ids'])
+        mask[b, 0] = torch.from_numpy(block_causal_mask(lengths, length))
+    return {'input_ids': input_ids, 'labels': labels, 'position_ids': position_ids, 'attention_mask': mask}
+
+
+def load_orpo(out_dir, part):
+    """(flat ids, offsets) for 'prompt', 'chosen' or 'rejected'"""
+    ids = np.load(os.path.join(out_dir, f'orpo_{part}_ids.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(out_dir, f'orpo_{part}_offsets.npy'))
+    return ids, offsets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenize and pack the training datasets")
+    parser.add_argument('--tokenizer', default=TOKENIZER_NAME)
+    parser.add_argument('--max-seq-length', type=int, default=MAX_SEQ_LENGTH)
+    parser.add_argument('--force', action='store_true', help="rebuild even if inputs are unchanged")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("PACK TRAINING DATA")
+    print("=" * 60)
+
+    out_dir = build(args.tokenizer, args.max_seq_length, force=args.force)
+    with open(os.path.join(out_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if 'sft' in manifest:
+        sft = manifest['sft']
+        print(f"SFT: {sft['samples']} samples, {sft['tokens']} tokens -> {sft['sequences']} sequences "
+              f"of {args.max_seq_length} ({sft['fill']:.0%} filled)")
+    if 'orpo' in manifest:
+        print(f"ORPO: {manifest['orpo']['pairs']} pairs")
+    print("=" * 60)
+    print(f"Saved to: {out_dir}")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
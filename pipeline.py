@@ -0,0 +1,286 @@
+"""Incremental end-to-end data pipeline: scrape -> datasets -> packed training data.
+
+Runs the same scripts we used to run by hand, as stages of a DAG:
+
+    scrape -> retry -> sft  -> factcheck_sft  -> dedup_sft  -> split -> convert_chat -+-> pack
+                    -> orpo -> factcheck_orpo -> dedup_orpo ----------> convert_orpo -+
+
+Each stage has a key: a hash of its command, its code (prompts and model
+names live there), its input files, the active events in the store and
+the env settings it reads. A stage is skipped when its key and its
+outputs are the same as after its last successful run, so a stage whose
+upstream reran but produced identical files is skipped too. Inside the
+generation stages only events whose prompt changed go to the model
+(see generation.py), so a small scrape delta costs a few requests.
+
+Only answers whose prices, dates, times and addresses match their event
+(factcheck.py) go on to dedup and training. The held-out events of
+evaluation.py are split off before convert_chat, so they never reach
+training.
+
+Independent stages (SFT and ORPO generation, the two check/dedup/convert
+chains) run in parallel, each as its own process with its output in
+``logs/<stage>.log``. State lives in ``pipeline_state.json``. Training
+itself stays in train.ipynb.
+
+    python pipeline.py                    # everything, scrape included
+    python pipeline.py --no-scrape        # rebuild from the current store
+    python pipeline.py convert_chat       # a stage and what it depends on
+    python pipeline.py --force sft        # rerun a stage even if up to date
+    python pipeline.py --dry-run
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from event_store import open_store
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_STATE_PATH = os.getenv("PIPELINE_STATE_PATH", "pipeline_state.json")
+PIPELINE_LOG_DIR = os.getenv("PIPELINE_LOG_DIR", "logs")
+PIPELINE_CONCURRENCY = int(os.getenv("PIPELINE_CONCURRENCY", "2"))  # Stages running at once
+
+
+class Stage:
+
+    def __init__(self, name, command, deps=(), inputs=(), outputs=(), code=(), env=(), store=False,
+                 always=False, key=None):
+        self.name = name
+        self.command = command  # Script in this directory, then its arguments
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = [command[0]] + list(code)
+        self.env = list(env)
+        self.store = store      # Reads the events in the store
+        self.always = always    # No way to tell if it is up to date (network source)
+        self.key = key          # Extra key material, e.g. the events it will touch
+
+
+def events_needing_content():
+    with open_store() as store:
+        return [event['id'] for event in store.events_needing_content()]
+
+
+GENERATION_ENV = ['OPENROUTER_BASE_URL', 'GENERATION_BATCH_EVENTS']
+DEDUP_ENV = ['DEDUP_THRESHOLD', 'DEDUP_ANSWER_THRESHOLD', 'DEDUP_NUM_PERM']
+FACTCHECK_ENV = ['FACTCHECK_DROP']
+
+STAGES = [
+    Stage('scrape', ['scrape_sxodim.py', '--incremental'], code=['html_to_markdown.py', 'event_store.py'],
+          always=True),
+    Stage('retry', ['retry_skipped.py'], deps=['scrape'], code=['scrape_sxodim.py', 'html_to_markdown.py'],
+          env=['MARKDOWN_SOURCES'], key=events_needing_content),
+    Stage('sft', ['generate_sft.py'], deps=['retry'], code=['generation.py'], env=GENERATION_ENV, store=True,
+          outputs=['sft_dataset.json', 'sft_dataset_alpaca.json']),
+    Stage('orpo', ['resume_orpo.py'], deps=['retry'], code=['generate_orpo_dataset.py', 'generation.py'],
+          env=GENERATION_ENV, store=True, outputs=['orpo_dataset.json']),
+    Stage('factcheck_sft', ['factcheck.py', 'sft'], deps=['sft'], code=['event_store.py', 'event_query.py'],
+          inputs=['sft_dataset.json'], env=FACTCHECK_ENV, store=True, outputs=['sft_dataset_verified.json']),
+    Stage('factcheck_orpo', ['factcheck.py', 'orpo'], deps=['orpo'], code=['event_store.py', 'event_query.py'],
+          inputs=['orpo_dataset.json'], env=FACTCHECK_ENV, store=True, outputs=['orpo_dataset_verified.json']),
+    Stage('dedup_sft', ['dedup.py', 'sft', '--input', 'sft_dataset_verified.json'], deps=['factcheck_sft'],
+          inputs=['sft_dataset_verified.json'], env=DEDUP_ENV,
+          outputs=['sft_dataset_verified_dedup.json', 'sft_dataset_verified_alpaca_dedup.json']),
+    Stage('dedup_orpo', ['dedup.py', 'orpo', '--input', 'orpo_dataset_verified.json'], deps=['factcheck_orpo'],
+          inputs=['orpo_dataset_verified.json'], env=DEDUP_ENV, outputs=['orpo_dataset_verified_dedup.json']),
+    Stage('split', ['evaluation.py', 'split', '--input', 'sft_dataset_verified_dedup.json'], deps=['dedup_sft'],
+          inputs=['sft_dataset_verified_dedup.json'], env=['EVAL_HOLDOUT'],
+          outputs=['eval_set.json', 'sft_dataset_alpaca_train.json']),
+    Stage('convert_chat', ['convert_format.py', '--format', 'chat', '--input', 'sft_dataset_alpaca_train.json'],
+          deps=['split'], inputs=['sft_dataset_alpaca_train.json'], outputs=['sft_dataset_chat.jsonl']),
+    Stage('convert_orpo', ['convert_format.py', '--format', 'orpo', '--input', 'orpo_dataset_verified_dedup.json'],
+          deps=['dedup_orpo'], inputs=['orpo_dataset_verified_dedup.json'], outputs=['orpo_dataset_pairs.jsonl']),
+    # pack_dataset.py also skips work on its own when its inputs are unchanged
+    Stage('pack', ['pack_dataset.py'], deps=['convert_chat', 'convert_orpo'],
+          inputs=['sft_dataset_chat.jsonl', 'orpo_dataset_pairs.jsonl'], env=['TOKENIZER_NAME', 'MAX_SEQ_LENGTH']),
+]
+
+
+def file_hash(path):
+    """sha256 of a file's contents, or None if it does not exist"""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_key(stage):
+    """Hash of everything that decides a stage's outputs"""
+    material = {
+        'command': stage.command,
+        'code': {path: file_hash(os.path.join(ROOT, path)) for path in stage.code},
+        'inputs': {path: file_hash(path) for path in stage.inputs},
+        'env': {name: os.getenv(name) for name in stage.env},
+    }
+    if stage.store:
+        with open_store() as store:
+            material['store'] = store.digest()
+    if stage.key:
+        material['extra'] = stage.key()
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_state(path=PIPELINE_STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state, path=PIPELINE_STATE_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def is_current(stage, key, state):
+    """Same key as the last successful run and the outputs are untouched since"""
+    previous = state.get(stage.name)
+    if stage.always or not previous or previous['key'] != key:
+        return False
+    return all(file_hash(path) == previous['outputs'].get(path) for path in stage.outputs)
+
+
+def select(targets=None, scrape=True):
+    """Stages needed for ``targets`` (all by default), in pipeline order"""
+    by_name = {stage.name: stage for stage in STAGES}
+    wanted = set()
+    todo = list(targets or by_name)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(by_name[name].deps)
+    if not scrape:
+        wanted.discard('scrape')
+    return [stage for stage in STAGES if stage.name in wanted]
+
+
+def run_stage(stage, log_dir=PIPELINE_LOG_DIR):
+    """Run a stage's script; returns (return code, seconds, log path)"""
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{stage.name}.log")
+    started = time.monotonic()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        code = subprocess.call([sys.executable, os.path.join(ROOT, stage.command[0])] + stage.command[1:],
+                               stdout=log, stderr=subprocess.STDOUT)
+    return code, time.monotonic() - started, log_path
+
+
+def tail(path, lines=10):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return ''.join(f.readlines()[-lines:])
+
+
+def run_pipeline(stages, force=(), concurrency=PIPELINE_CONCURRENCY, dry_run=False):
+    """Run out-of-date stages as soon as their dependencies finish.
+
+    Returns {stage: 'ran' | 'current' | 'failed' | 'blocked'}.
+    """
+    state = load_state()
+    names = {stage.name for stage in stages}
+    status = {}
+    pending = list(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while pending or running:
+            for stage in list(pending):
+                deps = [d for d in stage.deps if d in names]
+                if any(status.get(d) in ('failed', 'blocked') for d in deps):
+                    pending.remove(stage)
+                    status[stage.name] = 'blocked'
+                    print(f"[{stage.name}] blocked by a failed dependency")
+                    continue
+                if not all(d in status for d in deps):
+                    continue
+                pending.remove(stage)
+
+                upstream_ran = any(status[d] == 'ran' for d in deps)
+                if dry_run:
+                    # Upstream outputs are not rebuilt, so assume they change
+                    current = not upstream_ran and stage.name not in force and is_current(
+                        stage, stage_key(stage), state)
+                    status[stage.name] = 'current' if current else 'ran'
+                    print(f"[{stage.name}] {'up to date' if current else 'would run'}")
+                    continue
+
+                key = stage_key(stage)
+                if stage.name not in force and is_current(stage, key, state):
+                    status[stage.name] = 'current'
+                    print(f"[{stage.name}] up to date")
+                    continue
+                print(f"[{stage.name}] running: {' '.join(stage.command)}")
+                running[pool.submit(run_stage, stage)] = (stage, key)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key = running.pop(future)
+                code, seconds, log_path = future.result()
+                if code != 0:
+                    status[stage.name] = 'failed'
+                    print(f"[{stage.name}] FAILED (exit {code}) after {seconds:.1f}s, see {log_path}")
+                    print(tail(log_path))
+                    continue
+                status[stage.name] = 'ran'
+                state[stage.name] = {
+                    'key': key,
+                    'outputs': {path: file_hash(path) for path in stage.outputs},
+                    'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'seconds': round(seconds, 2),
+                }
+                save_state(state)
+                print(f"[{stage.name}] done in {seconds:.1f}s")
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the data pipeline, rebuilding only what changed")
+    parser.add_argument('targets', nargs='*', help="stages to bring up to date (default: all)")
+    parser.add_argument('--no-scrape', action='store_true', help="use the events already in the store")
+    parser.add_argument('--force', action='append', default=[], metavar='STAGE',
+                        help="rerun this stage even if it is up to date")
+    parser.add_argument('--concurrency', type=int, default=PIPELINE_CONCURRENCY)
+    parser.add_argument('--dry-run', action='store_true', help="only show which stages would run")
+    args = parser.parse_args()
+
+    known = {stage.name for stage in STAGES}
+    unknown = [name for name in args.targets + args.force if name not in known]
+    if unknown:
+        print(f"Unknown stages: {', '.join(unknown)} (known: {', '.join(s.name for s in STAGES)})")
+        sys.exit(1)
+
+    stages = select(args.targets, scrape=not args.no_scrape)
+
+    print("=" * 60)
+    print("DATA PIPELINE")
+    print("=" * 60)
+    print(f"Stages: {', '.join(stage.name for stage in stages)}")
+    print("=" * 60)
+
+    started = time.monotonic()
+    status = run_pipeline(stages, set(args.force), args.concurrency, args.dry_run)
+
+    print("\n" + "=" * 60)
+    counts = {s: list(status.values()).count(s) for s in ('ran', 'current', 'failed', 'blocked')}
+    print(f"DONE in {time.monotonic() - started:.1f}s: {counts['ran']} {'would run' if args.dry_run else 'ran'}, "
+          f"{counts['current']} up to date, {counts['failed']} failed, {counts['blocked']} blocked")
+    print("=" * 60)
+    if counts['failed'] or counts['blocked']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
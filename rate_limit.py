@@ -0,0 +1,176 @@
+"""Shared rate limiting and retry helpers for every HTTP / LLM client.
+
+Each remote endpoint gets its own token bucket (``get_bucket('jina')``).
+Callers take a token before each request instead of sleeping a fixed
+amount. On 429/5xx the request is retried with exponential backoff and
+jitter, honouring ``Retry-After``, and the bucket slows down for everyone
+sharing it until requests succeed again.
+
+Rates are requests per second and can be overridden with ``<NAME>_RPS``
+environment variables, e.g. ``JINA_RPS=3``.
+
+Requests, latency, bytes, retries and time spent waiting for a token are
+recorded in ``metrics`` under the bucket's name.
+"""
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULT_RATES = {
+    'sxodim': 5.0,
+    'jina': 3.0,
+    'openrouter': 2.0,
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket with multiplicative slow-down on throttling"""
+
+    def __init__(self, rate, burst=None, min_rate=None, name=None):
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """Block until ``tokens`` are available, then take them"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(self.paused_until - now, (tokens - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def on_throttle(self, retry_after=None):
+        """Halve the rate and, if the server asked, pause until Retry-After"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def on_success(self):
+        """Creep back towards the configured rate after throttling"""
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(name):
+    """Shared bucket for an endpoint, created on first use"""
+    with _buckets_lock:
+        if name not in _buckets:
+            rate = float(os.getenv(f"{name.upper()}_RPS", DEFAULT_RATES.get(name, 1.0)))
+            _buckets[name] = TokenBucket(rate, name=name)
+        return _buckets[name]
+
+
+def configure(name, rate, burst=None):
+    """Replace an endpoint's bucket, e.g. to lift limits against a local stub"""
+    with _buckets_lock:
+        _buckets[name] = TokenBucket(rate, burst, name=name)
+        return _buckets[name]
+
+
+def parse_retry_after(value):
+    """Retry-After header as seconds (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def request_with_backoff(session, url, bucket, max_retries=5, **kwargs):
+    """GET through ``bucket``, retrying on 429/5xx and connection errors.
+
+    Returns the last response (which may still be an error status) or
+    raises the last exception once retries are exhausted.
+    """
+    endpoint = bucket.name or 'http'
+    for attempt in range(max_retries + 1):
+        with metrics.timer('rate_limit_wait_seconds', endpoint=endpoint):
+            bucket.acquire()
+        started = time.monotonic()
+        try:
+            response = session.get(url, **kwargs)
+        except Exception as e:
+            metrics.inc('http_requests_total', endpoint=endpoint, status='error')
+            if attempt == max_retries:
+                raise
+            metrics.inc('retries_total', endpoint=endpoint, reason=type(e).__name__)
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        metrics.observe('http_request_seconds', time.monotonic() - started, endpoint=endpoint)
+        metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+        metrics.inc('http_response_bytes_total', len(response.content), endpoint=endpoint)
+        if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+            if response.status_code < 400:
+                bucket.on_success()
+            return response
+
+        metrics.inc('retries_total', endpoint=endpoint, reason=response.status_code)
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if response.status_code == 429:
+            bucket.on_throttle(retry_after)
+        time.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+
+
+def call_with_backoff(fn, bucket, max_retries=5, transient=()):
+    """Call ``fn()`` through ``bucket``, retrying on 429/5xx errors.
+
+    Works with any client whose errors carry ``status_code`` (and
+    optionally ``response.headers``), e.g. the OpenAI SDK. Exceptions in
+    ``transient`` are retried as well.
+    """
+    endpoint = bucket.name or 'call'
+    for attempt in range(max_retries + 1):
+        with metrics.timer('rate_limit_wait_seconds', endpoint=endpoint):
+            bucket.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            status = getattr(e, 'status_code', None)
+            if attempt == max_retries or not (status in RETRY_STATUSES or isinstance(e, transient)):
+                raise
+            metrics.inc('retries_total', endpoint=endpoint, reason=status or type(e).__name__)
+            headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            if status == 429:
+                bucket.on_throttle(retry_after)
+            time.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+            continue
+        bucket.on_success()
+        return result
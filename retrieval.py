@@ -0,0 +1,227 @@
+"""BM25 search over scraped events, for grounding answers in current data.
+
+The fine-tuned model only knows prices and dates from its training data.
+Instead of retraining after every scrape, the current events are indexed
+and the best matches for a question are put into the prompt:
+
+    python retrieval.py update
+    python retrieval.py search "концерты джаз"
+
+The index is an SQLite FTS5 table inside the event store (``sxodim.db``),
+one document per active event built from ``name``, ``category``,
+``address``, ``ticket_price``, ``event_dates`` and ``markdown_content``.
+Words are lowercased and stripped of common Russian endings before
+indexing, so "концерты" finds "концерт". ``update()`` keeps a hash per
+document and only rewrites new, changed and removed events; the scraper
+and retry_skipped.py call it after writing to the store.
+
+Dates, categories and prices in a question ("концерты в эти выходные до
+5000 тг") become filters on the store's typed columns (event_query.py),
+so a search only returns events that fit them.
+
+At inference the top-k events go into the user message, after the
+system prompt, so ``inference.PrefixCache`` still applies:
+
+    index = EventIndex(open_store())
+    answers = generate_answers(model, tokenizer, ground(index, questions))
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+
+from event_query import question_filters
+from event_store import date_range, open_store, query_filters
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+CONTEXT_CHARS = int(os.getenv("RETRIEVAL_CONTEXT_CHARS", "600"))  # Content per event in the prompt
+
+FIELDS = ('name', 'category', 'address', 'ticket_price', 'event_dates', 'content')
+# bm25() column weights, in FIELDS order
+WEIGHTS = (5.0, 3.0, 1.0, 1.0, 1.0, 1.0)
+
+SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS event_search USING fts5({', '.join(FIELDS)});
+CREATE TABLE IF NOT EXISTS event_search_state (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+"""
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+# Longest first, so "ами" wins over "и"
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ьми', 'ией', 'иям', 'ием', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ых', 'их', 'ым', 'им', 'ов', 'ев',
+    'ах', 'ях', 'ам', 'ям', 'ом', 'ем', 'ую', 'юю', 'ия', 'ья', 'ию', 'ью', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+
+STOP_WORDS = {
+    'в', 'во', 'на', 'и', 'или', 'а', 'но', 'с', 'со', 'к', 'по', 'за', 'из', 'от', 'до', 'для', 'о', 'об',
+    'что', 'где', 'куда', 'когда', 'как', 'какие', 'какой', 'какая', 'сколько', 'есть', 'будет', 'будут',
+    'это', 'эти', 'этот', 'эту', 'мне', 'я', 'ты', 'вы', 'можно', 'ли', 'не', 'посоветуй', 'сходить',
+    'тг', 'тенге',
+}
+
+
+def stem(word):
+    if not CYRILLIC_RE.search(word):
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def terms(text):
+    """Index terms of ``text``: lowercased, 'ё' -> 'е', stemmed, no stop words"""
+    words = WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+    return [stem(w) for w in words if w not in STOP_WORDS]
+
+
+def document(event):
+    """Indexed column values for an event, in FIELDS order"""
+    first_date, last_date = date_range(event)
+    dates = ' '.join(d for d in (first_date, last_date) if d)
+    values = (
+        event.get('name'), event.get('category'), event.get('address'), event.get('ticket_price'), dates,
+        event.get('markdown_content') or event.get('description'),
+    )
+    return tuple(' '.join(terms(value)) for value in values)
+
+
+class EventIndex:
+    """BM25 index over the active events of an EventStore"""
+
+    def __init__(self, store):
+        self.store = store
+        self.conn = store.conn
+        self.conn.executescript(SCHEMA)
+
+    def update(self):
+        """Re-index new and changed events, drop removed ones; returns counts"""
+        indexed = dict(self.conn.execute("SELECT id, hash FROM event_search_state"))
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        seen = set()
+        with self.conn:
+            for event in self.store.iter_events():
+                doc = document(event)
+                digest = hashlib.sha1(json.dumps(doc, ensure_ascii=False).encode('utf-8')).hexdigest()
+                seen.add(event['id'])
+                previous = indexed.get(event['id'])
+                if previous == digest:
+                    counts['unchanged'] += 1
+                    continue
+                if previous is not None:
+                    self.conn.execute("DELETE FROM event_search WHERE rowid = ?", (event['id'],))
+                self.conn.execute(
+                    f"INSERT INTO event_search (rowid, {', '.join(FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (event['id'],) + doc,
+                )
+                self.conn.execute("INSERT OR REPLACE INTO event_search_state (id, hash) VALUES (?, ?)",
+                                  (event['id'], digest))
+                counts['updated' if previous else 'added'] += 1
+
+            for event_id in indexed.keys() - seen:
+                self.conn.execute("DELETE FROM event_search WHERE rowid = ?", (event_id,))
+                self.conn.execute("DELETE FROM event_search_state WHERE id = ?", (event_id,))
+                counts['removed'] += 1
+        return counts
+
+    def search(self, query, k=RETRIEVAL_TOP_K, **filters):
+        """Top ``k`` (event, score) pairs for ``query``, best first.
+
+        ``filters`` are the typed filters of ``EventStore.query``. Lower
+        bm25 scores are better; scores are returned negated so higher is
+        better.
+        """
+        query_terms = list(dict.fromkeys(terms(query)))
+        if not query_terms:
+            return []
+        match = ' OR '.join(f'"{term}"' for term in query_terms)
+        where, params = query_filters(**filters)
+        sql = (f"SELECT e.data, bm25(event_search, {', '.join(map(str, WEIGHTS))}) AS score "
+               "FROM event_search JOIN events e ON e.id = event_search.rowid "
+               f"WHERE event_search MATCH ? AND {where} ORDER BY score LIMIT ?")
+        rows = self.conn.execute(sql, [match] + params + [k])
+        return [(json.loads(data), -score) for data, score in rows]
+
+    def find(self, question, k=RETRIEVAL_TOP_K, today=None):
+        """Events for a question: dates, category and price from the question
+        (event_query.py) filter the text search, and when it finds fewer
+        than ``k`` events the rest are the soonest events passing the filters.
+        """
+        filters = question_filters(question, self.store.categories(), today)
+        events = [event for event, _ in self.search(question, k, **filters)]
+        if len(events) < k and filters:
+            found = {event['id'] for event in events}
+            events += [e for e in self.store.query(limit=k + len(found), **filters) if e['id'] not in found]
+        return events[:k]
+
+
+def event_card(event, limit=CONTEXT_CHARS):
+    """Short plain-text description of an event for the prompt"""
+    first_date, last_date = date_range(event)
+    dates = first_date if first_date == last_date else f"{first_date} — {last_date}"
+    lines = [
+        f"Название: {event.get('name')}",
+        f"Категория: {event.get('category') or 'Не указано'}",
+        f"Даты: {dates or 'Не указано'}",
+        f"Адрес: {event.get('address') or 'Не указано'}",
+        f"Цена билетов: {event.get('ticket_price') or 'Не указано'}",
+    ]
+    if event.get('url'):
+        lines.append(f"URL: {event['url']}")
+    content = (event.get('markdown_content') or event.get('description') or '').strip()
+    if content:
+        lines.append(f"Описание: {content[:limit]}")
+    return '\n'.join(lines)
+
+
+def grounded_question(question, events):
+    """User message with the retrieved events ahead of the question"""
+    if not events:
+        return question
+    cards = '\n\n'.join(event_card(event) for event in events)
+    return f"Актуальная информация о мероприятиях:\n\n{cards}\n\nВопрос: {question}"
+
+
+def ground(index, questions, k=RETRIEVAL_TOP_K):
+    """``questions`` with their top-k events included, for generate_answers"""
+    return [grounded_question(q, index.find(q, k)) for q in questions]
+
+
+def ground_messages(index, messages, k=RETRIEVAL_TOP_K):
+    """Chat messages with the top-k events added to the last user message"""
+    messages = [dict(m) for m in messages]
+    for message in reversed(messages):
+        if message.get('role') == 'user' and isinstance(message.get('content'), str):
+            message['content'] = grounded_question(message['content'], index.find(message['content'], k))
+            break
+    return messages
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'update'
+
+    with open_store() as store:
+        index = EventIndex(store)
+        if command == 'update':
+            counts = index.update()
+            print(f"Index: {counts['added']} added, {counts['updated']} updated, "
+                  f"{counts['removed']} removed, {counts['unchanged']} unchanged")
+        elif command == 'search' and len(sys.argv) > 2:
+            index.update()
+            for event, score in index.search(' '.join(sys.argv[2:]), k=10):
+                print(f"{score:6.2f}  [{event['id']}] {event.get('name')} ({event.get('category')})")
+        else:
+            print("Usage: python retrieval.py update | search <query>")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
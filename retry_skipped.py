@@ -1,42 +1,17 @@
-import requests
-import json
-import time
-import os
 from dotenv import load_dotenv
 
-load_dotenv()
-
-# Jina AI headers
-jina_headers = {
-    'Authorization': f'Bearer {os.getenv("JINA_API_KEY")}'
-}
+import metrics
+from event_store import open_store
+from html_to_markdown import html_to_markdown
+from retrieval import EventIndex
+from scrape_sxodim import MARKDOWN_SOURCES, fetch_remote_markdown, local_markdown
 
-def fetch_event_content(event_url):
-    """Fetch detailed content for an event using Jina AI reader"""
-    jina_url = f"https://r.jina.ai/{event_url}"
-    try:
-        response = requests.get(jina_url, headers=jina_headers, timeout=60)
-        if response.status_code == 200:
-            return response.text
-        else:
-            print(f"  Error: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"  Exception: {e}")
-        return None
+load_dotenv()
 
 def main():
-    # Load existing data
-    with open('sxodim_data.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    events = data['events']
-
-    # Find skipped events
-    skipped = []
-    for i, event in enumerate(events):
-        if event.get('markdown_content') is None and event.get('url'):
-            skipped.append((i, event))
+    # Only the rows still missing reader content are read
+    store = open_store()
+    skipped = list(store.events_needing_content())
 
     print("=" * 60)
     print("RETRY SKIPPED EVENTS")
@@ -45,30 +20,37 @@ def main():
     print("=" * 60)
 
     fixed = 0
-    for idx, (i, event) in enumerate(skipped):
+    for idx, event in enumerate(skipped):
         name = event['name'][:50]
         url = event['url']
         print(f"[{idx+1}/{len(skipped)}] {name}...", end=" ", flush=True)
 
-        content = fetch_event_content(url)
+        # Same order as the scraper: local conversion, then MARKDOWN_SOURCES
+        content, source = local_markdown(event), 'html'
+        if not content and url:
+            content, source = fetch_remote_markdown(url)
+        if not content and 'html' in MARKDOWN_SOURCES:
+            # Short listing HTML is still better than nothing
+            content, source = html_to_markdown(event.get('content_html')) or None, 'html'
         if content:
-            events[i]['markdown_content'] = content
+            # Patch just this row
+            store.update(event['id'], markdown_content=content, markdown_source=source)
             fixed += 1
-            print("OK")
+            metrics.inc('markdown_source_total', source=source)
+            print(f"OK ({source})")
         else:
+            metrics.inc('events_skipped_total', stage='retry', reason='fetch_failed')
             print("FAILED")
 
-        time.sleep(1)  # Longer delay for retries
-
-    # Save updated data
-    data['events'] = events
-    data['scraped_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
-
-    with open('sxodim_data.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if fixed:
+        counts = EventIndex(store).update()
+        print(f"Search index: {counts['added'] + counts['updated']} events re-indexed")
+    store.close()
 
     print("\n" + "=" * 60)
-    print(f"DONE! Fixed {fixed}/{len(skipped)} events")
+    print(f"DONE! Fixed {fixed}/{len(skipped)} events in {store.path}")
+    print("Run `python event_store.py export` to refresh sxodim_data.json")
+    print(f"Metrics: {metrics.write_report('retry')}")
     print("=" * 60)
 
 if __name__ == '__main__':
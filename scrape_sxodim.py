@@ -1,12 +1,41 @@
 import requests
+import argparse
+import hashlib
 import json
 import time
 import sys
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+import metrics
+from event_store import open_store
+from html_to_markdown import html_to_markdown
+from journal import Journal, read_journal
+from rate_limit import get_bucket, request_with_backoff
+from retrieval import EventIndex
+
 load_dotenv()
 
+# Endpoints (overridable so the crawl can be pointed at a local stub)
+SXODIM_API_URL = os.getenv("SXODIM_API_URL", "https://sxodim.com/api/posts/in/almaty/tickets")
+JINA_READER_URL = os.getenv("JINA_READER_URL", "https://r.jina.ai")
+
+# Crawl settings
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "8"))  # Max requests in flight
+JOURNAL_PATH = 'sxodim_data.jsonl'  # Per-event checkpoint, removed after the final save
+
+# Where markdown_content comes from, tried in order:
+#   html  - local conversion of the listing's content_html (no request)
+#   page  - fetch the event page ourselves and convert it locally
+#   jina  - r.jina.ai reader
+MARKDOWN_SOURCES = os.getenv("MARKDOWN_SOURCES", "html,jina").split(',')
+LOCAL_MARKDOWN_MIN_CHARS = int(os.getenv("LOCAL_MARKDOWN_MIN_CHARS", "200"))  # Shorter results fall through
+
+# Listing fields that decide whether an event changed since the last snapshot
+FINGERPRINT_FIELDS = ('name', 'description', 'content_html', 'address', 'ticket_price', 'event_dates', 'url')
+
 # API headers
 api_headers = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:147.0) Gecko/20100101 Firefox/147.0',
@@ -22,10 +51,21 @@ jina_headers = {
     'Authorization': f'Bearer {os.getenv("JINA_API_KEY")}'
 }
 
+
+_local = threading.local()
+
+
+def get_session():
+    """One keep-alive session per worker thread"""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
 def fetch_page(page_num):
     """Fetch a single page of events from the API"""
-    url = f"https://sxodim.com/api/posts/in/almaty/tickets?page={page_num}"
-    response = requests.get(url, headers=api_headers)
+    url = f"{SXODIM_API_URL}?page={page_num}"
+    response = request_with_backoff(get_session(), url, get_bucket('sxodim'), headers=api_headers, timeout=30)
     if response.status_code == 200:
         return response.json()
     else:
@@ -34,9 +74,9 @@ def fetch_page(page_num):
 
 def fetch_event_content(event_url):
     """Fetch detailed content for an event using Jina AI reader"""
-    jina_url = f"https://r.jina.ai/{event_url}"
+    jina_url = f"{JINA_READER_URL}/{event_url}"
     try:
-        response = requests.get(jina_url, headers=jina_headers, timeout=30)
+        response = request_with_backoff(get_session(), jina_url, get_bucket('jina'), headers=jina_headers, timeout=30)
         if response.status_code == 200:
             return response.text
         else:
@@ -44,99 +84,217 @@ def fetch_event_content(event_url):
     except Exception as e:
         return None
 
+def fetch_page_markdown(event_url):
+    """Fetch the event page directly and convert its main content locally"""
+    try:
+        response = request_with_backoff(get_session(), event_url, get_bucket('sxodim'),
+                                        headers={'User-Agent': api_headers['User-Agent']}, timeout=30)
+        if response.status_code == 200:
+            return html_to_markdown(response.text, root_tags=('article', 'main')) or None
+        return None
+    except Exception as e:
+        return None
+
+def local_markdown(event_info):
+    """Markdown from the listing's own HTML, if it is substantial enough"""
+    if 'html' not in MARKDOWN_SOURCES:
+        return None
+    markdown = html_to_markdown(event_info.get('content_html'))
+    if len(markdown) >= LOCAL_MARKDOWN_MIN_CHARS:
+        return markdown
+    return None
+
+def fetch_remote_markdown(event_url):
+    """Try the remote markdown sources in order; returns (markdown, source)"""
+    fetchers = {'page': fetch_page_markdown, 'jina': fetch_event_content}
+    for source in MARKDOWN_SOURCES:
+        if source in fetchers:
+            with metrics.timer('markdown_fetch_seconds', source=source):
+                markdown = fetchers[source](event_url)
+            if markdown:
+                return markdown, source
+            metrics.inc('markdown_fetch_failed_total', source=source)
+    return None, None
+
+def extract_event_info(event):
+    """Pick the fields we keep from a listing API event"""
+    return {
+        'id': event.get('id'),
+        'name': event.get('name'),
+        'slug': event.get('slug'),
+        'city': event.get('city', {}).get('name'),
+        'category': event.get('category', {}).get('name'),
+        'description': event.get('description'),
+        'content_html': event.get('content'),
+        'image': event.get('image'),
+        'type': event.get('type'),
+        'subtype': event.get('subtype'),
+        'address': event.get('address'),
+        'ticket_price': event.get('additional', {}).get('ticket_price'),
+        'event_dates': event.get('event_dates', []),
+        'url': event.get('cardData', {}).get('url'),
+        'ticket_url': event.get('cardData', {}).get('ticketUrl'),
+        'views': event.get('cardData', {}).get('views'),
+        'coordinates': event.get('coordinates'),
+    }
+
+def fingerprint(event_info):
+    """Hash of the listing fields that matter for an event's content"""
+    payload = json.dumps([event_info.get(field) for field in FINGERPRINT_FIELDS], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_snapshot(store):
+    """Events from the previous run keyed by id, tombstones included"""
+    return {e['id']: e for e in store.iter_events(include_removed=True)}
+
+def diff_snapshot(all_events, previous, listing_complete=True):
+    """Reuse reader content for unchanged events and tombstone removed ones.
+
+    Returns (tombstones, counts). Unchanged events get their previous
+    markdown_content filled in, so only new and changed events are left
+    to fetch. If some listing pages failed, events missing from the
+    listing are carried over as they were instead of being tombstoned.
+    """
+    counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+    current_ids = set()
+    for event_info in all_events:
+        current_ids.add(event_info['id'])
+        prev = previous.get(event_info['id'])
+        if prev is None or prev.get('removed'):
+            counts['new'] += 1
+        elif fingerprint(prev) != fingerprint(event_info) or prev.get('markdown_content') is None:
+            counts['changed'] += 1
+        else:
+            event_info['markdown_content'] = prev['markdown_content']
+            if 'markdown_source' in prev:
+                event_info['markdown_source'] = prev['markdown_source']
+            counts['unchanged'] += 1
+
+    tombstones = []
+    for event_id, prev in previous.items():
+        if event_id in current_ids:
+            continue
+        if not prev.get('removed') and listing_complete:
+            prev = dict(prev, removed=True, removed_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+            counts['removed'] += 1
+        tombstones.append(prev)
+    return tombstones, counts
+
+def save_events(store, events, output_file='sxodim_data.json'):
+    """Replace the store contents and refresh the JSON export"""
+    store.replace_all(events)
+    store.set_meta('scraped_at', time.strftime('%Y-%m-%d %H:%M:%S'))
+    store.export_json(output_file)
+    counts = EventIndex(store).update()
+    print(f"Search index: {counts['added']} added, {counts['updated']} updated, {counts['removed']} removed")
+
 def main():
-    all_events = []
-    total_events_count = 0
+    parser = argparse.ArgumentParser(description="Scrape Almaty events from sxodim.com")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only refetch reader content for new or changed events")
+    args = parser.parse_args()
+
+    started = time.monotonic()
 
-    # First, count total events
     print("=" * 60)
     print("SXODIM.COM SCRAPER")
     print("=" * 60)
 
     first_page = fetch_page(1)
-    if first_page and 'meta' in first_page:
-        total_events_count = first_page['meta']['total']
-        total_pages = first_page['meta']['last_page']
-        print(f"Total events to scrape: {total_events_count}")
-        print(f"Total pages: {total_pages}")
+    if not first_page or 'meta' not in first_page:
+        print("Could not read the first page, aborting")
+        sys.exit(1)
+
+    total_events_count = first_page['meta']['total']
+    total_pages = first_page['meta']['last_page']
+    print(f"Total events to scrape: {total_events_count}")
+    print(f"Total pages: {total_pages}")
+    print(f"Concurrency: {SCRAPE_CONCURRENCY}")
     print("=" * 60)
 
-    current_event = 0
-
-    # Fetch all pages (1-7)
-    for page in range(1, 8):
-        print(f"\n[PAGE {page}/7] Fetching...")
-        page_data = fetch_page(page)
-
-        if page_data and 'data' in page_data:
-            events = page_data['data']
-            print(f"[PAGE {page}/7] Found {len(events)} events")
-
-            for i, event in enumerate(events):
-                current_event += 1
-                event_name = event.get('name', 'Unknown')[:40]
-
-                # Extract key info
-                event_info = {
-                    'id': event.get('id'),
-                    'name': event.get('name'),
-                    'slug': event.get('slug'),
-                    'city': event.get('city', {}).get('name'),
-                    'category': event.get('category', {}).get('name'),
-                    'description': event.get('description'),
-                    'content_html': event.get('content'),
-                    'image': event.get('image'),
-                    'type': event.get('type'),
-                    'subtype': event.get('subtype'),
-                    'address': event.get('address'),
-                    'ticket_price': event.get('additional', {}).get('ticket_price'),
-                    'event_dates': event.get('event_dates', []),
-                    'url': event.get('cardData', {}).get('url'),
-                    'ticket_url': event.get('cardData', {}).get('ticketUrl'),
-                    'views': event.get('cardData', {}).get('views'),
-                    'coordinates': event.get('coordinates'),
-                }
-
-                # Fetch detailed markdown content
-                print(f"  [{current_event}/{total_events_count}] {event_name}...", end=" ", flush=True)
-
-                if event_info['url']:
-                    markdown_content = fetch_event_content(event_info['url'])
-                    event_info['markdown_content'] = markdown_content
-                    if markdown_content:
-                        print("OK")
-                    else:
-                        print("SKIP")
-                    time.sleep(0.3)
-                else:
-                    event_info['markdown_content'] = None
-                    print("NO URL")
+    store = open_store()
+
+    with ThreadPoolExecutor(max_workers=SCRAPE_CONCURRENCY) as pool:
+        # Fetch the remaining listing pages in parallel
+        pages = {1: first_page}
+        futures = {pool.submit(fetch_page, page): page for page in range(2, total_pages + 1)}
+        for future in as_completed(futures):
+            pages[futures[future]] = future.result()
+
+        all_events = []
+        listing_complete = True
+        for page in range(1, total_pages + 1):
+            page_data = pages.get(page)
+            if page_data and 'data' in page_data:
+                print(f"[PAGE {page}/{total_pages}] Found {len(page_data['data'])} events")
+                all_events.extend(extract_event_info(event) for event in page_data['data'])
+                metrics.inc('listing_pages_total', status='ok')
+            else:
+                print(f"[PAGE {page}/{total_pages}] FAILED")
+                metrics.inc('listing_pages_total', status='failed')
+                listing_complete = False
 
-                all_events.append(event_info)
+        tombstones = []
+        if args.incremental:
+            tombstones, counts = diff_snapshot(all_events, load_snapshot(store), listing_complete)
+            print(f"Incremental: {counts['new']} new, {counts['changed']} changed, "
+                  f"{counts['unchanged']} unchanged, {counts['removed']} removed")
+            metrics.inc('events_skipped_total', counts['unchanged'], stage='scrape', reason='unchanged')
 
-                # Save progress every 10 events
-                if current_event % 10 == 0:
-                    with open('sxodim_data.json', 'w', encoding='utf-8') as f:
-                        json.dump({
-                            'total_events': len(all_events),
-                            'scraped_at': time.strftime('%Y-%m-%d %H:%M:%S'),
-                            'events': all_events
-                        }, f, ensure_ascii=False, indent=2)
-                    print(f"  [SAVED] Progress saved ({current_event} events)")
+        # Resume: events already in the journal keep their content
+        done_events = {e['id']: e for e in read_journal(JOURNAL_PATH)}
+        if done_events:
+            print(f"Resuming: {len(done_events)} events already in {JOURNAL_PATH}")
+            metrics.inc('events_skipped_total', len(done_events), stage='scrape', reason='already_done')
+        all_events = [done_events.get(e['id'], e) for e in all_events]
 
-        time.sleep(0.5)
+        with Journal(JOURNAL_PATH) as journal:
+            # Convert locally where possible, fetch the rest in parallel
+            futures = {}
+            converted = 0
+            for event_info in all_events:
+                if event_info['id'] in done_events or 'markdown_content' in event_info:
+                    continue
+                markdown = local_markdown(event_info)
+                if markdown:
+                    event_info['markdown_content'] = markdown
+                    event_info['markdown_source'] = 'html'
+                    journal.append(event_info)
+                    metrics.inc('markdown_source_total', source='html')
+                    converted += 1
+                elif event_info['url']:
+                    futures[pool.submit(fetch_remote_markdown, event_info['url'])] = event_info
+                else:
+                    event_info['markdown_content'] = None
+                    journal.append(event_info)
+                    metrics.inc('events_skipped_total', stage='scrape', reason='no_url')
+            print(f"Converted locally: {converted}, fetching remotely: {len(futures)}")
+
+            done = 0
+            for future in as_completed(futures):
+                event_info = futures[future]
+                event_info['markdown_content'], event_info['markdown_source'] = future.result()
+                journal.append(event_info)
+                done += 1
+                if event_info['markdown_content']:
+                    metrics.inc('markdown_source_total', source=event_info['markdown_source'])
+                else:
+                    metrics.inc('events_skipped_total', stage='scrape', reason='fetch_failed')
+                status = "OK" if event_info['markdown_content'] else "SKIP"
+                print(f"  [{done}/{len(futures)}] {(event_info['name'] or 'Unknown')[:40]}... {status}")
 
     # Final save
     output_file = 'sxodim_data.json'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            'total_events': len(all_events),
-            'scraped_at': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'events': all_events
-        }, f, ensure_ascii=False, indent=2)
+    save_events(store, all_events + tombstones, output_file)
+    store.close()
+    os.remove(JOURNAL_PATH)
 
     print("\n" + "=" * 60)
-    print(f"DONE! Saved {len(all_events)} events to {output_file}")
+    print(f"DONE! Saved {len(all_events)} events to {store.path} and {output_file}")
+    if tombstones:
+        print(f"Tombstoned (removed from listing): {len(tombstones)}")
+    print(f"Wall time: {time.monotonic() - started:.1f}s")
+    print(f"Metrics: {metrics.write_report('scrape')}")
     print("=" * 60)
 
 if __name__ == '__main__':
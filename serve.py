@@ -0,0 +1,553 @@
+"""Local OpenAI-compatible server for the fine-tuned model.
+
+Serves ``POST /v1/chat/completions`` (plain and streaming), so anything
+using the ``OpenAI`` client, including generation.py via
+OPENROUTER_BASE_URL, can talk to our own model:
+
+    python serve.py --model rsyrlybay/qwen2.5-3b-sxodim-almaty --port 8000
+    OPENROUTER_BASE_URL=http://127.0.0.1:8000/v1
+
+Requests go into a bounded queue. A single engine thread owns the model
+and does continuous batching: between two decode steps it drops finished
+sequences and prefills waiting requests into the running batch (up to
+``--max-batch``), so a long answer never holds up short ones. Prompts
+that start with the default system prompt reuse its KV cache
+(``inference.PrefixCache``). The batch KV cache is left-padded to a
+common width and pads are masked out.
+
+Limits: ``--max-batch`` sequences decode together, ``--max-queue``
+requests may wait (more get 429 with Retry-After), ``max_tokens`` is
+capped at ``--max-tokens`` and prompts longer than
+``--max-prompt-tokens`` get 400. ``GET /metrics`` returns queue,
+latency and throughput figures as JSON. Runs on CPU when there is no GPU.
+
+With ``--retrieval-k N`` the top N matching events from the search index
+(retrieval.py) are added to the last user message, so answers use the
+latest scraped prices and dates.
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache
+
+from event_store import EventStore
+from inference import PrefixCache
+from retrieval import EventIndex, ground_messages
+
+SERVE_MODEL = os.getenv("SERVE_MODEL", "rsyrlybay/qwen2.5-3b-sxodim-almaty")
+SERVE_MAX_BATCH = int(os.getenv("SERVE_MAX_BATCH", "8"))            # Sequences decoded together
+SERVE_MAX_QUEUE = int(os.getenv("SERVE_MAX_QUEUE", "64"))           # Waiting requests before 429
+SERVE_MAX_TOKENS = int(os.getenv("SERVE_MAX_TOKENS", "512"))        # Cap on max_tokens
+SERVE_MAX_PROMPT_TOKENS = int(os.getenv("SERVE_MAX_PROMPT_TOKENS", "2048"))
+
+CHAT_PATH = "/v1/chat/completions"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Request:
+
+    def __init__(self, prompt_ids, max_tokens, temperature, top_p):
+        self.id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        self.prompt_ids = prompt_ids
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.generated = []
+        self.finish_reason = None
+        self.events = queue.Queue()   # New token ids, then None when finished
+        self.created = time.time()
+        self.submitted = time.monotonic()
+        self.first_token_at = None
+        self.finished_at = None
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Metrics:
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counts = {'requests': 0, 'completed': 0, 'rejected': 0, 'errors': 0,
+                       'prompt_tokens': 0, 'completion_tokens': 0, 'decode_steps': 0, 'batched_rows': 0}
+        self.ttft = deque(maxlen=window)
+        self.latency = deque(maxlen=window)
+
+    def add(self, **counts):
+        with self.lock:
+            for key, value in counts.items():
+                self.counts[key] += value
+
+    def finished(self, request):
+        with self.lock:
+            self.counts['completed'] += 1
+            self.counts['prompt_tokens'] += len(request.prompt_ids)
+            self.counts['completion_tokens'] += len(request.generated)
+            if request.first_token_at is not None:
+                self.ttft.append(request.first_token_at - request.submitted)
+            self.latency.append(request.finished_at - request.submitted)
+
+    def snapshot(self, engine):
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            ms = lambda v: None if v is None else round(v * 1000, 1)
+            return dict(
+                self.counts,
+                uptime_s=round(uptime, 1),
+                active=engine.active_count,
+                queued=engine.pending.qsize(),
+                max_batch=engine.max_batch,
+                avg_batch_size=round(self.counts['batched_rows'] / max(1, self.counts['decode_steps']), 2),
+                completion_tokens_per_s=round(self.counts['completion_tokens'] / max(uptime, 1e-9), 1),
+                ttft_ms_p50=ms(percentile(self.ttft, 0.5)),
+                ttft_ms_p95=ms(percentile(self.ttft, 0.95)),
+                latency_ms_p50=ms(percentile(self.latency, 0.5)),
+                latency_ms_p95=ms(percentile(self.latency, 0.95)),
+            )
+
+
+def sample(logits, temperature, top_p):
+    """Next token id from last-position logits [V]"""
+    if temperature <= 0:
+        return int(torch.argmax(logits))
+    probs = torch.softmax(logits.float() / temperature, dim=-1)
+    if top_p < 1.0:
+        sorted_probs, sorted_ids = torch.sort(probs, descending=True)
+        keep = torch.cumsum(sorted_probs, dim=-1) - sorted_probs < top_p
+        sorted_probs = sorted_probs * keep
+        return int(sorted_ids[torch.multinomial(sorted_probs / sorted_probs.sum(), 1)])
+    return int(torch.multinomial(probs, 1))
+
+
+class Engine(threading.Thread):
+    """Owns the model; continuous batching over a shared left-padded KV cache"""
+
+    def __init__(self, model, tokenizer, max_batch=SERVE_MAX_BATCH, max_queue=SERVE_MAX_QUEUE,
+                 prefix_cache=None, metrics=None):
+        super().__init__(daemon=True)
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch = max_batch
+        self.pending = queue.Queue(maxsize=max_queue)
+        self.prefix_cache = prefix_cache
+        self.metrics = metrics or Metrics()
+        self.stop_ids = {i for i in (tokenizer.eos_token_id, tokenizer.pad_token_id,
+                                     tokenizer.convert_tokens_to_ids('<|im_end|>')) if isinstance(i, int)}
+
+        # Batch state, one row per active request
+        self.requests = []
+        self.kv = None          # Per layer (keys, values), [B, heads, T, dim]
+        self.mask = None        # [B, T], 0 for left padding
+        self.positions = None   # [B], position id of each row's next token
+        self.last_tokens = None
+
+    @property
+    def active_count(self):
+        return len(self.requests)
+
+    def submit(self, request):
+        try:
+            self.pending.put_nowait(request)
+        except queue.Full:
+            raise QueueFull()
+        self.metrics.add(requests=1)
+
+    def run(self):
+        while True:
+            # Admit waiting requests between decode steps
+            while len(self.requests) < self.max_batch:
+                try:
+                    request = self.pending.get(block=not self.requests, timeout=None if not self.requests else 0)
+                except queue.Empty:
+                    break
+                try:
+                    self.prefill(request)
+                except Exception as e:
+                    print(f"Prefill error: {e}")
+                    self.metrics.add(errors=1)
+                    request.finish_reason = 'error'
+                    request.finished_at = time.monotonic()
+                    request.events.put(None)
+            # Requests can finish on their first token
+            self.evict_finished()
+            if self.requests:
+                try:
+                    self.decode_step()
+                except Exception as e:
+                    print(f"Decode error: {e}")
+                    self.metrics.add(errors=len(self.requests))
+                    for request in self.requests:
+                        request.finish_reason = 'error'
+                    self.evict_finished()
+
+    # Batch cache helpers
+
+    def prefill(self, request):
+        """Run the prompt, emit the first token and add the row to the batch"""
+        device = self.model.device
+        ids = request.prompt_ids
+        cache = None
+        start = 0
+        if self.prefix_cache is not None and self.prefix_cache.matches(ids):
+            cache = DynamicCache([(layer.keys.clone(), layer.values.clone()) for layer in self.prefix_cache.cache.layers])
+            start = len(self.prefix_cache.prefix_ids)
+
+        with torch.no_grad():
+            output = self.model(
+                input_ids=torch.tensor([ids[start:]], device=device),
+                position_ids=torch.arange(start, len(ids), device=device)[None],
+                past_key_values=cache if cache is not None else DynamicCache(),
+                use_cache=True,
+            )
+        row_kv = [(layer.keys, layer.values) for layer in output.past_key_values.layers]
+        token = sample(output.logits[0, -1], request.temperature, request.top_p)
+        self.merge(row_kv, len(ids), token)
+        self.requests.append(request)
+        self.emit(len(self.requests) - 1, token)
+
+    def merge(self, row_kv, length, token):
+        device = self.model.device
+        row_mask = torch.ones((1, length), dtype=torch.long, device=device)
+        if self.kv is None:
+            self.kv, self.mask = row_kv, row_mask
+        else:
+            width = self.mask.shape[1]
+            if length < width:
+                row_kv = [(left_pad(k, width - length), left_pad(v, width - length)) for k, v in row_kv]
+                row_mask = torch.cat([torch.zeros((1, width - length), dtype=torch.long, device=device), row_mask], 1)
+            elif length > width:
+                self.kv = [(left_pad(k, length - width), left_pad(v, length - width)) for k, v in self.kv]
+                self.mask = torch.cat([torch.zeros((self.mask.shape[0], length - width), dtype=torch.long,
+                                                   device=device), self.mask], 1)
+            self.kv = [(torch.cat([k, rk]), torch.cat([v, rv])) for (k, v), (rk, rv) in zip(self.kv, row_kv)]
+            self.mask = torch.cat([self.mask, row_mask])
+        position = torch.tensor([length], device=device)
+        last = torch.tensor([token], device=device)
+        self.positions = position if self.positions is None else torch.cat([self.positions, position])
+        self.last_tokens = last if self.last_tokens is None else torch.cat([self.last_tokens, last])
+
+    def decode_step(self):
+        mask = torch.cat([self.mask, torch.ones((self.mask.shape[0], 1), dtype=torch.long, device=self.mask.device)], 1)
+        cache = DynamicCache(self.kv)
+        with torch.no_grad():
+            output = self.model(
+                input_ids=self.last_tokens[:, None],
+                attention_mask=mask,
+                position_ids=self.positions[:, None],
+                past_key_values=cache,
+                use_cache=True,
+            )
+        self.kv = [(layer.keys, layer.values) for layer in cache.layers]
+        self.mask = mask
+        self.positions = self.positions + 1
+        self.metrics.add(decode_steps=1, batched_rows=len(self.requests))
+
+        tokens = [sample(output.logits[row, -1], r.temperature, r.top_p) for row, r in enumerate(self.requests)]
+        self.last_tokens = torch.tensor(tokens, device=self.mask.device)
+        for row, token in enumerate(tokens):
+            self.emit(row, token)
+        self.evict_finished()
+
+    def emit(self, row, token):
+        request = self.requests[row]
+        if request.finish_reason is not None:
+            return
+        if request.first_token_at is None:
+            request.first_token_at = time.monotonic()
+        if token in self.stop_ids:
+            request.finish_reason = 'stop'
+            return
+        request.generated.append(token)
+        request.events.put(token)
+        if len(request.generated) >= request.max_tokens:
+            request.finish_reason = 'length'
+
+    def evict_finished(self):
+        keep = [row for row, r in enumerate(self.requests) if r.finish_reason is None]
+        if len(keep) == len(self.requests):
+            return
+        for r in self.requests:
+            if r.finish_reason is not None:
+                r.finished_at = time.monotonic()
+                self.metrics.finished(r)
+                r.events.put(None)
+        self.requests = [self.requests[row] for row in keep]
+        if not keep:
+            self.kv = self.mask = self.positions = self.last_tokens = None
+            return
+
+        index = torch.tensor(keep, device=self.mask.device)
+        self.kv = [(k.index_select(0, index), v.index_select(0, index)) for k, v in self.kv]
+        self.mask = self.mask.index_select(0, index)
+        self.positions = self.positions.index_select(0, index)
+        self.last_tokens = self.last_tokens.index_select(0, index)
+
+        # Drop padding columns no remaining row uses
+        used = self.mask.sum(0).nonzero()
+        trim = int(used[0]) if len(used) else 0
+        if trim:
+            self.kv = [(k[:, :, trim:], v[:, :, trim:]) for k, v in self.kv]
+            self.mask = self.mask[:, trim:]
+
+
+def left_pad(tensor, amount):
+    """Zero-pad a [B, heads, T, dim] cache tensor on the left of T"""
+    shape = list(tensor.shape)
+    shape[2] = amount
+    return torch.cat([tensor.new_zeros(shape), tensor], 2)
+
+
+class TextStream:
+    """Incremental detokenization that never splits a multi-byte character"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.ids = []
+        self.sent = ''
+
+    def push(self, token):
+        self.ids.append(token)
+        text = self.tokenizer.decode(self.ids, skip_special_tokens=True)
+        if text.endswith('�'):
+            return ''
+        delta, self.sent = text[len(self.sent):], text
+        return delta
+
+
+def chat_params(body, max_tokens):
+    """(messages, max_tokens, temperature, top_p) of a chat request; ValueError names what is wrong"""
+    if not isinstance(body, dict) or 'messages' not in body:
+        raise ValueError("Request body must be JSON with 'messages'")
+    messages = body['messages']
+    if not isinstance(messages, list) or not messages or not all(
+            isinstance(m, dict) and isinstance(m.get('role'), str) and isinstance(m.get('content'), str)
+            for m in messages):
+        raise ValueError("'messages' must be a non-empty list of {role, content} objects")
+    try:
+        requested = int(body.get('max_tokens') or body.get('max_completion_tokens') or max_tokens)
+        temperature = float(body.get('temperature', 0.7))
+        top_p = float(body.get('top_p', 1.0))
+    except (TypeError, ValueError):
+        raise ValueError("'max_tokens', 'temperature' and 'top_p' must be numbers") from None
+    if requested < 1:
+        raise ValueError("'max_tokens' must be at least 1")
+    if not 0 <= temperature <= 2:
+        raise ValueError("'temperature' must be between 0 and 2")
+    if not 0 < top_p <= 1:
+        raise ValueError("'top_p' must be greater than 0 and at most 1")
+    return messages, min(requested, max_tokens), temperature, top_p
+
+
+class ServerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {'error': {'message': message, 'type': 'invalid_request_error', 'code': status}}, headers)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/metrics':
+            self.send_json(200, server.engine.metrics.snapshot(server.engine))
+        elif self.path == '/v1/models':
+            self.send_json(200, {'object': 'list', 'data': [{'id': server.model_name, 'object': 'model', 'owned_by': 'local'}]})
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_error_json(404, 'not found')
+
+    def do_POST(self):
+        server = self.server
+        if self.path != CHAT_PATH:
+            self.send_error_json(404, 'not found')
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self.send_error_json(400, "Request body must be JSON with 'messages'")
+            return
+        try:
+            messages, max_tokens, temperature, top_p = chat_params(body, server.max_tokens)
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+
+        if server.retrieval_k:
+            with EventStore() as store:
+                messages = ground_messages(EventIndex(store), messages, server.retrieval_k)
+
+        tokenizer = server.tokenizer
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        prompt_ids = tokenizer(text, add_special_tokens=False)['input_ids']
+        if len(prompt_ids) > server.max_prompt_tokens:
+            self.send_error_json(400, f"Prompt is {len(prompt_ids)} tokens, limit is {server.max_prompt_tokens}")
+            return
+
+        request = Request(prompt_ids, max_tokens=max_tokens, temperature=temperature, top_p=top_p)
+        try:
+            server.engine.submit(request)
+        except QueueFull:
+            server.engine.metrics.add(rejected=1)
+            self.send_error_json(429, 'Server is busy, retry later', {'Retry-After': '1'})
+            return
+
+        if body.get('stream'):
+            self.stream(request, body)
+        else:
+            self.complete(request)
+
+    def completion_usage(self, request):
+        return {
+            'prompt_tokens': len(request.prompt_ids),
+            'completion_tokens': len(request.generated),
+            'total_tokens': len(request.prompt_ids) + len(request.generated),
+        }
+
+    def complete(self, request):
+        while request.events.get() is not None:
+            pass
+        content = self.server.tokenizer.decode(request.generated, skip_special_tokens=True)
+        self.send_json(200, {
+            'id': request.id,
+            'object': 'chat.completion',
+            'created': int(request.created),
+            'model': self.server.model_name,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': request.finish_reason,
+            }],
+            'usage': self.completion_usage(request),
+        })
+
+    def stream(self, request, body):
+        """Server-sent events in the OpenAI streaming format"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None, **extra):
+            payload = {
+                'id': request.id,
+                'object': 'chat.completion.chunk',
+                'created': int(request.created),
+                'model': self.server.model_name,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+            payload.update(extra)
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        text = TextStream(self.server.tokenizer)
+        try:
+            chunk({'role': 'assistant', 'content': ''})
+            while True:
+                token = request.events.get()
+                if token is None:
+                    break
+                delta = text.push(token)
+                if delta:
+                    chunk({'content': delta})
+            extra = {}
+            if (body.get('stream_options') or {}).get('include_usage'):
+                extra['usage'] = self.completion_usage(request)
+            chunk({}, request.finish_reason, **extra)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+def load_model(name, device=None):
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    tokenizer = AutoTokenizer.from_pretrained(name)
+    model = AutoModelForCausalLM.from_pretrained(
+        name, dtype=torch.float16 if device == 'cuda' else torch.float32).to(device).eval()
+    return model, tokenizer
+
+
+def start_server(model_name=SERVE_MODEL, host='127.0.0.1', port=8000, max_batch=SERVE_MAX_BATCH,
+                 max_queue=SERVE_MAX_QUEUE, max_tokens=SERVE_MAX_TOKENS,
+                 max_prompt_tokens=SERVE_MAX_PROMPT_TOKENS, prefix_cache=True, retrieval_k=0):
+    """Load the model and serve in a background thread; returns (server, base_url)"""
+    model, tokenizer = load_model(model_name)
+    metrics = Metrics()
+    engine = Engine(model, tokenizer, max_batch, max_queue,
+                    PrefixCache(model, tokenizer) if prefix_cache else None, metrics)
+    engine.start()
+
+    server = ThreadingHTTPServer((host, port), ServerHandler)
+    server.daemon_threads = True
+    server.engine = engine
+    server.tokenizer = tokenizer
+    server.model_name = model_name
+    server.max_tokens = max_tokens
+    server.max_prompt_tokens = max_prompt_tokens
+    server.retrieval_k = retrieval_k
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible server for the fine-tuned model")
+    parser.add_argument('--model', default=SERVE_MODEL)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=SERVE_MAX_BATCH)
+    parser.add_argument('--max-queue', type=int, default=SERVE_MAX_QUEUE)
+    parser.add_argument('--max-tokens', type=int, default=SERVE_MAX_TOKENS)
+    parser.add_argument('--max-prompt-tokens', type=int, default=SERVE_MAX_PROMPT_TOKENS)
+    parser.add_argument('--no-prefix-cache', action='store_true')
+    parser.add_argument('--retrieval-k', type=int, default=0,
+                        help="add the top K matching events to each question (0 = off)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("SXODIM MODEL SERVER")
+    print("=" * 60)
+    server, base_url = start_server(args.model, args.host, args.port, args.max_batch, args.max_queue,
+                                    args.max_tokens, args.max_prompt_tokens, not args.no_prefix_cache,
+                                    args.retrieval_k)
+    print(f"Model: {args.model} on {server.engine.model.device}")
+    print(f"Max batch: {args.max_batch}, max queue: {args.max_queue}, max tokens: {args.max_tokens}")
+    print(f"Serving: {base_url}/chat/completions")
+    print(f"Metrics: {base_url[:-3]}/metrics")
+    print("=" * 60)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Local stand-ins for the remote services, used for offline benchmarks.
+
+Start everything with ``start_stub_server(...)``; it returns the server and
+its base URL. Routes:
+
+    /api/posts/in/almaty/tickets?page=N   sxodim listing API
+    /reader/<event url>                   Jina reader
+    /v1/chat/completions                  OpenAI-compatible chat endpoint
+
+Each request waits ``latency`` seconds (``chat_latency`` for the chat
+endpoint) and fails with a 503 at ``error_rate``. The server counts
+requests, errors, requests in flight (current and peak) and busy
+seconds, for load figures in the benchmarks.
+
+Listing events vary like the real ones: categories, free / fixed /
+"от" / range prices, one to three dates, content of different lengths,
+and every tenth event too short for local conversion, so it goes to the
+reader.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+LISTING_PATH = "/api/posts/in/almaty/tickets"
+READER_PATH = "/reader/"
+CHAT_PATH = "/v1/chat/completions"
+
+
+CATEGORIES = ('Концерты', 'Стендап', 'Спектакли', 'Выставки', 'Детям', 'Фестивали', 'Мастер-классы',
+              'Вечеринки', 'Спорт', 'Кино')
+FIRST_DAY = date(2025, 6, 1)
+
+
+def make_price(i):
+    price = 1000 + (i % 20) * 500
+    return ["Бесплатно", f"{price} тг", f"от {price} тг", f"{price} - {price * 2} тг"][i % 7 % 4]
+
+
+def make_content(i):
+    if i % 10 == 9:
+        return f"<p>Подробности о мероприятии #{i} скоро.</p>"
+    details = "<p>Программа, участники и всё, что нужно знать перед походом.</p>" * (1 + i % 4)
+    return (
+        f"<h2>О мероприятии</h2><p>Подробности о мероприятии <b>#{i}</b>.</p>{details}"
+        f"<ul><li>Начало в 19:00</li><li>Продолжительность 2 часа</li>"
+        f"<li>Возраст 16+</li></ul><p>Билеты можно купить онлайн или на входе.</p>"
+    )
+
+
+def make_event(i):
+    """Synthetic event shaped like a listing API record"""
+    first_day = FIRST_DAY + timedelta(days=i % 120)
+    return {
+        'id': 100000 + i,
+        'name': f"Тестовое мероприятие #{i}",
+        'slug': f"test-event-{i}",
+        'city': {'name': 'Алматы'},
+        'category': {'name': CATEGORIES[i % len(CATEGORIES)]},
+        'description': f"Описание мероприятия номер {i}",
+        'content': make_content(i),
+        'image': None,
+        'type': 'event',
+        'subtype': None,
+        'address': f"ул. Абая, {i % 200 + 1}",
+        'additional': {'ticket_price': make_price(i)},
+        'event_dates': [{'date': (first_day + timedelta(days=7 * n)).isoformat(), 'time': '19:00'}
+                        for n in range(1 + i % 3)],
+        'cardData': {
+            'url': f"https://sxodim.com/almaty/event/test-event-{i}",
+            'ticketUrl': None,
+            'views': i * 7,
+        },
+        'coordinates': None,
+    }
+
+
+def make_usage(prompt, content):
+    """Token counts at roughly four characters per token"""
+    return {
+        'prompt_tokens': len(prompt) // 4,
+        'completion_tokens': len(content) // 4,
+        'total_tokens': (len(prompt) + len(content)) // 4,
+    }
+
+
+def make_completion(prompt):
+    """Canned model reply: ORPO pairs or SFT QA pairs depending on the prompt.
+
+    Batched prompts get a JSON object keyed by the event ids they list.
+    """
+    if 'chosen' in prompt:
+        items = [{'prompt': f"Вопрос {i}?", 'chosen': f"Классно, советую! {i}", 'rejected': f"Информируем вас. {i}"} for i in range(5)]
+    else:
+        items = [{'question': f"Вопрос {i}?", 'answer': f"Ответ {i}."} for i in range(12)]
+    batch_ids = re.findall(r"=== Мероприятие id=(\S+) ===", prompt)
+    reply = {event_id: items for event_id in batch_ids} if batch_ids else items
+    return "```json\n" + json.dumps(reply, ensure_ascii=False) + "\n```"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def serve(self, route, latency):
+        """Count the request, wait, then fail at the error rate or route it"""
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        self.body = self.rfile.read(length) if length else b''
+        started = time.monotonic()
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+            failed = server.error_rate and server.random.random() < server.error_rate
+        try:
+            time.sleep(latency)
+            if failed:
+                with server.lock:
+                    server.errors += 1
+                self.send_body(503, 'service unavailable', 'text/plain')
+            else:
+                route()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+                server.busy_seconds += time.monotonic() - started
+
+    def do_GET(self):
+        self.serve(self.route_get, self.server.latency)
+
+    def do_POST(self):
+        server = self.server
+        self.serve(self.route_post, server.latency if server.chat_latency is None else server.chat_latency)
+
+    def route_get(self):
+        server = self.server
+        parsed = urlparse(self.path)
+
+        if parsed.path == LISTING_PATH:
+            page = int(parse_qs(parsed.query).get('page', ['1'])[0])
+            start = (page - 1) * server.per_page
+            events = [make_event(i) for i in range(start, min(start + server.per_page, server.total_events))]
+            body = json.dumps({
+                'data': events,
+                'meta': {
+                    'total': server.total_events,
+                    'last_page': max(1, math.ceil(server.total_events / server.per_page)),
+                    'current_page': page,
+                },
+            }, ensure_ascii=False)
+            self.send_body(200, body, 'application/json')
+        elif parsed.path.startswith(READER_PATH):
+            url = self.path[len(READER_PATH):]
+            self.send_body(200, f"Title: stub\n\nURL Source: {url}\n\nMarkdown Content:\nСодержимое страницы {url}\n", 'text/plain; charset=utf-8')
+        else:
+            self.send_body(404, 'not found', 'text/plain')
+
+    def route_post(self):
+        server = self.server
+        request = json.loads(self.body or b'{}')
+
+        if urlparse(self.path).path != CHAT_PATH:
+            self.send_body(404, 'not found', 'text/plain')
+            return
+
+        with server.lock:
+            server.chat_requests += 1
+            server.prompt_chars += len(request['messages'][-1]['content'])
+
+        prompt = request['messages'][-1]['content']
+        content = make_completion(prompt)
+        if server.truncate_replies:
+            content = content[:len(content) * 2 // 3]
+
+        if request.get('stream'):
+            self.send_stream(request, content)
+            return
+
+        body = json.dumps({
+            'id': f"stub-{server.chat_requests}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': make_usage(prompt, content),
+        }, ensure_ascii=False)
+        self.send_body(200, body, 'application/json')
+
+    def send_stream(self, request, content, chunk_size=40):
+        """Server-sent events in the OpenAI streaming format"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for i in range(0, len(content), chunk_size):
+            chunk = {
+                'id': 'stub-stream',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': request.get('model', 'stub'),
+                'choices': [{'index': 0, 'delta': {'content': content[i:i + chunk_size]}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+        if (request.get('stream_options') or {}).get('include_usage'):
+            chunk = {
+                'id': 'stub-stream',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': request.get('model', 'stub'),
+                'choices': [],
+                'usage': make_usage(request['messages'][-1]['content'], content),
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Many clients connect at once under load
+
+
+def reset_counters(server):
+    with server.lock:
+        server.requests = 0
+        server.errors = 0
+        server.in_flight = 0
+        server.peak_in_flight = 0
+        server.busy_seconds = 0.0
+        server.chat_requests = 0
+        server.prompt_chars = 0
+
+
+def start_stub_server(total_events=100, per_page=15, latency=0.05, handler=StubHandler, error_rate=0.0,
+                      chat_latency=None, seed=0):
+    """Run the stub in a background thread; returns (server, base_url)"""
+    server = StubServer(('127.0.0.1', 0), handler)
+    server.total_events = total_events
+    server.per_page = per_page
+    server.latency = latency
+    server.chat_latency = chat_latency
+    server.error_rate = error_rate
+    server.random = random.Random(seed)
+    server.truncate_replies = False
+    server.lock = threading.Lock()
+    reset_counters(server)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"